@@ -1,19 +1,31 @@
+import atexit
+import json
 import logging
 import os
 import pickle
+import shutil
+import sys
+import tempfile
+from functools import lru_cache
 from glob import glob
+from math import gcd
+from multiprocessing import Pool
 import time
-import librosa
 import numpy as np
-from tqdm import tqdm
 
-from utils import parallel_function
+import instrumentation
+from vad import VOICED_SEGMENTS, voiced_segments
 
 logger = logging.getLogger(__name__)
 
 SENTENCE_ID = 'sentence_id'
 SPEAKER_ID = 'speaker_id'
 FILENAME = 'filename'
+CACHE_BACKENDS = ['pkl', 'mmap']
+MANIFEST_FILENAME = 'manifest.jsonl'
+FILE_INDEX_FILENAME = 'audio_cache_index.json'  # in cache_dir, next to audio_cache_pkl (see build_file_index).
+FILE_INDEX_VERSION = 1
+RESAMPLE_MODES = ['librosa', 'polyphase']
 new_path = "samples/"
 
 def find_files(directory, pattern='**/*.wav'):
@@ -23,19 +35,51 @@ def find_files(directory, pattern='**/*.wav'):
     return sorted(glob(directory + pattern, recursive=True))
 
 
-def read_audio_from_filename(filename, sample_rate):
-    #读取音频，mono设置为True表示使用单通道，输出的另一个是采样率，这里不需要
-    audio, _ = librosa.load(filename, sr=sample_rate, mono=True)
+def read_audio_from_filename(filename, sample_rate, resample_mode='librosa'):
+    if resample_mode == 'polyphase':
+        audio = read_audio_polyphase(filename, sample_rate)
+    else:
+        import librosa  # only imported by the code paths that decode with it: importing it takes seconds.
+        #读取音频，mono设置为True表示使用单通道，输出的另一个是采样率，这里不需要
+        audio, _ = librosa.load(filename, sr=sample_rate, mono=True)
     #读取出来的ndarray格式为(x,)，将其reshape之后格式为(x,1)
     audio = audio.reshape(-1, 1)
     return audio, filename
 
 
+def read_audio_polyphase(filename, sample_rate):
+    """Decodes with soundfile and resamples with scipy's polyphase filter (48k -> 8k is a 1/6 ratio)."""
+    from scipy.signal import resample_poly
+    try:
+        import soundfile
+        audio, orig_sr = soundfile.read(filename, dtype='float32', always_2d=True)
+        audio = np.mean(audio, axis=1)
+    except (ImportError, RuntimeError):  # soundfile missing or format not supported by libsndfile.
+        import librosa
+        audio, orig_sr = librosa.load(filename, sr=None, mono=True)
+    if orig_sr == sample_rate:
+        return audio.astype(np.float32)
+    up, down = sample_rate, int(orig_sr)
+    g = gcd(up, down)
+    up, down = up // g, down // g
+    audio = resample_poly(audio, up, down, window=polyphase_filter(up, down))
+    return audio.astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(up, down):
+    # same low-pass as the default of resample_poly, designed once per ratio instead of once per file.
+    from scipy.signal import firwin
+    max_rate = max(up, down)
+    return firwin(2 * 10 * max_rate + 1, 1. / max_rate, window=('kaiser', 5.0))
+
+
 def trim_silence(audio, threshold):
     """Removes silence at the beginning and end of a sample."""
-    energy = librosa.feature.rmse(audio)
-    frames = np.nonzero(np.array(energy > threshold))
-    indices = librosa.core.frames_to_samples(frames)[1]
+    from vad import frame_rms
+    # same frames as the former librosa.feature.rmse (2048 samples every 512), without the centering.
+    energy = frame_rms(audio, frame_length=2048, hop_length=512)
+    indices = np.nonzero(energy > threshold)[0] * 512
 
     # Note: indices can be an empty array, if the whole audio was silence.
     audio_trim = audio[0:0]
@@ -48,6 +92,13 @@ def trim_silence(audio, threshold):
     return audio_trim, left_blank, right_blank
 
 
+def with_voice_only(obj):
+    """pkl files dumped with the VAD store the voiced offsets instead of a copy: audio_voice_only becomes a view."""
+    if 'audio_voice_only' not in obj:
+        obj['audio_voice_only'] = obj['audio'][obj['voice_start']:obj['voice_end']]
+    return obj
+
+
 def extract_speaker_id(filename):
     """找到这句话的说话人"""
     return filename.split('/')[-2]
@@ -61,29 +112,88 @@ class AudioReader:
     def __init__(self, input_audio_dir,
                  output_cache_dir,
                  sample_rate,
-                 multi_threading=False):
+                 multi_threading=False,
+                 cache_backend='pkl',
+                 num_workers=None,
+                 resample_mode='librosa'):
+        assert cache_backend in CACHE_BACKENDS, 'cache_backend should be one of {}.'.format(CACHE_BACKENDS)
+        assert resample_mode in RESAMPLE_MODES, 'resample_mode should be one of {}.'.format(RESAMPLE_MODES)
         self.audio_dir = input_audio_dir
         self.cache_dir = output_cache_dir
         self.sample_rate = sample_rate
         self.multi_threading = multi_threading
+        self.num_workers = num_workers
+        self.resample_mode = resample_mode
+        self.cache_backend = cache_backend
         self.cache_pkl_dir = os.path.join(self.cache_dir, 'audio_cache_pkl')
-        self.pkl_filenames = find_files(self.cache_pkl_dir, pattern='/**/*.pkl')##pkl_filenames保存的是所有说话人说的所有句子的文件
+        self.audio_store_dir = os.path.join(self.cache_dir, 'audio_store')
 
         logger.info('audio_dir = {}'.format(self.audio_dir))
         logger.info('cache_dir = {}'.format(self.cache_dir))
         logger.info('sample_rate = {}'.format(sample_rate))
+        logger.info('cache_backend = {}'.format(cache_backend))
+        logger.info('resample_mode = {}'.format(resample_mode))
+
+        self.audio_store = None
+        self.shared_store_dir = None  # written by share_cache().
+        self.shared_speaker_ids = None
+        self._shared_store_owner = None
+        self.file_index_filename = os.path.join(self.cache_dir, FILE_INDEX_FILENAME)
+        self._files = None  # pkl_filenames, speaker_ids_to_filename and all_speaker_ids, loaded on first use.
+        if self.cache_backend == 'mmap':
+            # speakers and filenames come from the store index, no pkl file is listed nor opened.
+            from audio_store import AudioStore
+            self.audio_store = AudioStore(self.audio_store_dir)
+            self._files = {'pkl_filenames': [],
+                           'speaker_ids_to_filename': {s: self.audio_store.filenames(s)
+                                                       for s in self.audio_store.all_speaker_ids},
+                           'all_speaker_ids': self.audio_store.all_speaker_ids}
+
+    @property
+    def pkl_filenames(self):
+        """pkl_filenames保存的是所有说话人说的所有句子的文件"""
+        files = self._load_files()
+        if files['pkl_filenames'] is None:
+            files['pkl_filenames'] = sorted([f for fs in files['speaker_ids_to_filename'].values() for f in fs])
+        return files['pkl_filenames']
 
-        speakers = set()
-        self.speaker_ids_to_filename = {}   ###保存的格式是字典，{speaker_id:[这个人说的句子]}，所有人所有句子
-        for pkl_filename in self.pkl_filenames:
-            speaker_id = os.path.basename(pkl_filename).split('_')[0]
-            if speaker_id not in self.speaker_ids_to_filename:
-                self.speaker_ids_to_filename[speaker_id] = []
-            self.speaker_ids_to_filename[speaker_id].append(pkl_filename)
-            speakers.add(speaker_id)
-        self.all_speaker_ids = sorted(speakers)    ####保存了所有说话人，字典sorted之后是列表，保存了所有说话人的id
+    @property
+    def speaker_ids_to_filename(self):
+        """保存的格式是字典，{speaker_id:[这个人说的句子]}，所有人所有句子"""
+        return self._load_files()['speaker_ids_to_filename']
+
+    @property
+    def all_speaker_ids(self):
+        """保存了所有说话人，字典sorted之后是列表，保存了所有说话人的id"""
+        return self._load_files()['all_speaker_ids']
+
+    def _load_files(self):
+        """From the persisted file index if audio_cache_pkl was not modified since it was written. Otherwise the pkl
+        files are listed (and the index written again)."""
+        if self._files is not None:
+            return self._files
+        index = load_file_index(self.file_index_filename, self.cache_pkl_dir)
+        if index is None:
+            index = build_file_index(self.cache_pkl_dir, self.sample_rate)
+            if os.path.isdir(self.cache_pkl_dir):
+                try:
+                    write_file_index(self.file_index_filename, index)
+                except OSError as e:  # read-only cache: the index is only kept in memory.
+                    logger.warning('Could not write {}: {}.'.format(self.file_index_filename, e))
+        speaker_ids_to_filename = {s: [os.path.join(self.cache_pkl_dir, f) for f in entry['files']]
+                                   for (s, entry) in index['speakers'].items()}
+        self._files = {'pkl_filenames': None,
+                       'speaker_ids_to_filename': speaker_ids_to_filename,
+                       'all_speaker_ids': sorted(speaker_ids_to_filename)}
+        return self._files
 
     def load_cache(self, speakers_sub_list=None):
+        with instrumentation.timer('audio.load_cache'):
+            return self._load_cache(speakers_sub_list)
+
+    def _load_cache(self, speakers_sub_list=None):
+        if self.audio_store is not None and self._in_store(speakers_sub_list):
+            return self.audio_store.load_cache(speakers_sub_list)
         cache = {}
         metadata = {}
 
@@ -100,7 +210,7 @@ class AudioReader:
             with open(pkl_file, 'rb') as f:
                 obj = pickle.load(f)
                 if FILENAME in obj:
-                    cache[obj[FILENAME]] = obj
+                    cache[obj[FILENAME]] = with_voice_only(obj)
         #metadata是字典，字典的每一个元素key是speaker_id，values还是一个字典，字典的key是sentence_id
         for filename in sorted(cache):
             speaker_id = extract_speaker_id(filename)
@@ -117,79 +227,297 @@ class AudioReader:
         # cache # big cache <filename, data:audio librosa, blanks.>
         return cache, metadata
 
+    def _in_store(self, speakers_sub_list):
+        if self.shared_speaker_ids is None:  # the store has all the speakers.
+            return True
+        if speakers_sub_list is None:
+            return False
+        return all([s in self.shared_speaker_ids for s in speakers_sub_list])
+
+    def share_cache(self, speakers_sub_list=None):
+        """Decodes the pkl files of the speakers once into a temporary memory-mapped audio store, read by load_cache()
+        from then on.
+
+        Worker processes then slice the same pages instead of each unpickling its own copy of the audio, and the
+        reader is pickled without the audio (AudioStore is pickled as its directory). The store is removed by
+        close_shared_cache(), or at exit. Nothing to do with cache_backend='mmap'.
+        """
+        if self.audio_store is not None:
+            return self
+        from audio_store import AudioStore, write_shared_store
+        if speakers_sub_list is None:
+            filenames = self.pkl_filenames
+        else:
+            filenames = [f for speaker_id in speakers_sub_list for f in self.speaker_ids_to_filename[speaker_id]]
+        start = time.time()
+        with instrumentation.timer('audio.share_cache'):
+            self.shared_store_dir = write_shared_store(filenames, self.sample_rate)
+        self._shared_store_owner = os.getpid()
+        atexit.register(self.close_shared_cache)
+        self.audio_store = AudioStore(self.shared_store_dir)
+        self.shared_speaker_ids = None if speakers_sub_list is None else set(speakers_sub_list)
+        logger.info('[SHARE AUDIO CACHE] {} files in {} ({:.1f}s).'.format(len(filenames), self.shared_store_dir,
+                                                                           time.time() - start))
+        return self
+
+    def close_shared_cache(self):
+        """Removes the store of share_cache() (in the process that wrote it only) and reads the pkl files again."""
+        if self.shared_store_dir is None:
+            return
+        if os.getpid() == self._shared_store_owner:
+            shutil.rmtree(self.shared_store_dir, ignore_errors=True)
+        self.audio_store = None
+        self.shared_store_dir = None
+        self.shared_speaker_ids = None
+
     def build_cache(self):
         #将所有的音频写入pkl文件
-        if not os.path.exists(self.cache_pkl_dir):
-            os.makedirs(self.cache_pkl_dir)
-        logger.info('Nothing found at {}. Generating all the cache now.'.format(self.cache_pkl_dir))
         logger.info('Looking for the audio dataset in {}.'.format(self.audio_dir))
-        audio_files = find_files(self.audio_dir)  #找到所有音频文件，以列表的形式存储
-        audio_files_count = len(audio_files)
-        assert audio_files_count != 0, '请输入正确的路径以及glob通配符查找音频文件'
-        logger.info('Found {} files in total in {}.'.format(audio_files_count, self.audio_dir))
-        #assert len(audio_files) != 0
-
-        if self.multi_threading:
-            num_threads = os.cpu_count()
-            print("共有 {} CPU可用".format(num_threads))
-            time.sleep(5)
-            parallel_function(self.dump_audio_to_pkl_cache, audio_files, num_threads)
-        else:
-            bar = tqdm(audio_files)
-            for filename in bar:
-                bar.set_description(filename)
-                self.dump_audio_to_pkl_cache(filename)
-            bar.close()
+        return self.dump_audio_files_to_pkl_cache(find_files(self.audio_dir))  #找到所有音频文件，以列表的形式存储
+
+    def migrate_cache_to_store(self):
+        """Converts audio_cache_pkl into the memory-mapped store used by cache_backend='mmap'."""
+        from audio_store import migrate_pkl_cache
+        store = migrate_pkl_cache(self.cache_pkl_dir, self.audio_store_dir, self.sample_rate)
+        logger.info('Migrated {} utterances to {}.'.format(len(store), self.audio_store_dir))
+        return store
 
     def build_new_cache(self):
         #将所有的音频写入pkl文件
+        logger.info('Looking for the audio dataset in {}.'.format(new_path))
+        return self.dump_audio_files_to_pkl_cache(find_files(new_path))
+
+    def dump_audio_files_to_pkl_cache(self, audio_files):
+        """Dumps every audio file not already listed in the manifest. Returns the throughput summary."""
         if not os.path.exists(self.cache_pkl_dir):
             os.makedirs(self.cache_pkl_dir)
-        logger.info('Nothing found at {}. Generating all the cache now.'.format(self.cache_pkl_dir))
-        logger.info('Looking for the audio dataset in {}.'.format(new_path))
-        audio_files = find_files(new_path)  #找到所有音频文件，以列表的形式存储
         audio_files_count = len(audio_files)
         assert audio_files_count != 0, '请输入正确的路径以及glob通配符查找音频文件'
-        logger.info('Found {} files in total in {}.'.format(audio_files_count, self.audio_dir))
-        #assert len(audio_files) != 0
-
-        if self.multi_threading:
-            num_threads = os.cpu_count()
-            print("共有 {} CPU可用".format(num_threads))
-            time.sleep(5)
-            parallel_function(self.dump_audio_to_pkl_cache, audio_files, num_threads)
+        logger.info('Found {} files in total.'.format(audio_files_count))
+
+        # a re-run only compares the mtime/size of the audio files with the manifest, the pkl files are not listed.
+        manifest = CacheManifest(os.path.join(self.cache_pkl_dir, MANIFEST_FILENAME))
+        signatures = {f: CacheManifest.signature(f) for f in audio_files}
+        todo = [f for f in audio_files if not manifest.is_done(f, signatures[f])]
+        logger.info('{} files already in the cache. {} files to dump.'.format(audio_files_count - len(todo), len(todo)))
+
+        start = time.time()
+        num_dumped, num_samples = 0, 0
+        from tqdm import tqdm
+        bar = tqdm(total=len(todo))
+        if self.multi_threading and len(todo) > 0:
+            num_workers = self.num_workers or os.cpu_count()
+            logger.info('Using {} workers.'.format(num_workers))
+            chunk_size = max(1, min(64, len(todo) // (4 * num_workers)))
+            pool = Pool(processes=num_workers, initializer=init_dump_worker,
+                        initargs=(self.cache_pkl_dir, self.sample_rate, self.resample_mode))
+            results = pool.imap_unordered(dump_worker, todo, chunksize=chunk_size)
         else:
-            bar = tqdm(audio_files)
-            for filename in bar:
-                bar.set_description(filename)
-                self.dump_audio_to_pkl_cache(filename)
+            if len(todo) > 0:
+                init_dump_worker(self.cache_pkl_dir, self.sample_rate, self.resample_mode)
+            pool = None
+            results = map(dump_worker, todo)
+        try:
+            for input_filename, pkl_filename, samples, worker_stats in results:
+                bar.update(1)
+                instrumentation.merge(worker_stats)
+                if pkl_filename is None:
+                    continue
+                manifest.add(input_filename, signatures[input_filename], pkl_filename, samples)
+                num_dumped += 1
+                num_samples += samples
+        finally:
             bar.close()
+            manifest.close()
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if len(todo) > 0 or load_file_index(self.file_index_filename, self.cache_pkl_dir) is None:
+            write_file_index(self.file_index_filename, build_file_index(self.cache_pkl_dir, self.sample_rate))
+            self._files = None
+
+        elapsed = max(time.time() - start, 1e-9)
+        summary = {'files': len(todo), 'dumped': num_dumped, 'skipped': audio_files_count - len(todo),
+                   'seconds': elapsed, 'files_per_sec': len(todo) / elapsed,
+                   'audio_seconds_per_sec': num_samples / self.sample_rate / elapsed}
+        logger.info('Dumped {dumped}/{files} files in {seconds:.1f}s: {files_per_sec:.1f} files/s, '
+                    '{audio_seconds_per_sec:.1f} audio seconds/s.'.format(**summary))
+        return summary
 
     def dump_audio_to_pkl_cache(self, input_filename):
-        try:
-            cache_filename = input_filename.split('/')[-1].split('.')[0] + '_cache'
-            pkl_filename = os.path.join(self.cache_pkl_dir, cache_filename) + '.pkl'
-
-            if os.path.isfile(pkl_filename):
-                logger.info('[FILE ALREADY EXISTS] {}'.format(pkl_filename))
-                return
-
-            audio, _ = read_audio_from_filename(input_filename, self.sample_rate)  ##格式是ndarray，shape是(x,1)
-            energy = np.abs(audio[:, 0])   ##对其中的每一个数取绝对值
-            silence_threshold = np.percentile(energy, 95)   ###取95%分位数，也就是第0.95大的数
-            offsets = np.where(energy > silence_threshold)[0]
-            left_blank_duration_ms = (1000.0 * offsets[0]) // self.sample_rate  # frame_id to duration (ms)
-            right_blank_duration_ms = (1000.0 * (len(audio) - offsets[-1])) // self.sample_rate
-
-            obj = {'audio': audio,
-                   'audio_voice_only': audio[offsets[0]:offsets[-1]],
-                   'left_blank_duration_ms': left_blank_duration_ms,
-                   'right_blank_duration_ms': right_blank_duration_ms,
-                   FILENAME: input_filename}
-
-            with open(pkl_filename, 'wb') as f:
-                pickle.dump(obj, f)                ###把对象obj保存到文件中去
-                logger.info('[DUMP AUDIO] {}'.format(pkl_filename))
-        except librosa.util.exceptions.ParameterError as e:
-            logger.error(e)
-            logger.error('[DUMP AUDIO ERROR SKIPPING FILENAME] {}'.format(input_filename))
+        return dump_audio_to_pkl(input_filename, self.cache_pkl_dir, self.sample_rate, self.resample_mode)
+
+
+def dump_audio_to_pkl(input_filename, cache_pkl_dir, sample_rate, resample_mode='librosa'):
+    """Returns (input_filename, pkl_filename, number of samples). pkl_filename is None if nothing was dumped."""
+    try:
+        cache_filename = input_filename.split('/')[-1].split('.')[0] + '_cache'
+        pkl_filename = os.path.join(cache_pkl_dir, cache_filename) + '.pkl'
+
+        if os.path.isfile(pkl_filename):
+            logger.debug('[FILE ALREADY EXISTS] {}'.format(pkl_filename))
+            return input_filename, pkl_filename, 0
+
+        with instrumentation.timer('audio.read'):
+            audio, _ = read_audio_from_filename(input_filename, sample_rate, resample_mode)  ##格式是ndarray，shape是(x,1)
+        if instrumentation.enabled():
+            instrumentation.count('audio.bytes_read', os.path.getsize(input_filename))
+            instrumentation.count('audio.samples', len(audio))
+        # 按帧计算能量（VAD），只保存有声音的片段的起止位置，不再另外复制一份audio_voice_only
+        with instrumentation.timer('audio.vad'):
+            segments = voiced_segments(audio, sample_rate)
+        voice_start, voice_end = (segments[0, 0], segments[-1, 1]) if len(segments) > 0 else (0, 0)
+        left_blank_duration_ms = (1000.0 * voice_start) // sample_rate  # frame_id to duration (ms)
+        right_blank_duration_ms = (1000.0 * (len(audio) - voice_end)) // sample_rate
+
+        obj = {'audio': audio,
+               'voice_start': int(voice_start),
+               'voice_end': int(voice_end),
+               VOICED_SEGMENTS: segments,
+               'left_blank_duration_ms': left_blank_duration_ms,
+               'right_blank_duration_ms': right_blank_duration_ms,
+               FILENAME: input_filename}
+
+        with instrumentation.timer('audio.write_pkl'), open(pkl_filename, 'wb') as f:
+            pickle.dump(obj, f)                ###把对象obj保存到文件中去
+        # one line per file costs more than the dump itself on VCTK (44k files): the summary is logged at the end.
+        logger.debug('[DUMP AUDIO] {}'.format(pkl_filename))
+        instrumentation.count('audio.files_dumped')
+        return input_filename, pkl_filename, len(audio)
+    except Exception as e:
+        if not _is_librosa_parameter_error(e):
+            raise
+        logger.error(e)
+        logger.error('[DUMP AUDIO ERROR SKIPPING FILENAME] {}'.format(input_filename))
+        return input_filename, None, 0
+
+
+def _is_librosa_parameter_error(e):
+    # librosa can only have raised it if it was imported.
+    return 'librosa' in sys.modules and isinstance(e, sys.modules['librosa'].util.exceptions.ParameterError)
+
+
+_dump_worker_args = {}
+
+
+def init_dump_worker(cache_pkl_dir, sample_rate, resample_mode='librosa'):
+    """Runs once per worker. Only the filenames are sent to the workers afterwards, not the AudioReader."""
+    _dump_worker_args['cache_pkl_dir'] = cache_pkl_dir
+    _dump_worker_args['sample_rate'] = sample_rate
+    _dump_worker_args['resample_mode'] = resample_mode
+    instrumentation.init_worker()
+    # filters and librosa submodules are loaded lazily: pay for it here and not on the first file (VCTK is 48kHz).
+    if resample_mode == 'polyphase':
+        g = gcd(sample_rate, 48000)
+        polyphase_filter(sample_rate // g, 48000 // g)
+    else:
+        import librosa
+        librosa.resample(np.zeros(4800, dtype=np.float32), orig_sr=48000, target_sr=sample_rate)
+
+
+def dump_worker(input_filename):
+    """dump_audio_to_pkl, plus the timers and counters of the worker (instrumentation.drain())."""
+    return dump_audio_to_pkl(input_filename, _dump_worker_args['cache_pkl_dir'], _dump_worker_args['sample_rate'],
+                             _dump_worker_args['resample_mode']) + (instrumentation.drain(),)
+
+
+class CacheManifest:
+    """Append-only list of the audio files already dumped, with the mtime/size they had at that time."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.done = {}
+        if os.path.isfile(self.filename):
+            with open(self.filename) as r:
+                for line in r:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # last line of an interrupted run.
+                        continue
+                    self.done[entry['audio']] = entry['signature']
+        self.file = open(self.filename, 'a')
+
+    @staticmethod
+    def signature(audio_filename):
+        st = os.stat(audio_filename)
+        return '{}:{}'.format(st.st_mtime_ns, st.st_size)
+
+    def is_done(self, audio_filename, signature):
+        return self.done.get(audio_filename) == signature
+
+    def add(self, audio_filename, signature, pkl_filename, samples=None):
+        self.done[audio_filename] = signature
+        entry = {'audio': audio_filename, 'signature': signature, 'pkl': pkl_filename}
+        if samples:  # 0 when the pkl file was already there.
+            entry['samples'] = int(samples)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def num_samples(filename):
+        """{pkl basename: number of samples} of the entries of the manifest that have it."""
+        num_samples = {}
+        if os.path.isfile(filename):
+            with open(filename) as r:
+                for line in r:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'samples' in entry:
+                        num_samples[os.path.basename(entry['pkl'])] = entry['samples']
+        return num_samples
+
+
+def build_file_index(cache_pkl_dir, sample_rate):
+    """Lists the pkl files of the cache, grouped by speaker, with their sentence ids, byte sizes and number of samples
+    (-1 if the manifest does not have it; duration = num_samples / sample_rate).
+
+    The index is valid as long as the mtime of audio_cache_pkl does not change: adding, removing or renaming a pkl
+    file in it updates that mtime (files in its sub-directories are not tracked).
+    """
+    dir_mtime_ns = os.stat(cache_pkl_dir).st_mtime_ns if os.path.isdir(cache_pkl_dir) else 0
+    num_samples = CacheManifest.num_samples(os.path.join(cache_pkl_dir, MANIFEST_FILENAME))
+    speakers = {}
+    for pkl_filename in find_files(cache_pkl_dir, pattern='/**/*.pkl'):
+        relative = os.path.relpath(pkl_filename, cache_pkl_dir)
+        basename = os.path.basename(pkl_filename)
+        entry = speakers.setdefault(basename.split('_')[0], {'files': [], 'sentence_ids': [], 'num_samples': [],
+                                                             'num_bytes': []})
+        entry['files'].append(relative)
+        entry['sentence_ids'].append(extract_sentence_id(basename))
+        entry['num_samples'].append(num_samples.get(basename, -1))
+        entry['num_bytes'].append(os.path.getsize(pkl_filename))
+    return {'version': FILE_INDEX_VERSION, 'dir_mtime_ns': dir_mtime_ns, 'sample_rate': sample_rate,
+            'speakers': speakers}
+
+
+def write_file_index(filename, index):
+    # one temporary file per writer: several processes can rebuild the index at the same time.
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as w:
+            json.dump(index, w)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
+def load_file_index(filename, cache_pkl_dir):
+    """The index written by build_file_index, None if there is none or if it is stale."""
+    if not os.path.isfile(filename) or not os.path.isdir(cache_pkl_dir):
+        return None
+    try:
+        with open(filename) as r:
+            index = json.load(r)
+    except ValueError:
+        return None
+    if index.get('version') != FILE_INDEX_VERSION or index['dir_mtime_ns'] != os.stat(cache_pkl_dir).st_mtime_ns:
+        return None
+    return index
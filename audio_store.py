@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_DTYPE = np.float32
+INDEX_FILENAME = 'index.npz'
+INFO_FILENAME = 'info.json'
+MAX_SHARD_SAMPLES = 2 ** 28  # 1GB of float32 per shard.
+SHARED_MEMORY_DIR = '/dev/shm'  # tmpfs: files there are in RAM, and every process mapping them shares the pages.
+
+
+def shard_filename(store_dir, shard_id):
+    return os.path.join(store_dir, 'shard_{:05d}.f32'.format(shard_id))
+
+
+class AudioStoreWriter:
+    """Appends utterances to contiguous float32 shards and writes the index on close().
+
+    The voice-only region is stored as an offset pair into the utterance instead of a second copy of the samples.
+    """
+
+    def __init__(self, store_dir, sample_rate, max_shard_samples=MAX_SHARD_SAMPLES):
+        self.store_dir = store_dir
+        self.sample_rate = sample_rate
+        self.max_shard_samples = max_shard_samples
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        self.shard_id = -1
+        self.shard_file = None
+        self.shard_samples = 0
+        self.rows = {'filename': [], 'speaker_id': [], 'sentence_id': [], 'shard': [], 'offset': [], 'length': [],
+                     'voice_start': [], 'voice_end': [], 'left_blank_duration_ms': [],
+                     'right_blank_duration_ms': [], 'num_segments': []}
+        self.segments = []
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard_id += 1
+        self.shard_samples = 0
+        self.shard_file = open(shard_filename(self.store_dir, self.shard_id), 'wb')
+
+    def append(self, filename, audio, voice_start, voice_end, left_blank_duration_ms, right_blank_duration_ms,
+               voiced_segments=None):
+        """voiced_segments are the [start, end) offsets of the VAD, one segment [voice_start, voice_end) if None."""
+        from audio_reader import extract_speaker_id, extract_sentence_id
+        audio = np.ascontiguousarray(audio, dtype=SAMPLES_DTYPE).reshape(-1)
+        if self.shard_file is None or self.shard_samples + len(audio) > self.max_shard_samples:
+            self._next_shard()
+        self.shard_file.write(audio.tobytes())
+        self.rows['filename'].append(filename)
+        self.rows['speaker_id'].append(extract_speaker_id(filename))
+        self.rows['sentence_id'].append(extract_sentence_id(filename))
+        self.rows['shard'].append(self.shard_id)
+        self.rows['offset'].append(self.shard_samples)
+        self.rows['length'].append(len(audio))
+        self.rows['voice_start'].append(voice_start)
+        self.rows['voice_end'].append(voice_end)
+        self.rows['left_blank_duration_ms'].append(left_blank_duration_ms)
+        self.rows['right_blank_duration_ms'].append(right_blank_duration_ms)
+        if voiced_segments is None:
+            voiced_segments = [[voice_start, voice_end]] if voice_end > voice_start else []
+        voiced_segments = np.asarray(voiced_segments, dtype=np.int64).reshape(-1, 2)
+        self.rows['num_segments'].append(len(voiced_segments))
+        self.segments.append(voiced_segments)
+        self.shard_samples += len(audio)
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        index = {k: np.array(v) for (k, v) in self.rows.items()}
+        for k in ['shard', 'offset', 'length', 'voice_start', 'voice_end', 'num_segments']:
+            index[k] = index[k].astype(np.int64)
+        # the segments of row i are voiced_segments[segments_offset[i]:segments_offset[i + 1]].
+        index['voiced_segments'] = np.concatenate(self.segments) if len(self.segments) > 0 \
+            else np.zeros((0, 2), dtype=np.int64)
+        index['segments_offset'] = np.concatenate([[0], np.cumsum(index.pop('num_segments'))]).astype(np.int64)
+        np.savez(os.path.join(self.store_dir, INDEX_FILENAME), **index)
+        with open(os.path.join(self.store_dir, INFO_FILENAME), 'w') as w:
+            json.dump({'sample_rate': self.sample_rate, 'num_shards': self.shard_id + 1,
+                       'num_utterances': len(self.rows['filename']), 'dtype': np.dtype(SAMPLES_DTYPE).name}, w)
+        logger.info('[DUMP AUDIO STORE] {} utterances in {} shards at {}.'.format(len(self.rows['filename']),
+                                                                                 self.shard_id + 1,
+                                                                                 self.store_dir))
+
+
+class AudioStore:
+    """Read side of the store. Every audio returned by load_cache() is a view of a memory-mapped shard."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(self.store_dir, INFO_FILENAME)) as r:
+            self.info = json.load(r)
+        with np.load(os.path.join(self.store_dir, INDEX_FILENAME)) as index:
+            self.index = {k: index[k] for k in index.files}
+        self.shards = [np.memmap(shard_filename(self.store_dir, i), dtype=SAMPLES_DTYPE, mode='r')
+                       if os.path.getsize(shard_filename(self.store_dir, i)) > 0
+                       else np.zeros(0, dtype=SAMPLES_DTYPE)
+                       for i in range(self.info['num_shards'])]
+        self.speaker_ids_to_rows = {}
+        for row, speaker_id in enumerate(self.index['speaker_id']):
+            self.speaker_ids_to_rows.setdefault(str(speaker_id), []).append(row)
+        self.all_speaker_ids = sorted(self.speaker_ids_to_rows)
+
+    def __getstate__(self):
+        # pickled as its directory: a worker process maps the shards again instead of receiving a copy of the audio.
+        return {'store_dir': self.store_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['store_dir'])
+
+    def __len__(self):
+        return len(self.index['filename'])
+
+    def filenames(self, speaker_id):
+        return [str(self.index['filename'][row]) for row in self.speaker_ids_to_rows[speaker_id]]
+
+    def audio(self, row):
+        offset = self.index['offset'][row]
+        return self.shards[self.index['shard'][row]][offset:offset + self.index['length'][row]]
+
+    def voiced_segments(self, row):
+        if 'segments_offset' not in self.index:  # store written before the VAD.
+            return np.array([[self.index['voice_start'][row], self.index['voice_end'][row]]], dtype=np.int64)
+        offsets = self.index['segments_offset']
+        return self.index['voiced_segments'][offsets[row]:offsets[row + 1]]
+
+    def entity(self, row):
+        audio = self.audio(row).reshape(-1, 1)
+        return {'audio': audio,
+                'voiced_segments': self.voiced_segments(row),
+                'audio_voice_only': audio[self.index['voice_start'][row]:self.index['voice_end'][row]],
+                'left_blank_duration_ms': float(self.index['left_blank_duration_ms'][row]),
+                'right_blank_duration_ms': float(self.index['right_blank_duration_ms'][row]),
+                'filename': str(self.index['filename'][row])}
+
+    def load_cache(self, speakers_sub_list=None):
+        """Same output as AudioReader.load_cache(), without reading any sample from disk."""
+        from audio_reader import SPEAKER_ID, SENTENCE_ID, FILENAME
+        if speakers_sub_list is None:
+            rows = range(len(self))
+        else:
+            rows = [row for speaker_id in speakers_sub_list for row in self.speaker_ids_to_rows[speaker_id]]
+        cache = {}
+        metadata = {}
+        for row in rows:
+            entity = self.entity(row)
+            cache[entity[FILENAME]] = entity
+        for row in sorted(rows, key=lambda r: self.index['filename'][r]):
+            speaker_id = str(self.index['speaker_id'][row])
+            sentence_id = str(self.index['sentence_id'][row])
+            metadata.setdefault(speaker_id, {})[sentence_id] = {SPEAKER_ID: speaker_id,
+                                                                SENTENCE_ID: sentence_id,
+                                                                FILENAME: str(self.index['filename'][row])}
+        return cache, metadata
+
+
+def migrate_pkl_cache(cache_pkl_dir, store_dir, sample_rate, max_shard_samples=MAX_SHARD_SAMPLES):
+    """Converts an existing audio_cache_pkl directory into an audio store. The pkl files are left untouched."""
+    from audio_reader import find_files
+    pkl_filenames = find_files(cache_pkl_dir, pattern='/**/*.pkl')
+    assert len(pkl_filenames) != 0, 'No pkl file found in {}.'.format(cache_pkl_dir)
+    writer = AudioStoreWriter(store_dir, sample_rate, max_shard_samples=max_shard_samples)
+    for pkl_filename in pkl_filenames:
+        _append_pkl(writer, pkl_filename, sample_rate)
+    writer.close()
+    return AudioStore(store_dir)
+
+
+def _append_pkl(writer, pkl_filename, sample_rate):
+    with open(pkl_filename, 'rb') as f:
+        obj = pickle.load(f)
+    audio = obj['audio']
+    if 'voice_start' in obj:
+        voice_start, voice_end = obj['voice_start'], obj['voice_end']
+    else:
+        # audio_voice_only is a slice of audio. Its start is recovered from the left blank, its end from its length.
+        voice_only = obj['audio_voice_only']
+        voice_start = _find_voice_start(audio, voice_only, obj['left_blank_duration_ms'], sample_rate)
+        voice_end = voice_start + len(voice_only)
+    writer.append(obj['filename'], audio, voice_start, voice_end,
+                  obj['left_blank_duration_ms'], obj['right_blank_duration_ms'],
+                  voiced_segments=obj.get('voiced_segments'))
+
+
+def write_shared_store(pkl_filenames, sample_rate, directory=None):
+    """Decodes the pkl files once into a temporary audio store and returns its directory (removed by the caller).
+
+    The store goes to /dev/shm when it has room for it (about the size of the pkl files), to the default temporary
+    directory otherwise: the page cache is shared by the processes in both cases, only the first read differs.
+    """
+    if directory is None:
+        needed = sum([os.path.getsize(f) for f in pkl_filenames])
+        if os.path.isdir(SHARED_MEMORY_DIR) and shutil.disk_usage(SHARED_MEMORY_DIR).free > 2 * needed:
+            directory = SHARED_MEMORY_DIR
+    store_dir = tempfile.mkdtemp(prefix='deep_speaker_audio_', dir=directory)
+    writer = AudioStoreWriter(store_dir, sample_rate)
+    for pkl_filename in pkl_filenames:
+        _append_pkl(writer, pkl_filename, sample_rate)
+    writer.close()
+    return store_dir
+
+
+def _find_voice_start(audio, voice_only, left_blank_duration_ms, sample_rate):
+    audio = audio.reshape(-1)
+    voice_only = voice_only.reshape(-1)
+    guess = int(left_blank_duration_ms * sample_rate // 1000)
+    if len(voice_only) == 0:
+        return min(guess, len(audio))
+    # the duration in ms was floored, so the real offset is a few samples after the guess.
+    for start in range(max(guess - 1, 0), min(guess + sample_rate // 1000 + 2, len(audio) - len(voice_only) + 1)):
+        if np.array_equal(audio[start:start + len(voice_only)], voice_only):
+            return start
+    raise ValueError('Could not locate audio_voice_only inside audio ({} ms).'.format(left_blank_duration_ms))
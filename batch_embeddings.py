@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import time
+from glob import glob
+from multiprocessing import Pool
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_worker_args = {}
+
+
+def find_audio_files(path):
+    """path is a directory (searched recursively for wav files) or a glob pattern."""
+    if os.path.isdir(path):
+        return sorted(glob(os.path.join(path, '**', '*.wav'), recursive=True))
+    return sorted(glob(path, recursive=True))
+
+
+SPEAKER_FROM = ['prefix', 'dir']
+
+
+def speaker_of(filename, speaker_from='prefix'):
+    """prefix: <speaker>_<sentence>.wav, like the pkl cache (build_file_index). dir: the parent directory (VCTK's
+    wav48/<speaker>/<speaker>_<sentence>.wav layout). None if the path does not follow the layout."""
+    if speaker_from == 'dir':
+        parent = os.path.basename(os.path.dirname(os.path.abspath(filename)))
+        return parent or None
+    basename = os.path.basename(filename)
+    return basename.split('_')[0] if '_' in basename else None
+
+
+def init_features_worker(sample_rate, resample_mode):
+    _worker_args['sample_rate'] = sample_rate
+    _worker_args['resample_mode'] = resample_mode
+
+
+def features_worker(filename):
+    from utils import audio_file_features
+    try:
+        features = audio_file_features(filename, _worker_args['sample_rate'], _worker_args['resample_mode'])
+    except Exception as e:
+        logger.error('[SKIPPING FILENAME] {}: {}'.format(filename, e))
+        return filename, None
+    return filename, features.astype(np.float32)
+
+
+def compute_batch_embeddings(filenames, output_filename, sample_rate, resample_mode='librosa',
+                             num_workers=None, batch_size=16384, checkpoints_dir='checkpoints', numpy_embedder=None,
+                             speaker_from='prefix'):
+    """Embeds every file: the features are extracted in a process pool and the model runs on batches of frames.
+
+    Writes output_filename (.npz) with the per-utterance and per-speaker mean embeddings, and a JSON index next to it.
+    Utterances with no feature frame (shorter than 325ms) are skipped. The speaker of a file is given by speaker_of().
+    """
+    from numpy_embedder import load_predict_fn
+    assert len(filenames) != 0, 'No audio file to process.'
+    assert speaker_from in SPEAKER_FROM, 'speaker_from should be one of {}.'.format(SPEAKER_FROM)
+    # checked before any feature is computed.
+    speakers = {f: speaker_of(f, speaker_from) for f in filenames}
+    bad_filenames = [f for (f, s) in speakers.items() if s is None]
+    assert len(bad_filenames) == 0, 'No speaker id (speaker_from={}) in {} file(s), e.g. {}.'.format(
+        speaker_from, len(bad_filenames), bad_filenames[:3])
+    predict_fn = load_predict_fn(checkpoints_dir, numpy_embedder=numpy_embedder, batch_size=batch_size)
+
+    utterance_ids, utterance_sums, utterance_frames = [], [], []
+    pending_features, pending_rows = [], []  # frames waiting for the next predict call, with their utterance row.
+
+    def flush():
+        if len(pending_features) == 0:
+            return
+        embeddings = predict_fn(np.vstack(pending_features))
+        rows = np.concatenate(pending_rows)
+        for row, start, end in _row_ranges(rows):
+            utterance_sums[row] += np.sum(embeddings[start:end], axis=0)
+        del pending_features[:]
+        del pending_rows[:]
+
+    start_time = time.time()
+    num_pending = 0
+    pool = Pool(processes=num_workers, initializer=init_features_worker, initargs=(sample_rate, resample_mode))
+    try:
+        chunk_size = max(1, min(16, len(filenames) // (4 * (num_workers or os.cpu_count()))))
+        for i, (filename, features) in enumerate(pool.imap(features_worker, filenames, chunksize=chunk_size)):
+            if features is None or len(features) == 0:
+                continue
+            row = len(utterance_ids)
+            utterance_ids.append(filename)
+            utterance_sums.append(0.0)  # becomes the sum of the frame embeddings in flush().
+            utterance_frames.append(len(features))
+            pending_features.append(features)
+            pending_rows.append(np.full(len(features), row))
+            num_pending += len(features)
+            if num_pending >= batch_size:
+                flush()
+                num_pending = 0
+            if (i + 1) % 1000 == 0:
+                logger.info('{}/{} utterances, {:.1f} utterances/s.'.format(i + 1, len(filenames),
+                                                                           (i + 1) / (time.time() - start_time)))
+        flush()
+    finally:
+        pool.close()
+        pool.join()
+
+    assert len(utterance_ids) != 0, 'None of the {} files has a feature frame.'.format(len(filenames))
+    utterance_frames = np.array(utterance_frames)
+    utterance_sums = np.array(utterance_sums, dtype=np.float64)
+    utterance_embeddings = (utterance_sums / utterance_frames[:, None]).astype(np.float32)
+    utterance_speakers = [speakers[f] for f in utterance_ids]
+    speaker_ids = sorted(set(utterance_speakers))
+    speaker_to_row = {s: i for (i, s) in enumerate(speaker_ids)}
+    speaker_rows = np.array([speaker_to_row[s] for s in utterance_speakers], dtype=np.int64)
+    # frame-weighted mean, like the mean over all the frames of a speaker done in inference_embeddings.
+    speaker_sums = np.zeros((len(speaker_ids), utterance_sums.shape[1]))
+    np.add.at(speaker_sums, speaker_rows, utterance_sums)
+    speaker_frames = np.bincount(speaker_rows, weights=utterance_frames)
+    speaker_embeddings = (speaker_sums / speaker_frames[:, None]).astype(np.float32)
+
+    np.savez(output_filename,
+             utterance_ids=np.array(utterance_ids), utterance_embeddings=utterance_embeddings,
+             utterance_num_frames=utterance_frames, utterance_speaker_rows=speaker_rows,
+             speaker_ids=np.array(speaker_ids), speaker_embeddings=speaker_embeddings)
+    index_filename = os.path.splitext(output_filename)[0] + '.index.json'
+    with open(index_filename, 'w') as w:
+        json.dump({'utterances': [{'id': f, 'speaker': s, 'row': i, 'num_frames': int(n)} for (i, (f, s, n)) in
+                                  enumerate(zip(utterance_ids, utterance_speakers, utterance_frames))],
+                   'speakers': [{'id': s, 'row': i} for (i, s) in enumerate(speaker_ids)]}, w, indent=2)
+
+    elapsed = time.time() - start_time
+    logger.info('Embedded {} utterances of {} speakers in {:.1f}s: {:.1f} utterances/s.'.format(
+        len(utterance_ids), len(speaker_ids), elapsed, len(utterance_ids) / elapsed))
+    logger.info('[DUMP EMBEDDINGS] {} and {}'.format(output_filename, index_filename))
+    return utterance_ids, utterance_embeddings, speaker_ids, speaker_embeddings
+
+
+def _row_ranges(rows):
+    # rows is sorted (frames are appended utterance by utterance): yields (row, start, end) for each utterance.
+    boundaries = np.concatenate([[0], np.where(np.diff(rows) != 0)[0] + 1, [len(rows)]])
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        yield rows[start], start, end
@@ -0,0 +1,106 @@
+"""Compares load_cache() and random crop reads between the pkl cache and the memory-mapped audio store.
+
+python -m benchmarks.bench_audio_store --num_speakers 10 --utterances_per_speaker 50
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from audio_reader import AudioReader
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=10)
+    arg_p.add_argument('--utterances_per_speaker', type=int, default=50)
+    arg_p.add_argument('--seconds_per_utterance', type=float, default=3.0)
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    arg_p.add_argument('--num_crops', type=int, default=10000)
+    return arg_p
+
+
+def write_synthetic_pkl_cache(cache_dir, num_speakers, utterances_per_speaker, seconds, sample_rate, seed=123):
+    """Writes pkl files with the same layout as AudioReader.dump_audio_to_pkl_cache.
+
+    utterances_per_speaker is a number, or a list with the number of utterances of every speaker.
+    """
+    rng = np.random.RandomState(seed)
+    cache_pkl_dir = os.path.join(cache_dir, 'audio_cache_pkl')
+    os.makedirs(cache_pkl_dir)
+    if isinstance(utterances_per_speaker, int):
+        utterances_per_speaker = [utterances_per_speaker] * num_speakers
+    for s in range(num_speakers):
+        speaker_id = 'p{}'.format(s + 100)
+        for u in range(utterances_per_speaker[s]):
+            audio = (rng.uniform(-0.5, 0.5, size=int(seconds * sample_rate)).astype(np.float32)).reshape(-1, 1)
+            energy = np.abs(audio[:, 0])
+            offsets = np.where(energy > np.percentile(energy, 95))[0]
+            filename = 'VCTK-Corpus/wav48/{0}/{0}_{1:03d}.wav'.format(speaker_id, u + 1)
+            obj = {'audio': audio,
+                   'audio_voice_only': audio[offsets[0]:offsets[-1]],
+                   'left_blank_duration_ms': (1000.0 * offsets[0]) // sample_rate,
+                   'right_blank_duration_ms': (1000.0 * (len(audio) - offsets[-1])) // sample_rate,
+                   'filename': filename}
+            with open(os.path.join(cache_pkl_dir, '{}_{:03d}_cache.pkl'.format(speaker_id, u + 1)), 'wb') as w:
+                pickle.dump(obj, w)
+
+
+def time_reader(audio_reader, num_crops, seed=123):
+    rng = np.random.RandomState(seed)
+    start = time.time()
+    entities = []
+    for speaker_id in audio_reader.all_speaker_ids:
+        cache, _ = audio_reader.load_cache([speaker_id])
+        entities.extend(cache.values())
+    load_time = time.time() - start
+
+    start = time.time()
+    read_bytes = 0
+    checksum = 0.0
+    for i in rng.randint(len(entities), size=num_crops):
+        voice_only = entities[i]['audio_voice_only']
+        cuts = rng.uniform(low=1, high=len(voice_only), size=2)
+        crop = voice_only[int(min(cuts)):int(max(cuts))]
+        checksum += float(np.sum(crop))  # forces the samples to be read.
+        read_bytes += crop.nbytes
+    crop_time = time.time() - start
+    return load_time, crop_time, read_bytes, checksum
+
+
+def main():
+    args = arg_parse().parse_args()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        write_synthetic_pkl_cache(cache_dir, args.num_speakers, args.utterances_per_speaker,
+                                  args.seconds_per_utterance, args.sample_rate)
+        pkl_reader = AudioReader(input_audio_dir=None, output_cache_dir=cache_dir, sample_rate=args.sample_rate)
+        start = time.time()
+        pkl_reader.migrate_cache_to_store()
+        print('Migration: {:.3f}s.'.format(time.time() - start))
+        mmap_reader = AudioReader(input_audio_dir=None, output_cache_dir=cache_dir, sample_rate=args.sample_rate,
+                                  cache_backend='mmap')
+
+        pkl_cache, pkl_metadata = pkl_reader.load_cache()
+        mmap_cache, mmap_metadata = mmap_reader.load_cache()
+        assert pkl_metadata == mmap_metadata
+        for filename, entity in pkl_cache.items():
+            assert np.array_equal(entity['audio_voice_only'], mmap_cache[filename]['audio_voice_only'])
+
+        results = {}
+        for name, audio_reader in [('pkl', pkl_reader), ('mmap', mmap_reader)]:
+            results[name] = time_reader(audio_reader, args.num_crops)
+        assert results['pkl'][3] == results['mmap'][3]
+        for name, (load_time, crop_time, read_bytes, _) in results.items():
+            print('{:>4}: load_cache = {:.3f}s, {} crops = {:.3f}s ({:.1f} MB/s).'.format(
+                name, load_time, args.num_crops, crop_time, read_bytes / 1e6 / max(crop_time, 1e-9)))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
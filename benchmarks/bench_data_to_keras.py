@@ -0,0 +1,73 @@
+"""Time and peak memory of data_to_keras: row-by-row lists (old) vs preallocated arrays and integer labels (new).
+
+python -m benchmarks.bench_data_to_keras --num_speakers 105 --crops_per_speaker 200
+"""
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+import numpy as np
+
+from utils import data_to_keras, SpeakersToCategorical
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=105)
+    arg_p.add_argument('--crops_per_speaker', type=int, default=200)
+    arg_p.add_argument('--frames_per_crop', type=int, default=20)
+    return arg_p
+
+
+def old_data_to_keras(data):
+    categorical_speakers = SpeakersToCategorical(data)
+    kx_train, ky_train, kx_test, ky_test = [], [], [], []
+    for speaker_id in categorical_speakers.get_speaker_ids():
+        d = data[speaker_id]
+        y = categorical_speakers.get_one_hot_vector(d['speaker_id'])
+        for x_train_elt in data[speaker_id]['train']:
+            for x_train_sub_elt in x_train_elt:
+                kx_train.append(x_train_sub_elt)
+                ky_train.append(y)
+        for x_test_elt in data[speaker_id]['test']:
+            for x_test_sub_elt in x_test_elt:
+                kx_test.append(x_test_sub_elt)
+                ky_test.append(y)
+    return np.array(kx_train), np.array(ky_train), np.array(kx_test), np.array(ky_test), categorical_speakers
+
+
+def measure(f, data, **kwargs):
+    tracemalloc.start()
+    start = time.time()
+    outputs = f(data, **kwargs)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return outputs, elapsed, peak
+
+
+def main():
+    args = arg_parse().parse_args()
+    rng = np.random.RandomState(123)
+    data = {}
+    for s in range(args.num_speakers):
+        speaker_id = 'p{}'.format(s + 100)
+        data[speaker_id] = {'speaker_id': speaker_id,
+                            'train': [rng.uniform(size=(args.frames_per_crop, 390)) for _ in
+                                      range(args.crops_per_speaker)],
+                            'test': [rng.uniform(size=(args.frames_per_crop, 390)) for _ in
+                                     range(args.crops_per_speaker // 4)]}
+
+    old, old_time, old_peak = measure(old_data_to_keras, data)
+    new, new_time, new_peak = measure(data_to_keras, data, one_hot=False)
+    np.testing.assert_allclose(old[0], new[0], rtol=1e-6)
+    np.testing.assert_array_equal(old[1].argmax(axis=1), new[1])
+    np.testing.assert_array_equal(old[3].argmax(axis=1), new[3])
+
+    print('{} train frames, {} speakers.'.format(len(new[0]), args.num_speakers))
+    print('old: {:.3f}s, peak {:.1f} MB.'.format(old_time, old_peak / 1e6))
+    print('new: {:.3f}s, peak {:.1f} MB.'.format(new_time, new_peak / 1e6))
+
+
+if __name__ == '__main__':
+    main()
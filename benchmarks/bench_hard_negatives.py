@@ -0,0 +1,68 @@
+"""Share of the triplets of a batch with a non-zero loss (active triplets), with uniformly drawn negatives and with the
+semi-hard negatives of HardNegativeMiner, and the time to build a batch and to refresh the miner.
+
+Synthetic speakers: gaussian clusters, half of them close to another speaker. The embedding is a fixed random
+projection, computed in NumPy like the triplet loss of triplet_loss.py.
+
+python -m benchmarks.bench_hard_negatives --num_speakers 80 --num_batches 200
+"""
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from triplet_loss import alpha
+from triplet_mining import HardNegativeMiner, l2_normalize
+from triplet_sampler import TripletSampler
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=80)
+    arg_p.add_argument('--frames_per_speaker', type=int, default=500)
+    arg_p.add_argument('--batch_size', type=int, default=900)
+    arg_p.add_argument('--num_batches', type=int, default=200)
+    return arg_p
+
+
+def active_triplets(embeddings):
+    elements = len(embeddings) // 3
+    anchor, positive, negative = embeddings[:elements], embeddings[elements:2 * elements], embeddings[2 * elements:]
+    loss = np.sum(anchor * negative, axis=1) - np.sum(anchor * positive, axis=1) + alpha
+    return np.mean(loss > 0)
+
+
+def main():
+    args = arg_parse().parse_args()
+    rng = np.random.RandomState(0)
+    centers = rng.normal(size=(args.num_speakers, 390))
+    half = args.num_speakers // 2
+    centers[half:2 * half] = centers[:half] + 0.3 * rng.normal(size=(half, 390))
+    y = np.repeat(np.arange(args.num_speakers), args.frames_per_speaker)
+    x = (centers[y] + 2.0 * rng.normal(size=(len(y), 390))).astype(np.float32)
+    projection = rng.normal(size=(390, 200)).astype(np.float32)
+
+    def embed_fn(inputs):
+        return l2_normalize(inputs @ projection)
+
+    for name in ['uniform', 'semi-hard']:
+        miner = None
+        if name == 'semi-hard':
+            miner = HardNegativeMiner(x, y, args.num_speakers, seed=0)
+            start = time.time()
+            miner.refresh(embed_fn)
+            print('refresh: {} frames embedded in {:.3f}s.'.format(args.num_speakers * miner.frames_per_speaker,
+                                                                  time.time() - start))
+        sampler = TripletSampler(x, y, x, y, args.batch_size, seed=0, one_hot=False, miner=miner)
+        active, elapsed = [], 0.0
+        for _ in range(args.num_batches):
+            start = time.time()
+            batch = sampler.make_batch()
+            elapsed += time.time() - start
+            active.append(active_triplets(embed_fn(batch[2])))
+        print('{:>10}: {:.1f}% active triplets, {:.2f}ms per batch.'.format(name, 100 * np.mean(active),
+                                                                             1000 * elapsed / args.num_batches))
+
+
+if __name__ == '__main__':
+    main()
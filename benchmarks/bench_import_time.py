@@ -0,0 +1,74 @@
+"""Import time of the inference entry points (python -X importtime) and wall time of `<script> --help`, checked
+against a startup budget. The heavy dependencies (TensorFlow/Keras, librosa, scipy, tqdm) must only be imported by
+the code paths that need them: importing the script must not load any of them.
+
+Exits with status 1 if a script is over budget or imports a heavy module.
+
+python -m benchmarks.bench_import_time --budget_ms 300
+"""
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+SCRIPTS = ['get_emb', 'comp_cos']
+HEAVY_MODULES = ['tensorflow', 'keras', 'librosa', 'scipy', 'tqdm']
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--scripts', nargs='+', default=SCRIPTS)
+    arg_p.add_argument('--budget_ms', type=float, default=300.0, help='Cumulative import time of a script.')
+    arg_p.add_argument('--repeats', type=int, default=3)
+    return arg_p
+
+
+def import_times(module):
+    """{module name: cumulative import time in ms} of `import module` in a new interpreter."""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True, check=True)
+    times = {}
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000.0
+    return times
+
+
+def run_seconds(python_args):
+    """Wall time of a new interpreter running python_args."""
+    start = time.time()
+    subprocess.run([sys.executable] + python_args, stdout=subprocess.DEVNULL, check=True)
+    return time.time() - start
+
+
+def main():
+    args = arg_parse().parse_args()
+    interpreter = np.median([run_seconds(['-c', 'pass']) for _ in range(args.repeats)])
+    failures = []
+    for script in args.scripts:
+        runs = [import_times(script) for _ in range(args.repeats)]
+        import_ms = np.median([r[script] for r in runs])
+        heavy = sorted(set([m.split('.')[0] for m in runs[0] if m.split('.')[0] in HEAVY_MODULES]))
+        help_ms = 1000 * (np.median([run_seconds([script + '.py', '--help']) for _ in range(args.repeats)]) -
+                          interpreter)
+        slowest = sorted([(t, m) for (m, t) in runs[0].items() if m != script and '.' not in m], reverse=True)[:3]
+        status = 'OK'
+        if import_ms > args.budget_ms or len(heavy) > 0:
+            status = 'FAIL'
+            failures.append(script)
+        print('{:>10}: import {:.0f}ms (budget {:.0f}ms), --help {:.0f}ms over the interpreter startup, '
+              'heavy modules: {}, slowest imports: {} [{}]'.format(script, import_ms, args.budget_ms, help_ms,
+                                                                   heavy or 'none',
+                                                                   ', '.join(['{} {:.0f}ms'.format(m, t)
+                                                                              for (t, m) in slowest]), status))
+    if len(failures) > 0:
+        print('Over budget: {}.'.format(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Scaling of InputsGenerator.generate_all_inputs with the number of workers, on a synthetic pkl cache whose speakers
+have very different numbers of utterances. Also checks that the inputs do not depend on the number of workers.
+
+python -m benchmarks.bench_inputs_generator --num_speakers 16 --workers 1 2 4 8
+"""
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from audio_reader import AudioReader
+from benchmarks.bench_audio_store import write_synthetic_pkl_cache
+from utils import InputsGenerator
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=16)
+    arg_p.add_argument('--max_count_per_class', type=int, default=200)
+    arg_p.add_argument('--task_size', type=int, default=50)
+    arg_p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    return arg_p
+
+
+def main():
+    args = arg_parse().parse_args()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        # speaker s has 4 * (s + 1) utterances.
+        write_synthetic_pkl_cache(cache_dir, args.num_speakers, [4 * (s + 1) for s in range(args.num_speakers)], 3.0,
+                                  args.sample_rate)
+        audio_reader = AudioReader(cache_dir, cache_dir, args.sample_rate)
+        print('{} speakers, {} utterances, {} crops per speaker and split.'.format(
+            len(audio_reader.all_speaker_ids), len(audio_reader.pkl_filenames), args.max_count_per_class))
+        reference, reference_time = None, None
+        for num_workers in args.workers:
+            generator = InputsGenerator(cache_dir, audio_reader, max_count_per_class=args.max_count_per_class,
+                                        task_size=args.task_size)
+            start = time.time()
+            inputs = {i['speaker_id']: i for i in generator.generate_all_inputs(audio_reader.all_speaker_ids,
+                                                                                 num_workers)}
+            elapsed = time.time() - start
+            if reference is None:
+                reference, reference_time = inputs, elapsed
+            same = all([np.array_equal(inputs[s]['train'][0], reference[s]['train'][0]) and
+                        np.array_equal(inputs[s]['test'][0], reference[s]['test'][0]) for s in reference])
+            print('{} workers: {:.2f}s, speedup = {:.2f}x, same inputs as 1 worker: {}.'.format(
+                num_workers, elapsed, reference_time / elapsed, same))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
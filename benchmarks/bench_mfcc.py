@@ -0,0 +1,56 @@
+"""Checks get_mfcc_features_390 against the window-by-window reference and times both.
+
+python -m benchmarks.bench_mfcc --seconds 5 --repeats 3
+"""
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from speech_features import get_mfcc_features_390, get_mfcc_features_390_reference
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--seconds', type=float, default=5.0)  # length of the synthetic signal.
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    arg_p.add_argument('--repeats', type=int, default=3)
+    return arg_p
+
+
+def check_equivalence(sample_rate, seed=123):
+    rng = np.random.RandomState(seed)
+    # float32 (n, 1) signals are what the pkl cache stores. Lengths cover the empty and partial window cases.
+    for length in [0, 100, 1000, 1039, 1040, 1041, 4321, 16000]:
+        sig = rng.uniform(low=-0.5, high=0.5, size=(length, 1)).astype(np.float32)
+        for max_frames in [None, 1, 5]:
+            expected = get_mfcc_features_390_reference(sig, sample_rate, max_frames=max_frames)
+            actual = get_mfcc_features_390(sig, sample_rate, max_frames=max_frames)
+            assert len(expected) == len(actual), (length, max_frames, expected.shape, actual.shape)
+            if len(expected) > 0:
+                np.testing.assert_allclose(actual, expected, rtol=1e-6, atol=1e-6)
+    print('Equivalence check passed.')
+
+
+def time_function(f, sig, sample_rate, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        f(sig, sample_rate)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    args = arg_parse().parse_args()
+    check_equivalence(args.sample_rate)
+    sig = np.random.uniform(low=-0.5, high=0.5, size=(int(args.seconds * args.sample_rate), 1)).astype(np.float32)
+    reference = time_function(get_mfcc_features_390_reference, sig, args.sample_rate, args.repeats)
+    batched = time_function(get_mfcc_features_390, sig, args.sample_rate, args.repeats)
+    print('Signal of {} seconds at {} Hz.'.format(args.seconds, args.sample_rate))
+    print('reference = {:.4f}s, batched = {:.4f}s, speedup = x{:.1f}.'.format(reference, batched,
+                                                                            reference / batched))
+
+
+if __name__ == '__main__':
+    main()
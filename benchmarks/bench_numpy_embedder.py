@@ -0,0 +1,103 @@
+"""NumpyEmbedder against m.predict(...)[0] of load_inference_model, the model used by the inference CLIs: a checkpoint
+of a randomly initialized model (trained with and without normalize_embeddings, or --checkpoint) is exported to a .npz,
+and both compute the embeddings of the same random MFCC-390 batches. Reports the load time (load_inference_model vs
+np.load), the time per batch and the largest difference, and exits with status 1 if it is over --atol.
+Runs from the directory of conf.json (the softmax layer has one unit per speaker of SPEAKERS_TRAINING_SET).
+
+python -m benchmarks.bench_numpy_embedder
+python -m benchmarks.bench_numpy_embedder --checkpoint checkpoints/unified_model_checkpoints_100.h5
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from numpy_embedder import NumpyEmbedder, export_numpy_embedder
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--checkpoint', default=None)
+    arg_p.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 100, 10000])
+    arg_p.add_argument('--atol', type=float, default=1e-5)
+    arg_p.add_argument('--repeats', type=int, default=5)
+    return arg_p
+
+
+def median_seconds(f, repeats):
+    f()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def random_checkpoint(checkpoints_dir, normalize_embeddings):
+    """A checkpoint like the ones of train_cli.py, alone in checkpoints_dir (load_inference_model loads the latest)."""
+    from constants import c
+    from train_cli import triplet_softmax_model
+    m = triplet_softmax_model(len(c.AUDIO.SPEAKERS_TRAINING_SET), batch_size=None,
+                              normalize_embeddings=normalize_embeddings)
+    os.makedirs(checkpoints_dir)
+    filename = os.path.join(checkpoints_dir, 'unified_model_checkpoints_1.h5')
+    m.save_weights(filename)
+    return filename
+
+
+def compare(checkpoint_file, npz_filename, batch_sizes, repeats):
+    from unseen_speakers import load_inference_model
+    start = time.perf_counter()
+    m = load_inference_model(checkpoints_dir=os.path.dirname(checkpoint_file), verbose=False)
+    keras_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embedder = NumpyEmbedder.load(npz_filename)
+    numpy_load = time.perf_counter() - start
+    print('{}: load {:.1f}ms with Keras, {:.2f}ms with numpy.'.format(checkpoint_file, 1000 * keras_load,
+                                                                   1000 * numpy_load))
+    rng = np.random.RandomState(123)
+    max_difference = 0.0
+    for batch_size in batch_sizes:
+        x = rng.normal(scale=2.0, size=(batch_size, 39 * 10)).astype(np.float32)
+        expected = m.predict(x, batch_size=batch_size, verbose=0)[0]
+        actual = embedder.predict(x)
+        difference = float(np.max(np.abs(actual - expected)))
+        max_difference = max(max_difference, difference)
+        keras_time = median_seconds(lambda: m.predict(x, batch_size=batch_size, verbose=0), repeats)
+        numpy_time = median_seconds(lambda: embedder.predict(x), repeats)
+        print('{:>7} frames: m.predict {:.3f}ms, numpy {:.3f}ms ({:.1f}x), max |difference| = {:.2e}.'.format(
+            batch_size, 1000 * keras_time, 1000 * numpy_time, keras_time / numpy_time, difference))
+    return max_difference
+
+
+def main():
+    args = arg_parse().parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.checkpoint is not None:
+            os.makedirs(os.path.join(work_dir, 'checkpoint'))
+            checkpoints = [os.path.join(work_dir, 'checkpoint', os.path.basename(args.checkpoint))]
+            shutil.copy(args.checkpoint, checkpoints[0])
+        else:
+            checkpoints = [random_checkpoint(os.path.join(work_dir, 'normalize_embeddings_{}'.format(n)), n)
+                           for n in [False, True]]
+        max_difference = 0.0
+        for i, checkpoint_file in enumerate(checkpoints):
+            npz_filename = export_numpy_embedder(checkpoint_file, os.path.join(work_dir, 'embedder_{}.npz'.format(i)))
+            max_difference = max(max_difference, compare(checkpoint_file, npz_filename, args.batch_sizes,
+                                                         args.repeats))
+    finally:
+        shutil.rmtree(work_dir)
+    if max_difference > args.atol:
+        print('The numpy embeddings differ from m.predict by {:.2e} > {:.0e}.'.format(max_difference, args.atol))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
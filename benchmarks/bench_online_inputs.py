@@ -0,0 +1,52 @@
+"""Throughput of OnlineInputs (batches per second) with the number of workers, on a synthetic pkl cache, and the
+time the consumer spends waiting for a batch.
+
+python -m benchmarks.bench_online_inputs --num_speakers 16 --workers 1 2 4
+"""
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from audio_reader import AudioReader
+from benchmarks.bench_audio_store import write_synthetic_pkl_cache
+from online_inputs import OnlineInputs
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=16)
+    arg_p.add_argument('--num_utterances', type=int, default=10)
+    arg_p.add_argument('--batch_size', type=int, default=900)
+    arg_p.add_argument('--num_batches', type=int, default=50)
+    arg_p.add_argument('--mode', default='softmax')
+    arg_p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    return arg_p
+
+
+def main():
+    args = arg_parse().parse_args()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        write_synthetic_pkl_cache(cache_dir, args.num_speakers, args.num_utterances, 3.0, args.sample_rate)
+        audio_reader = AudioReader(cache_dir, cache_dir, args.sample_rate)
+        for num_workers in args.workers:
+            online_inputs = OnlineInputs(audio_reader, audio_reader.all_speaker_ids, mode=args.mode,
+                                         batch_size=args.batch_size, num_workers=num_workers)
+            online_inputs.start()
+            online_inputs.next_batch()  # the workers are started.
+            online_inputs.wait_seconds = 0.0
+            start = time.time()
+            for _ in range(args.num_batches):
+                online_inputs.next_batch()
+            elapsed = time.time() - start
+            online_inputs.stop()
+            print('{} workers: {:.1f} batches/s, {:.2f}s waiting for {} batches.'.format(
+                num_workers, args.num_batches / elapsed, online_inputs.wait_seconds, args.num_batches))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
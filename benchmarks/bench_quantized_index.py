@@ -0,0 +1,116 @@
+"""Memory, search speed and ranking agreement of the compact EnrollmentIndex storage (float16, int8 with one scale per
+row) against float32.
+
+The embeddings come from:
+- --embeddings: a .npz written by get_emb.py --batch_embeddings (speakers enrolled, utterances searched).
+- --speakers: speakers of the audio cache, embedded with the latest checkpoint like inference_embeddings. Half the
+  frames of each speaker are enrolled (their mean), the other frames are searched.
+- by default: synthetic embeddings with the shape of the model's, sigmoid(x.W) of 390-d clustered inputs, normalized.
+
+python -m benchmarks.bench_quantized_index --num_speakers 20000 --num_queries 1000
+python -m benchmarks.bench_quantized_index --embeddings embeddings.npz
+python -m benchmarks.bench_quantized_index --speakers p363 p364 p374 p376
+"""
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from speaker_index import EnrollmentIndex, STORAGE_DTYPES, l2_normalize
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--embeddings', default=None)
+    arg_p.add_argument('--speakers', nargs='+', default=None)
+    arg_p.add_argument('--num_speakers', type=int, default=20000)
+    arg_p.add_argument('--num_queries', type=int, default=1000)
+    arg_p.add_argument('--top_k', type=int, default=10)
+    arg_p.add_argument('--repeats', type=int, default=3)
+    return arg_p
+
+
+def synthetic_embeddings(num_speakers, num_queries, dim=200, seed=123):
+    rng = np.random.RandomState(seed)
+    w = rng.normal(scale=0.1, size=(39 * 10, dim)).astype(np.float32)
+    centers = rng.normal(size=(num_speakers, 39 * 10)).astype(np.float32)
+
+    def embed(x):
+        return l2_normalize(1 / (1 + np.exp(-x.dot(w))))
+
+    labels = rng.randint(num_speakers, size=num_queries)
+    queries = embed(centers[labels] + rng.normal(scale=0.5, size=(num_queries, 39 * 10)).astype(np.float32))
+    enrolled = embed(centers + rng.normal(scale=0.2, size=centers.shape).astype(np.float32))
+    return ['s{}'.format(i) for i in range(num_speakers)], enrolled, queries, labels
+
+
+def npz_embeddings(filename):
+    data = np.load(filename)
+    labels = data['utterance_speaker_rows'] if 'utterance_speaker_rows' in data else None
+    return [str(s) for s in data['speaker_ids']], data['speaker_embeddings'], data['utterance_embeddings'], labels
+
+
+def checkpoint_embeddings(speakers):
+    from audio_reader import AudioReader
+    from constants import c
+    from unseen_speakers import generate_features_for_unseen_speakers, load_inference_model
+    audio_reader = AudioReader(input_audio_dir='deep-speaker-data/VCTK-Corpus',
+                               output_cache_dir='deep-speaker-data/cache',
+                               sample_rate=c.AUDIO.SAMPLE_RATE,
+                               cache_backend=c.AUDIO.CACHE_BACKEND)
+    m = load_inference_model(verbose=False)
+    enrolled, queries, labels = [], [], []
+    for i, speaker_id in enumerate(speakers):
+        frames = m.predict(np.vstack(generate_features_for_unseen_speakers(audio_reader, speaker_id)))[0]
+        half = len(frames) // 2
+        enrolled.append(np.mean(frames[:half], axis=0))
+        queries.append(frames[half:])
+        labels.append(np.full(len(frames) - half, i))
+    return list(speakers), np.stack(enrolled), np.concatenate(queries), np.concatenate(labels)
+
+
+def main():
+    args = arg_parse().parse_args()
+    if args.embeddings is not None:
+        ids, enrolled, queries, labels = npz_embeddings(args.embeddings)
+    elif args.speakers is not None:
+        ids, enrolled, queries, labels = checkpoint_embeddings(args.speakers)
+    else:
+        ids, enrolled, queries, labels = synthetic_embeddings(args.num_speakers, args.num_queries)
+    k = min(args.top_k, len(ids))
+    print('{} enrolled speakers, {} queries, top-{}.'.format(len(ids), len(queries), k))
+
+    reference = None
+    for dtype in ['float32', 'float16', 'int8']:
+        assert dtype in STORAGE_DTYPES
+        index_dir = tempfile.mkdtemp()
+        try:
+            index = EnrollmentIndex(index_dir, dim=enrolled.shape[1], dtype=dtype, create=True)
+            index.add(ids, enrolled)
+            index.search(queries[:10], k=k)  # warm-up (page cache of the memory map).
+            times = []
+            for _ in range(args.repeats):
+                start = time.time()
+                top_ids, top_scores = index.search(queries, k=k)
+                times.append(time.time() - start)
+            if reference is None:
+                reference = (top_ids, top_scores)
+            top_1 = np.mean([a[0] == b[0] for (a, b) in zip(top_ids, reference[0])])
+            recall = np.mean([len(set(a) & set(b)) / k for (a, b) in zip(top_ids, reference[0])])
+            score_error = np.max(np.abs(top_scores[:, 0] - reference[1][:, 0]))
+            accuracy = ''
+            if labels is not None:
+                accuracy = ', identification top-1 = {:.3f}'.format(np.mean([t[0] == ids[l] for (t, l) in
+                                                                              zip(top_ids, labels)]))
+            print('{:>7}: {:.2f} MB ({:.0f} bytes/speaker), {:.3f} ms/query, top-1 agreement = {:.4f}, '
+                  'top-{} overlap = {:.4f}, max top-1 score error = {:.5f}{}.'.format(
+                      dtype, index.nbytes() / 1e6, index.nbytes() / len(ids),
+                      1000 * np.median(times) / len(queries), top_1, k, recall, score_error, accuracy))
+        finally:
+            shutil.rmtree(index_dir)
+
+
+if __name__ == '__main__':
+    main()
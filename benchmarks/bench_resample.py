@@ -0,0 +1,81 @@
+"""Per-file decode+resample time of every resample mode of read_audio_from_filename, and how close each mode is
+to the librosa output (SNR of the signal and relative difference of the MFCC-390 features).
+
+python -m benchmarks.bench_resample --num_files 20 --seconds 4
+"""
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from audio_reader import read_audio_from_filename, RESAMPLE_MODES
+from speech_features import get_mfcc_features_390
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_files', type=int, default=20)
+    arg_p.add_argument('--seconds', type=float, default=4.0)
+    arg_p.add_argument('--input_sample_rate', type=int, default=48000)
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    return arg_p
+
+
+def write_synthetic_wavs(directory, num_files, seconds, sample_rate, seed=123):
+    """Harmonics of a moving pitch plus noise, so that there is energy below and above the new Nyquist."""
+    import soundfile
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    filenames = []
+    for i in range(num_files):
+        f0 = rng.uniform(80, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+        phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+        audio = sum([np.sin(k * phase) / k for k in range(1, 40)]) * 0.1 + rng.normal(scale=0.01, size=len(t))
+        filename = os.path.join(directory, 'p900_{:03d}.wav'.format(i))
+        soundfile.write(filename, audio, sample_rate, subtype='PCM_16')
+        filenames.append(filename)
+    return filenames
+
+
+def snr_db(reference, estimate):
+    n = min(len(reference), len(estimate))
+    noise = reference[:n] - estimate[:n]
+    return 10 * np.log10(np.sum(reference[:n] ** 2) / max(np.sum(noise ** 2), 1e-20))
+
+
+def main():
+    args = arg_parse().parse_args()
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = write_synthetic_wavs(directory, args.num_files, args.seconds, args.input_sample_rate)
+        outputs = {}
+        for resample_mode in RESAMPLE_MODES:
+            read_audio_from_filename(filenames[0], args.sample_rate, resample_mode)  # warm up.
+            start = time.time()
+            outputs[resample_mode] = [read_audio_from_filename(f, args.sample_rate, resample_mode)[0][:, 0]
+                                      for f in filenames]
+            per_file = (time.time() - start) / len(filenames)
+            print('{:>10}: {:.2f} ms per file of {}s.'.format(resample_mode, per_file * 1000, args.seconds))
+
+        reference = outputs['librosa']
+        ref_features = [get_mfcc_features_390(a, args.sample_rate) for a in reference]
+        for resample_mode in RESAMPLE_MODES:
+            lengths = [len(a) - len(r) for (a, r) in zip(outputs[resample_mode], reference)]
+            snr = np.mean([snr_db(r, a) for (a, r) in zip(outputs[resample_mode], reference)])
+            feature_diff = []
+            for a, rf in zip(outputs[resample_mode], ref_features):
+                f = get_mfcc_features_390(a, args.sample_rate)
+                n = min(len(f), len(rf))
+                feature_diff.append(np.linalg.norm(f[:n] - rf[:n]) / np.linalg.norm(rf[:n]))
+            print('{:>10}: length diff = {}, SNR vs librosa = {:.1f} dB, '
+                  'MFCC-390 relative diff = {:.4f}.'.format(resample_mode, sorted(set(lengths)), snr,
+                                                             np.mean(feature_diff)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Memory and attach time of num_workers processes loading the audio of all the speakers: every worker unpickling
+the pkl files (pkl cache) vs the workers slicing one shared store written once by AudioReader.share_cache().
+
+Private memory is read from /proc/self/smaps_rollup (Linux): the pages of the shared store are not private.
+
+python -m benchmarks.bench_shared_cache --num_speakers 10 --utterances_per_speaker 50 --workers 4
+"""
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import numpy as np
+
+from audio_reader import AudioReader
+from benchmarks.bench_audio_store import write_synthetic_pkl_cache
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=10)
+    arg_p.add_argument('--utterances_per_speaker', type=int, default=50)
+    arg_p.add_argument('--seconds_per_utterance', type=float, default=3.0)
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    arg_p.add_argument('--workers', type=int, default=4)
+    return arg_p
+
+
+def private_mb():
+    total = 0
+    with open('/proc/self/smaps_rollup') as r:
+        for line in r:
+            if line.startswith('Private_Clean') or line.startswith('Private_Dirty'):
+                total += int(line.split()[1])
+    return total / 1024.0
+
+
+_reader = {}
+
+
+def init_worker(audio_reader):
+    _reader['audio_reader'] = audio_reader
+
+
+def load_worker(_):
+    """Loads the audio of every speaker and reads every sample. Returns (attach seconds, private MB added)."""
+    before = private_mb()
+    start = time.time()
+    cache, _ = _reader['audio_reader'].load_cache()
+    elapsed = time.time() - start
+    checksum = sum([float(np.sum(entity['audio'])) for entity in cache.values()])
+    return elapsed, private_mb() - before, checksum
+
+
+def run(audio_reader, num_workers):
+    pool = Pool(processes=num_workers, initializer=init_worker, initargs=(audio_reader,))
+    try:
+        return pool.map(load_worker, range(num_workers), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    args = arg_parse().parse_args()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        write_synthetic_pkl_cache(cache_dir, args.num_speakers, args.utterances_per_speaker,
+                                  args.seconds_per_utterance, args.sample_rate)
+        audio_mb = args.num_speakers * args.utterances_per_speaker * args.seconds_per_utterance * \
+            args.sample_rate * 4 / 1024.0 / 1024.0
+        print('{} workers, {:.0f}MB of float32 audio.'.format(args.workers, audio_mb))
+        audio_reader = AudioReader(cache_dir, cache_dir, args.sample_rate)
+        for name in ['pkl', 'shared']:
+            share_seconds = 0.0
+            if name == 'shared':
+                start = time.time()
+                audio_reader.share_cache()
+                share_seconds = time.time() - start
+            results = run(audio_reader, args.workers)
+            checksums = set([round(r[2], 3) for r in results])
+            print('{:>6}: load_cache {:.3f}s per worker, {:.0f}MB private memory in total ({:.0f}MB per worker), '
+                  'share_cache {:.2f}s, same audio: {}.'.format(name, np.mean([r[0] for r in results]),
+                                                                 sum([r[1] for r in results]),
+                                                                 np.mean([r[1] for r in results]),
+                                                                 share_seconds, len(checksums) == 1))
+        audio_reader.close_shared_cache()
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
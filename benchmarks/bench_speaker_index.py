@@ -0,0 +1,74 @@
+"""Top-k cosine search of EnrollmentIndex at several enrollment sizes, against a scipy cosine loop.
+
+python -m benchmarks.bench_speaker_index --sizes 10000 100000 --num_queries 100
+"""
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from speaker_index import EnrollmentIndex
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    arg_p.add_argument('--num_queries', type=int, default=100)
+    arg_p.add_argument('--top_k', type=int, default=5)
+    arg_p.add_argument('--dim', type=int, default=200)
+    return arg_p
+
+
+def scipy_top_k(enrolled, query, k):
+    from scipy.spatial.distance import cosine
+    distances = [cosine(query, e) for e in enrolled]
+    return np.argsort(distances)[:k]
+
+
+def main():
+    args = arg_parse().parse_args()
+    rng = np.random.RandomState(123)
+    for size in args.sizes:
+        index_dir = tempfile.mkdtemp()
+        try:
+            embeddings = rng.uniform(size=(size, args.dim)).astype(np.float32)
+            ids = ['s{}'.format(i) for i in range(size)]
+            index = EnrollmentIndex(index_dir, dim=args.dim, create=True)
+            start = time.time()
+            for chunk in range(0, size, 1000):  # incremental enrollment.
+                index.add(ids[chunk:chunk + 1000], embeddings[chunk:chunk + 1000])
+            index.save()
+            add_time = time.time() - start
+
+            # queries close to an enrolled speaker.
+            targets = rng.randint(size, size=args.num_queries)
+            queries = embeddings[targets] + rng.normal(scale=0.01, size=(args.num_queries, args.dim))
+
+            start = time.time()
+            top_ids, _ = index.search(queries, k=args.top_k)
+            batched_time = time.time() - start
+
+            start = time.time()
+            for q in queries[:10]:
+                index.search(q, k=args.top_k)
+            single_time = (time.time() - start) / 10
+
+            start = time.time()
+            reference = scipy_top_k(embeddings, queries[0], args.top_k)
+            scipy_time = time.time() - start
+
+            accuracy = np.mean([top[0] == ids[t] for (top, t) in zip(top_ids, targets)])
+            assert [ids[i] for i in reference] == top_ids[0]
+            print('{:>7} speakers: add = {:.3f}s, batched search = {:.3f} ms/query, single query = {:.3f} ms, '
+                  'scipy loop = {:.1f} ms/query, top-1 = {:.3f}.'.format(size, add_time,
+                                                                          1000 * batched_time / args.num_queries,
+                                                                          1000 * single_time, 1000 * scipy_time,
+                                                                          accuracy))
+        finally:
+            shutil.rmtree(index_dir)
+
+
+if __name__ == '__main__':
+    main()
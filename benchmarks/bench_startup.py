@@ -0,0 +1,60 @@
+"""Startup time of AudioReader on a large pkl cache: listing audio_cache_pkl (no file index, or a stale one) vs
+loading the persisted file index, up to the files of one speaker (what get_emb.py and comp_cos.py need).
+
+The pkl files are empty: only their names and sizes matter here.
+
+python -m benchmarks.bench_startup --num_speakers 110 --utterances_per_speaker 400
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from audio_reader import AudioReader, FILE_INDEX_FILENAME
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=110)
+    arg_p.add_argument('--utterances_per_speaker', type=int, default=400)
+    arg_p.add_argument('--repeats', type=int, default=3)
+    return arg_p
+
+
+def startup(cache_dir, speaker_id):
+    start = time.perf_counter()
+    audio_reader = AudioReader(cache_dir, cache_dir, 8000)
+    filenames = audio_reader.speaker_ids_to_filename[speaker_id]
+    return time.perf_counter() - start, len(filenames)
+
+
+def main():
+    args = arg_parse().parse_args()
+    logging.getLogger('audio_reader').setLevel(logging.WARNING)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache_pkl_dir = os.path.join(cache_dir, 'audio_cache_pkl')
+        os.makedirs(cache_pkl_dir)
+        for s in range(args.num_speakers):
+            for u in range(args.utterances_per_speaker):
+                open(os.path.join(cache_pkl_dir, 'p{}_{:03d}_cache.pkl'.format(s + 100, u)), 'w').close()
+        print('{} pkl files.'.format(args.num_speakers * args.utterances_per_speaker))
+        index_filename = os.path.join(cache_dir, FILE_INDEX_FILENAME)
+        for name in ['no index', 'index']:
+            times = []
+            for _ in range(args.repeats):
+                if name == 'no index' and os.path.isfile(index_filename):
+                    os.remove(index_filename)
+                elapsed, num_files = startup(cache_dir, 'p100')
+                times.append(elapsed)
+            print('{:>9}: {:.1f}ms to the {} files of one speaker.'.format(name, 1000 * np.median(times), num_files))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
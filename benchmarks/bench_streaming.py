@@ -0,0 +1,67 @@
+"""Peak memory and speed of the streaming features of a long recording, against get_mfcc_features_390 of the whole
+file. Each mode runs in its own process so that the peak RSS is its own.
+
+python -m benchmarks.bench_streaming --minutes 30
+"""
+import os
+import resource
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+import numpy as np
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--minutes', type=float, default=30.0)
+    arg_p.add_argument('--input_sample_rate', type=int, default=48000)
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    arg_p.add_argument('--chunk_frames', type=int, default=1000)
+    return arg_p
+
+
+def write_long_wav(filename, minutes, sample_rate, seed=123):
+    import soundfile
+    rng = np.random.RandomState(seed)
+    with soundfile.SoundFile(filename, 'w', samplerate=sample_rate, channels=1, subtype='PCM_16') as f:
+        for _ in range(int(minutes * 60)):  # one second at a time.
+            f.write(rng.uniform(-0.5, 0.5, size=sample_rate).astype(np.float32))
+
+
+def run(mode, filename, sample_rate, chunk_frames):
+    from audio_reader import read_audio_polyphase
+    from speech_features import get_mfcc_features_390
+    from streaming_embeddings import stream_audio, stream_features
+    start = time.time()
+    if mode == 'whole':
+        num_frames = len(get_mfcc_features_390(read_audio_polyphase(filename, sample_rate), sample_rate))
+    else:
+        num_frames = 0
+        for feat in stream_features(stream_audio(filename, sample_rate), sample_rate, chunk_frames):
+            num_frames += len(feat)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return mode, num_frames, time.time() - start, peak_mb
+
+
+def main():
+    args = arg_parse().parse_args()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp_dir, 'long.wav')
+        write_long_wav(filename, args.minutes, args.input_sample_rate)
+        print('{:.0f} minutes at {} Hz ({:.0f} MB).'.format(args.minutes, args.input_sample_rate,
+                                                           os.path.getsize(filename) / 1024 ** 2))
+        for mode in ['stream', 'whole']:
+            with Pool(1, maxtasksperchild=1) as pool:
+                _, num_frames, elapsed, peak_mb = pool.apply(run, (mode, filename, args.sample_rate,
+                                                                   args.chunk_frames))
+            print('{:>6}: {} frames in {:.1f}s, peak RSS = {:.0f} MB.'.format(mode, num_frames, elapsed, peak_mb))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
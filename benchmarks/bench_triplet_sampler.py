@@ -0,0 +1,78 @@
+"""Steps/sec of the fit_model batch selection: argmax scans (old loop) vs TripletSampler (new loop).
+
+A fake training step (a matmul of the batch with a 390x200 matrix, repeated --step_matmuls times) stands in
+for train_on_batch + test_on_batch so that the overlap given by the prefetching thread shows up.
+
+python -m benchmarks.bench_triplet_sampler --num_speakers 105 --rows_per_speaker 8000 --steps 200
+"""
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from triplet_sampler import TripletSampler
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_speakers', type=int, default=105)
+    arg_p.add_argument('--rows_per_speaker', type=int, default=2000)
+    arg_p.add_argument('--batch_size', type=int, default=900)
+    arg_p.add_argument('--steps', type=int, default=100)
+    arg_p.add_argument('--step_matmuls', type=int, default=20)
+    return arg_p
+
+
+def old_batch(kx_train, ky_train, kx_test, ky_test, batch_size, num_different_speakers):
+    def select_inputs_and_outputs_for_speaker(x, y, speaker_id_):
+        indices = np.random.choice(np.where(y.argmax(axis=1) == speaker_id_)[0], size=batch_size // 3)
+        return x[indices], y[indices]
+
+    anchor_positive_speaker, negative_speaker = np.random.choice(range(num_different_speakers), size=2, replace=False)
+    batches = []
+    for x, y in [(kx_train, ky_train), (kx_test, ky_test)]:
+        inputs_outputs = [select_inputs_and_outputs_for_speaker(x, y, anchor_positive_speaker),
+                          select_inputs_and_outputs_for_speaker(x, y, anchor_positive_speaker),
+                          select_inputs_and_outputs_for_speaker(x, y, negative_speaker)]
+        batches.append(np.vstack([v[0] for v in inputs_outputs]))
+        batches.append(np.vstack([v[1] for v in inputs_outputs]))
+    return batches
+
+
+def fake_step(inputs, weights, step_matmuls):
+    for _ in range(step_matmuls):
+        np.dot(inputs, weights)
+
+
+def main():
+    args = arg_parse().parse_args()
+    num_rows = args.num_speakers * args.rows_per_speaker
+    kx = np.random.uniform(size=(num_rows, 390)).astype(np.float32)
+    y = np.random.permutation(np.repeat(np.arange(args.num_speakers), args.rows_per_speaker))
+    ky = np.eye(args.num_speakers, dtype=np.float32)[y]
+    weights = np.random.uniform(size=(390, 200)).astype(np.float32)
+
+    results = {}
+    for step_matmuls in [0, args.step_matmuls]:
+        start = time.time()
+        for _ in range(args.steps):
+            inputs, _, test_inputs, _ = old_batch(kx, ky, kx, ky, args.batch_size, args.num_speakers)
+            fake_step(inputs, weights, step_matmuls)
+        results[('old', step_matmuls)] = args.steps / (time.time() - start)
+
+        sampler = TripletSampler(kx, y, kx, y, batch_size=args.batch_size).start()
+        start = time.time()
+        for _ in range(args.steps):
+            _, _, inputs, _, test_inputs, _ = sampler.next_batch()
+            fake_step(inputs, weights, step_matmuls)
+        results[('new', step_matmuls)] = args.steps / (time.time() - start)
+        sampler.stop()
+
+    print('{} rows, {} speakers, batch size {}.'.format(num_rows, args.num_speakers, args.batch_size))
+    for step_matmuls in [0, args.step_matmuls]:
+        print('fake step of {:>3} matmuls: old = {:.1f} steps/s, new = {:.1f} steps/s.'.format(
+            step_matmuls, results[('old', step_matmuls)], results[('new', step_matmuls)]))
+
+
+if __name__ == '__main__':
+    main()
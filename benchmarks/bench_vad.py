@@ -0,0 +1,87 @@
+"""Speed of the frame-level VAD, and share of the MFCC frames of the training crops computed on silence when the crops
+are sampled in the voiced segments instead of anywhere between the first and last loud sample (95th percentile).
+
+Synthetic utterances: noise bursts (words) separated by pauses, over a low noise floor.
+
+python -m benchmarks.bench_vad --num_utterances 200
+"""
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from speech_features import get_mfcc_features_390
+from utils import crop_source, sample_crops
+from vad import voiced_segments
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--num_utterances', type=int, default=200)
+    arg_p.add_argument('--num_crops', type=int, default=1000)
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    return arg_p
+
+
+def synthetic_utterance(rng, sample_rate):
+    """Returns the audio and a boolean mask of its speech samples."""
+    parts, mask = [rng.normal(scale=0.001, size=int(rng.uniform(0.3, 1.0) * sample_rate))], []
+    mask.append(np.zeros(len(parts[0]), dtype=bool))
+    for _ in range(rng.randint(3, 8)):
+        word = rng.normal(scale=rng.uniform(0.05, 0.3), size=int(rng.uniform(0.2, 0.8) * sample_rate))
+        pause = rng.normal(scale=0.001, size=int(rng.uniform(0.1, 0.6) * sample_rate))
+        parts.extend([word, pause])
+        mask.extend([np.ones(len(word), dtype=bool), np.zeros(len(pause), dtype=bool)])
+    return np.concatenate(parts).reshape(-1, 1), np.concatenate(mask)
+
+
+def percentile_entity(audio):
+    energy = np.abs(audio[:, 0])
+    offsets = np.where(energy > np.percentile(energy, 95))[0]
+    return {'audio': audio, 'audio_voice_only': audio[offsets[0]:offsets[-1]], 'voice_start': offsets[0]}
+
+
+def silent_frame_share(entities, masks, num_crops, sample_rate, rng):
+    """Counts the frames of the crops whose samples are mostly silence."""
+    step = int(0.01 * sample_rate)
+    context = 9 * step + int(0.025 * sample_rate)
+    entity_ids, starts, ends = sample_crops(entities, num_crops, rng)
+    num_frames, num_silent = 0, 0
+    for e, s, t in zip(entity_ids, starts, ends):
+        num = len(get_mfcc_features_390(crop_source(entities[e])[s:t], sample_rate))
+        for f in range(num):
+            num_silent += np.mean(masks[e][s + 3 * step * f:s + 3 * step * f + context]) < 0.5
+        num_frames += num
+    return num_frames, num_silent
+
+
+def main():
+    args = arg_parse().parse_args()
+    rng = np.random.RandomState(123)
+    utterances = [synthetic_utterance(rng, args.sample_rate) for _ in range(args.num_utterances)]
+    total_seconds = sum([len(a) for (a, _) in utterances]) / args.sample_rate
+
+    start = time.time()
+    segments = [voiced_segments(a, args.sample_rate) for (a, _) in utterances]
+    elapsed = time.time() - start
+    print('VAD: {:.1f}s of audio in {:.3f}s ({:.0f}x real time).'.format(total_seconds, elapsed,
+                                                                          total_seconds / elapsed))
+
+    masks = [m for (_, m) in utterances]
+    percentile = [percentile_entity(a) for (a, _) in utterances]
+    vad = [{'audio': a, 'voiced_segments': s} for ((a, _), s) in zip(utterances, segments)]
+    for name, entities in [('95th percentile span', percentile), ('voiced segments', vad)]:
+        if name == 'voiced segments':
+            entities_masks = masks
+        else:  # the crops are cut in audio_voice_only: shift the masks accordingly.
+            entities_masks = [m[p['voice_start']:] for (m, p) in zip(masks, percentile)]
+        start = time.time()
+        num_frames, num_silent = silent_frame_share(entities, entities_masks, args.num_crops, args.sample_rate,
+                                                    np.random.default_rng(0))
+        print('{:>20}: {} frames, {:.1f}% on silence ({:.1f}s).'.format(name, num_frames,
+                                                                         100.0 * num_silent / max(num_frames, 1),
+                                                                         time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
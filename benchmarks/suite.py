@@ -0,0 +1,222 @@
+"""Benchmark suite of the whole pipeline on synthetic audio: ingestion (read_audio_from_filename,
+dump_audio_to_pkl_cache), features (get_mfcc_features_390, generate_features, data_to_keras), one train_on_batch step
+and m.predict at several batch sizes. Runs offline: the wav files are generated at 48 kHz in a temporary directory.
+
+Every case is repeated and its median time is reported. The results are written as JSON, and compared with a
+baseline written by a previous run: a case slower than the baseline by more than --tolerance is a regression, and the
+suite exits with status 1.
+
+python -m benchmarks.suite --output bench.json
+python -m benchmarks.suite --baseline bench.json --tolerance 0.2
+python -m benchmarks.suite --cases mfcc predict
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from benchmarks.bench_resample import write_synthetic_wavs
+
+SUITE_VERSION = 1
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--output', default=None, help='JSON file for the results.')
+    arg_p.add_argument('--baseline', default=None, help='JSON file written by a previous run.')
+    arg_p.add_argument('--tolerance', type=float, default=0.2, help='Slowdown over the baseline flagged (0.2 = 20%%).')
+    arg_p.add_argument('--cases', nargs='+', default=None, help='Subset of the cases (default: all).')
+    arg_p.add_argument('--repeats', type=int, default=5)
+    arg_p.add_argument('--num_files', type=int, default=10)
+    arg_p.add_argument('--seconds', type=float, default=4.0)
+    arg_p.add_argument('--input_sample_rate', type=int, default=48000)
+    arg_p.add_argument('--sample_rate', type=int, default=8000)
+    arg_p.add_argument('--num_speakers', type=int, default=20)
+    arg_p.add_argument('--batch_size', type=int, default=900)
+    arg_p.add_argument('--predict_batch_sizes', type=int, nargs='+', default=[1, 30, 300, 900])
+    return arg_p
+
+
+def measure(f, repeats, setup=None):
+    """Median and min wall time of f() over repeats runs (after one warm-up run). setup() runs before each run,
+    untimed."""
+    times = []
+    for i in range(repeats + 1):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        f()
+        if i > 0:
+            times.append(time.perf_counter() - start)
+    return {'seconds': float(np.median(times)), 'min_seconds': float(np.min(times)), 'repeats': repeats}
+
+
+class Suite:
+    """The cases share the synthetic wav files and the audio decoded from them. Each case returns a dict of results
+    keyed by name (a case can measure several configurations)."""
+
+    def __init__(self, args, work_dir):
+        self.args = args
+        self.work_dir = work_dir
+        self.wav_dir = os.path.join(work_dir, 'wav')
+        os.makedirs(self.wav_dir)
+        self.filenames = write_synthetic_wavs(self.wav_dir, args.num_files, args.seconds, args.input_sample_rate)
+        self._audio = None
+
+    def audio(self):
+        if self._audio is None:
+            from audio_reader import read_audio_from_filename
+            self._audio = [read_audio_from_filename(f, self.args.sample_rate, 'polyphase')[0][:, 0]
+                           for f in self.filenames]
+        return self._audio
+
+    def case_read_audio(self):
+        from audio_reader import read_audio_from_filename, RESAMPLE_MODES
+        results = {}
+        for resample_mode in RESAMPLE_MODES:
+            r = measure(lambda: [read_audio_from_filename(f, self.args.sample_rate, resample_mode)
+                                 for f in self.filenames], self.args.repeats)
+            r['files'] = len(self.filenames)
+            results['read_audio_from_filename[{}]'.format(resample_mode)] = r
+        return results
+
+    def case_dump_audio(self):
+        from audio_reader import AudioReader
+        cache_dir = os.path.join(self.work_dir, 'cache')
+        audio_reader = AudioReader(self.wav_dir, cache_dir, self.args.sample_rate, resample_mode='polyphase')
+
+        def setup():  # dump_audio_to_pkl skips the files already in the cache.
+            shutil.rmtree(audio_reader.cache_pkl_dir, ignore_errors=True)
+            os.makedirs(audio_reader.cache_pkl_dir)
+
+        r = measure(lambda: [audio_reader.dump_audio_to_pkl_cache(f) for f in self.filenames], self.args.repeats,
+                    setup=setup)
+        r['files'] = len(self.filenames)
+        return {'dump_audio_to_pkl_cache': r}
+
+    def case_mfcc(self):
+        from speech_features import get_mfcc_features_390
+        audio = self.audio()
+        r = measure(lambda: [get_mfcc_features_390(a, self.args.sample_rate) for a in audio], self.args.repeats)
+        r['frames'] = int(sum([len(get_mfcc_features_390(a, self.args.sample_rate)) for a in audio]))
+        return {'get_mfcc_features_390': r}
+
+    def case_generate_features(self):
+        from utils import generate_features
+        from vad import voiced_segments
+        entities = [{'audio': a.reshape(-1, 1), 'voiced_segments': voiced_segments(a, self.args.sample_rate)}
+                    for a in self.audio()]
+        max_count = 200
+        r = measure(lambda: generate_features(entities, max_count, rng=np.random.default_rng(0)), self.args.repeats)
+        r['crops'] = max_count
+        return {'generate_features': r}
+
+    def case_data_to_keras(self):
+        from utils import data_to_keras
+        rng = np.random.RandomState(123)
+        data = {}
+        for s in range(self.args.num_speakers):
+            speaker_id = 'p{}'.format(s + 100)
+            data[speaker_id] = {'speaker_id': speaker_id,
+                                'train': [rng.uniform(size=(20, 390)).astype(np.float32) for _ in range(200)],
+                                'test': [rng.uniform(size=(20, 390)).astype(np.float32) for _ in range(50)]}
+        r = measure(lambda: data_to_keras(data, one_hot=False), self.args.repeats)
+        r['rows'] = 250 * 20 * self.args.num_speakers
+        return {'data_to_keras': r}
+
+    def case_train_step(self):
+        from train_cli import triplet_softmax_model, compile_triplet_softmax_model
+        batch_size = self.args.batch_size
+        m = triplet_softmax_model(self.args.num_speakers, batch_size=batch_size, normalize_embeddings=True)
+        compile_triplet_softmax_model(m, loss_on_softmax=False, loss_on_embeddings=True, sparse_labels=True)
+        rng = np.random.RandomState(123)
+        x = rng.normal(size=(batch_size, 390)).astype(np.float32)
+        y = rng.randint(self.args.num_speakers, size=batch_size).astype(np.int32)
+        r = measure(lambda: m.train_on_batch(x, {'embeddings': y * 0, 'softmax': y}), self.args.repeats)
+        r['batch_size'] = batch_size
+        return {'train_on_batch': r}
+
+    def case_predict(self):
+        from train_cli import triplet_softmax_model
+        rng = np.random.RandomState(123)
+        results = {}
+        weights = None
+        for batch_size in self.args.predict_batch_sizes:
+            # the input layer has a fixed batch size: one model per batch size, with the same weights.
+            m = triplet_softmax_model(self.args.num_speakers, batch_size=batch_size)
+            if weights is None:
+                weights = m.get_weights()
+            m.set_weights(weights)
+            x = rng.normal(size=(batch_size, 390)).astype(np.float32)
+            r = measure(lambda: m.predict(x, batch_size=batch_size, verbose=0), self.args.repeats)
+            r['batch_size'] = batch_size
+            r['rows_per_sec'] = batch_size / r['seconds']
+            results['predict[batch_size={}]'.format(batch_size)] = r
+        return results
+
+
+CASES = ['read_audio', 'dump_audio', 'mfcc', 'generate_features', 'data_to_keras', 'train_step', 'predict']
+
+
+def compare(results, baseline, tolerance):
+    """Returns the names of the results slower than the baseline by more than tolerance."""
+    regressions = []
+    for name, r in sorted(results.items()):
+        if name not in baseline:
+            print('{:>40}: {:.4f}s (no baseline)'.format(name, r['seconds']))
+            continue
+        ratio = r['seconds'] / max(baseline[name]['seconds'], 1e-12)
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = ' REGRESSION'
+            regressions.append(name)
+        print('{:>40}: {:.4f}s vs {:.4f}s ({:+.1f}%){}'.format(name, r['seconds'], baseline[name]['seconds'],
+                                                              100 * (ratio - 1), flag))
+    return regressions
+
+
+def main():
+    args = arg_parse().parse_args()
+    cases = args.cases or CASES
+    unknown = sorted(set(cases) - set(CASES))
+    assert len(unknown) == 0, 'Unknown cases {}. Available cases: {}.'.format(unknown, CASES)
+    work_dir = tempfile.mkdtemp()
+    try:
+        suite = Suite(args, work_dir)
+        results = {}
+        for case in cases:
+            start = time.time()
+            results.update(getattr(suite, 'case_' + case)())
+            print('[{}] done in {:.1f}s.'.format(case, time.time() - start))
+    finally:
+        shutil.rmtree(work_dir)
+
+    report = {'version': SUITE_VERSION,
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'platform': {'python': platform.python_version(), 'numpy': np.__version__,
+                           'machine': platform.machine(), 'cpu_count': os.cpu_count()},
+              'args': vars(args),
+              'results': results}
+    if args.output is not None:
+        with open(args.output, 'w') as w:
+            json.dump(report, w, indent=2)
+        print('Results written to {}.'.format(args.output))
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as r:
+            baseline = json.load(r)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if len(regressions) > 0:
+        print('{} regression(s) over {:.0f}%: {}.'.format(len(regressions), 100 * args.tolerance, regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,6 @@ import os
 import time
 from argparse import ArgumentParser
 
-from audio_reader import AudioReader
 from constants import c
 #from utils import InputsGenerator
 
@@ -12,21 +11,52 @@ def arg_parse():
     arg_p = ArgumentParser()
     arg_p.add_argument('--unseen_speakers')  # p225,p226 example.   
     arg_p.add_argument('--extra_speakers', action='store_true')   # PhilippeRemy
+    arg_p.add_argument('--enroll')     # .npz written by get_emb.py --batch_embeddings, its speakers are enrolled.
+    arg_p.add_argument('--identify')   # .npz written by get_emb.py --batch_embeddings, its utterances are searched.
+    arg_p.add_argument('--index_dir', default='deep-speaker-data/enrollment')
+    arg_p.add_argument('--top_k', type=int, default=5)
+    arg_p.add_argument('--index_dtype', default='float32', choices=['float32', 'float16', 'int8'])  # new indexes only.
     return arg_p
 
 
 
+def enroll_or_identify(args):
+    import numpy as np
+    from speaker_index import EnrollmentIndex
+    index = EnrollmentIndex(args.index_dir, dtype=args.index_dtype, create=args.enroll is not None)
+    if args.enroll is not None:
+        data = np.load(args.enroll)
+        index.add([str(s) for s in data['speaker_ids']], data['speaker_embeddings'])
+        index.save()
+        print('{} speakers enrolled in {}.'.format(len(index), args.index_dir))
+    if args.identify is not None:
+        data = np.load(args.identify)
+        start_identify = time.time()
+        top_ids, top_scores = index.search(data['utterance_embeddings'], k=args.top_k)
+        end_identify = time.time()
+        for utterance_id, ids, scores in zip(data['utterance_ids'], top_ids, top_scores):
+            print('{}: {}'.format(utterance_id, ', '.join(['{} ({:.4f})'.format(i, s) for (i, s) in zip(ids, scores)])))
+        print('Searched {} utterances among {} speakers in {:.4f}s.'.format(len(top_ids), len(index),
+                                                                            end_identify - start_identify))
+
+
 def main():
     args = arg_parse().parse_args()
 
+    if args.enroll is not None or args.identify is not None:
+        enroll_or_identify(args)
+        exit(1)
+
     if args.extra_speakers:
         input_audio_dir="samples/"
     else:
         input_audio_dir="deep-speaker-data/VCTK-Corpus"
 
+    from audio_reader import AudioReader  # only the code paths reading the cache pay for its imports.
     audio_reader = AudioReader(input_audio_dir=input_audio_dir,
                                output_cache_dir="deep-speaker-data/cache",
-                               sample_rate=c.AUDIO.SAMPLE_RATE)
+                               sample_rate=c.AUDIO.SAMPLE_RATE,
+                               cache_backend=c.AUDIO.CACHE_BACKEND)
 
     if args.unseen_speakers is not None:
         start_unseen = time.time()
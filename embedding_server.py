@@ -0,0 +1,248 @@
+"""Long-lived embedding service. The model is loaded once and concurrent requests are micro-batched into one
+m.predict call.
+
+python embedding_server.py --port 8000 --max_batch_size 8192 --max_latency_ms 10
+python embedding_server.py --unix_socket /tmp/deep_speaker.sock
+
+POST /embeddings with one of:
+    Content-Type: application/json             {"features": [[390 floats], ...]} (already normalized)
+    Content-Type: application/octet-stream     a .npy file of shape (num_frames, 390) (already normalized)
+    Content-Type: audio/wav                    a wav file, read like get_emb.py --batch_embeddings does (resampled
+                                               with c.AUDIO.RESAMPLE_MODE, voiced part only).
+Answers {"embedding": [...], "num_frames": n} (mean of the frame embeddings). Add ?frames=1 to also get them.
+GET /stats returns the latency percentiles and the batch fill statistics.
+"""
+import io
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from constants import c
+
+logger = logging.getLogger(__name__)
+
+
+def arg_parse():
+    arg_p = ArgumentParser()
+    arg_p.add_argument('--host', default='127.0.0.1')
+    arg_p.add_argument('--port', type=int, default=8000)
+    arg_p.add_argument('--unix_socket', default=None)  # listens on a Unix socket instead of host:port.
+    arg_p.add_argument('--checkpoints_dir', default='checkpoints')
+    arg_p.add_argument('--max_batch_size', type=int, default=8192)  # in frames, not in requests.
+    arg_p.add_argument('--max_latency_ms', type=float, default=10.0)
+    return arg_p
+
+
+class MicroBatcher:
+    """Groups the frames of concurrent requests into one predict call.
+
+    A batch is sent to the model when it holds max_batch_size frames, or max_latency_ms after its first request.
+    A request larger than max_batch_size is predicted alone.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8192, max_latency_ms=10.0, stats_size=10000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.queue = Queue()
+        self.pending = None  # request taken from the queue that did not fit in the previous batch.
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=stats_size)
+        self.batch_frames = deque(maxlen=stats_size)
+        self.batch_requests = deque(maxlen=stats_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, features):
+        future = Future()
+        self.queue.put((np.asarray(features, dtype=np.float32), future, time.time()))
+        return future
+
+    def _next_request(self, timeout):
+        if self.pending is not None:
+            request, self.pending = self.pending, None
+            return request
+        return self.queue.get(timeout=timeout) if timeout is None or timeout > 0 else self.queue.get_nowait()
+
+    def _run(self):
+        while True:
+            batch = [self._next_request(timeout=None)]
+            num_frames = len(batch[0][0])
+            deadline = batch[0][2] + self.max_latency
+            while num_frames < self.max_batch_size:
+                try:
+                    request = self._next_request(timeout=deadline - time.time())
+                except Empty:
+                    break
+                if num_frames + len(request[0]) > self.max_batch_size:
+                    self.pending = request
+                    break
+                batch.append(request)
+                num_frames += len(request[0])
+            self._predict(batch, num_frames)
+
+    def _predict(self, batch, num_frames):
+        try:
+            embeddings = self.predict_fn(np.vstack([features for (features, _, _) in batch]))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        now = time.time()
+        with self.lock:
+            self.batch_frames.append(num_frames)
+            self.batch_requests.append(len(batch))
+            for features, future, submitted in batch:
+                future.set_result(embeddings[start:start + len(features)])
+                start += len(features)
+                self.latencies.append(now - submitted)
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_frames = np.array(self.batch_frames)
+            batch_requests = np.array(self.batch_requests)
+        if len(latencies) == 0:
+            return {'requests': 0, 'batches': 0}
+        return {'requests': int(np.sum(batch_requests)),
+                'batches': len(batch_frames),
+                'latency_ms_p50': float(np.percentile(latencies, 50)),
+                'latency_ms_p99': float(np.percentile(latencies, 99)),
+                'mean_requests_per_batch': float(np.mean(batch_requests)),
+                'mean_frames_per_batch': float(np.mean(batch_frames)),
+                'mean_batch_fill': float(np.mean(np.minimum(batch_frames / self.max_batch_size, 1.0)))}
+
+
+def wav_to_features(wav_bytes, sample_rate, resample_mode):
+    """The features get_emb.py --batch_embeddings computes for the same wav file."""
+    from utils import audio_file_features
+    return audio_file_features(io.BytesIO(wav_bytes), sample_rate, resample_mode)
+
+
+def make_handler(batcher, sample_rate, resample_mode='librosa'):
+    class EmbeddingHandler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == '/stats':
+                self._reply(200, batcher.stats())
+            else:
+                self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/embeddings':
+                self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+                return
+            payload = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            content_type = self.headers.get('Content-Type', 'application/json').split(';')[0].strip()
+            try:
+                if content_type == 'application/json':
+                    features = np.array(json.loads(payload.decode('utf-8'))['features'], dtype=np.float32)
+                elif content_type == 'application/octet-stream':
+                    features = np.load(io.BytesIO(payload), allow_pickle=False)
+                elif content_type in ['audio/wav', 'audio/x-wav', 'audio/wave']:
+                    features = wav_to_features(payload, sample_rate, resample_mode)
+                else:
+                    self._reply(415, {'error': 'unsupported content type {}'.format(content_type)})
+                    return
+            except Exception as e:
+                self._reply(400, {'error': str(e)})
+                return
+            if features.ndim != 2 or features.shape[1] != 39 * 10:
+                self._reply(400, {'error': 'features of shape {}, expected (num_frames, {})'.format(features.shape,
+                                                                                                  39 * 10)})
+                return
+            if len(features) == 0:
+                self._reply(400, {'error': 'no feature frame (audio shorter than 325ms?)'})
+                return
+            try:
+                embeddings = batcher.submit(features).result()
+            except Exception as e:  # raised by the model, passed through the future by MicroBatcher.
+                logger.exception('Predict failed on {} frames.'.format(len(features)))
+                self._reply(500, {'error': str(e)})
+                return
+            response = {'embedding': np.mean(embeddings, axis=0).tolist(), 'num_frames': len(embeddings)}
+            if parse_qs(url.query).get('frames', ['0'])[0] == '1':
+                response['frame_embeddings'] = embeddings.tolist()
+            self._reply(200, response)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return EmbeddingHandler
+
+
+class UnixSocketHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name = self.server_address
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def make_predict_fn(m):
+    import tensorflow as tf
+    if tf.executing_eagerly():
+        return lambda x: m.predict_on_batch(x)[0]
+    # graph mode (TF1): the model only lives in the default graph of the thread that built it.
+    graph = tf.get_default_graph()
+
+    def predict(x):
+        with graph.as_default():
+            return m.predict_on_batch(x)[0]
+
+    return predict
+
+
+def main():
+    args = arg_parse().parse_args()
+    from unseen_speakers import load_inference_model
+    m = load_inference_model(checkpoints_dir=args.checkpoints_dir, verbose=False)
+    m.predict(np.zeros((1, 39 * 10), dtype=np.float32))  # builds the predict function before the first request.
+    batcher = MicroBatcher(make_predict_fn(m), max_batch_size=args.max_batch_size,
+                           max_latency_ms=args.max_latency_ms)
+    handler = make_handler(batcher, c.AUDIO.SAMPLE_RATE, c.AUDIO.RESAMPLE_MODE)
+    if args.unix_socket is not None:
+        server = UnixSocketHTTPServer(args.unix_socket, handler)
+        logger.info('Listening on {}.'.format(args.unix_socket))
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler)
+        logger.info('Listening on {}:{}.'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info('Stats: {}'.format(batcher.stats()))
+        server.server_close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
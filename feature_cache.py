@@ -0,0 +1,98 @@
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FEATURES_VERSION = 3  # bump when get_mfcc_features_390 or the normalization changes.
+STATS_FILENAME = 'stats.json'
+
+
+def audio_entities_hash(audio_entities):
+    """Content hash of the voice-only audio of the entities (order independent)."""
+    h = hashlib.sha1()
+    for audio_entity in sorted(audio_entities, key=lambda e: e['filename']):
+        h.update(audio_entity['filename'].encode('utf-8'))
+        h.update(np.ascontiguousarray(audio_entity['audio_voice_only']).tobytes())
+        if audio_entity.get('voiced_segments') is not None:  # the crops are sampled inside the segments.
+            h.update(np.ascontiguousarray(audio_entity['voiced_segments'], dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def feature_key(audio_hash, sample_rate, seed, max_count):
+    params = 'v{}-sr{}-seed{}-count{}'.format(FEATURES_VERSION, sample_rate, seed, max_count)
+    return hashlib.sha1('{}-{}'.format(audio_hash, params).encode('utf-8')).hexdigest()
+
+
+class FeatureCache:
+    """On-disk cache of lists of feature matrices, one .npz per key, evicted least recently used first.
+
+    Hits and misses are counted in the process (hits, misses) and accumulated in stats.json.
+    """
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def get(self, key):
+        filename = self._filename(key)
+        if not os.path.isfile(filename):
+            self.misses += 1
+            self._update_stats(misses=1)
+            return None
+        with np.load(filename) as data:
+            features, offsets = data['features'], data['offsets']
+        os.utime(filename)  # the mtime is the last access time used by the LRU eviction.
+        self.hits += 1
+        self._update_stats(hits=1)
+        logger.info('[FEATURE CACHE HIT] {}'.format(filename))
+        return np.split(features, offsets[1:-1])
+
+    def put(self, key, list_matrices):
+        offsets = np.cumsum([0] + [len(m) for m in list_matrices])
+        features = np.vstack(list_matrices) if len(list_matrices) > 0 else np.zeros((0, 390))
+        filename = self._filename(key)
+        np.savez(filename + '.tmp.npz', features=features, offsets=offsets)
+        os.replace(filename + '.tmp.npz', filename)
+        logger.info('[FEATURE CACHE PUT] {}'.format(filename))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum([size for (_, size, _) in entries])
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            logger.info('[FEATURE CACHE EVICT] {}'.format(name))
+
+    def _update_stats(self, hits=0, misses=0):
+        stats = self.stats()
+        stats['hits'] += hits
+        stats['misses'] += misses
+        stats_filename = os.path.join(self.cache_dir, STATS_FILENAME)
+        with open(stats_filename + '.tmp', 'w') as w:
+            json.dump(stats, w)
+        os.replace(stats_filename + '.tmp', stats_filename)
+
+    def stats(self):
+        stats_filename = os.path.join(self.cache_dir, STATS_FILENAME)
+        if os.path.isfile(stats_filename):
+            with open(stats_filename) as r:
+                return json.load(r)
+        return {'hits': 0, 'misses': 0}
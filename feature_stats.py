@@ -0,0 +1,78 @@
+import numpy as np
+
+
+class RunningStats:
+    """Per-dimension mean and variance, updated one batch of frames at a time in a single pass.
+
+    Batches are combined with the parallel form of Welford's algorithm (Chan et al.), so two RunningStats
+    computed separately (two speakers, two workers) can be merged exactly.
+    """
+
+    def __init__(self, dim=39 * 10):
+        self.count = 0
+        self.mean = np.zeros(dim)
+        self.m2 = np.zeros(dim)  # sum of the squared differences to the mean.
+
+    def update(self, x):
+        x = np.asarray(x).reshape(-1, len(self.mean))
+        if len(x) == 0:
+            return self
+        batch_mean = np.mean(x, axis=0)
+        batch_m2 = np.sum(np.square(x - batch_mean), axis=0)
+        self._combine(len(x), batch_mean, batch_m2)
+        return self
+
+    def merge(self, other):
+        if other.count > 0:
+            self._combine(other.count, other.mean, other.m2)
+        return self
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + np.square(delta) * self.count * count / total
+        self.count = total
+
+    @property
+    def var(self):
+        return self.m2 / max(self.count, 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    def pooled_mean(self):
+        """Mean over all the frames and all the dimensions."""
+        return float(np.mean(self.mean))
+
+    def pooled_std(self):
+        """Std over all the frames and all the dimensions (within-dimension + between-dimension variance)."""
+        return float(np.sqrt(np.mean(self.var + np.square(self.mean - self.pooled_mean()))))
+
+    def to_dict(self):
+        return {'count': int(self.count), 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    @staticmethod
+    def from_dict(d):
+        stats = RunningStats(len(d['mean']))
+        stats.count = d['count']
+        stats.mean = np.array(d['mean'])
+        stats.m2 = np.array(d['m2'])
+        return stats
+
+
+def stack_and_normalize(list_matrices, mean, std, dtype=np.float32):
+    """Copies the crops into one preallocated (num_frames, 390) matrix and normalizes it in place.
+
+    mean and std are scalars or per-dimension vectors. Returns a list holding the matrix, so that it can replace
+    the list of crops everywhere (data_to_keras, add_speaker, np.vstack).
+    """
+    num_frames = sum([len(m) for m in list_matrices])
+    num_features = list_matrices[0].shape[1] if len(list_matrices) > 0 else 39 * 10
+    batch = np.empty((num_frames, num_features), dtype=dtype)
+    if num_frames > 0:
+        np.concatenate(list_matrices, axis=0, out=batch)
+    batch -= np.asarray(mean, dtype=dtype)
+    batch /= np.asarray(std, dtype=dtype)
+    return [batch]
@@ -3,13 +3,24 @@ import os
 import time
 from argparse import ArgumentParser
 
-from audio_reader import AudioReader
 from constants import c
 
 
 def arg_parse():
     arg_p = ArgumentParser()
     arg_p.add_argument('--get_embeddings')  # p225 example.
+    arg_p.add_argument('--batch_embeddings')  # directory (or glob) of wav files, e.g. samples/
+    arg_p.add_argument('--output', default='embeddings.npz')
+    arg_p.add_argument('--num_workers', type=int, default=None)
+    arg_p.add_argument('--batch_size', type=int, default=16384)  # frames per predict call.
+    # speaker of a --batch_embeddings file: prefix of <speaker>_<sentence>.wav, or its parent directory.
+    arg_p.add_argument('--speaker_from', default='prefix', choices=['prefix', 'dir'])
+    arg_p.add_argument('--stream_embeddings')  # one long wav file, embedded segment by segment.
+    arg_p.add_argument('--segment_seconds', type=float, default=10.0)
+    arg_p.add_argument('--hop_seconds', type=float, default=None)  # defaults to segment_seconds.
+    arg_p.add_argument('--export_numpy_embedder')  # .npz of the fc1 weights of --checkpoint, for --numpy_embedder.
+    arg_p.add_argument('--checkpoint', default=None)  # defaults to the latest one in checkpoints/.
+    arg_p.add_argument('--numpy_embedder', default=None)  # embeds with numpy instead of TensorFlow.
     return arg_p
 
 
@@ -18,9 +29,37 @@ def arg_parse():
 def main():
     args = arg_parse().parse_args()
 
+    if args.export_numpy_embedder is not None:
+        from numpy_embedder import export_numpy_embedder, latest_checkpoint
+        export_numpy_embedder(args.checkpoint or latest_checkpoint(), args.export_numpy_embedder)
+        exit(1)
+
+    if args.batch_embeddings is not None:
+        # reads the wav files directly, the pkl cache is not needed.
+        from batch_embeddings import compute_batch_embeddings, find_audio_files
+        compute_batch_embeddings(find_audio_files(args.batch_embeddings), args.output,
+                                 sample_rate=c.AUDIO.SAMPLE_RATE,
+                                 resample_mode=c.AUDIO.RESAMPLE_MODE,
+                                 num_workers=args.num_workers,
+                                 batch_size=args.batch_size,
+                                 numpy_embedder=args.numpy_embedder,
+                                 speaker_from=args.speaker_from)
+        exit(1)
+
+    if args.stream_embeddings is not None:
+        from streaming_embeddings import compute_stream_embeddings
+        compute_stream_embeddings(args.stream_embeddings, args.output,
+                                  sample_rate=c.AUDIO.SAMPLE_RATE,
+                                  segment_seconds=args.segment_seconds,
+                                  hop_seconds=args.hop_seconds,
+                                  numpy_embedder=args.numpy_embedder)
+        exit(1)
+
+    from audio_reader import AudioReader  # only the code paths reading the cache pay for its imports.
     audio_reader = AudioReader(input_audio_dir="deep-speaker-data/VCTK-Corpus",
                                output_cache_dir="deep-speaker-data/cache/",
-                               sample_rate=c.AUDIO.SAMPLE_RATE)
+                               sample_rate=c.AUDIO.SAMPLE_RATE,
+                               cache_backend=c.AUDIO.CACHE_BACKEND)
 
     if args.get_embeddings is not None:
         start_get = time.time()
@@ -0,0 +1,226 @@
+"""Timers and counters of the hot paths (per-stage wall time, bytes read, frames produced, queue waits).
+
+Disabled by default: timer() then returns a shared no-op context manager and count() returns immediately, so the
+instrumented code pays one function call. Enabled with DEEP_SPEAKER_INSTRUMENT=1 or the --instrument flag of
+preprocess.py and train_cli.py.
+
+Some stages can also be profiled: DEEP_SPEAKER_PROFILE=audio.read,features.mfcc (or all) or --profile. Every
+profiled stage has its own profiler, enabled only inside the stage, and its stats are written at the end to
+DEEP_SPEAKER_PROFILE_DIR (profiles/ by default). The profiler is cProfile, or pyinstrument with
+DEEP_SPEAKER_PROFILER=pyinstrument.
+
+The timers and counters are per process: the pool workers send theirs back with drain() and the parent merge()s them.
+The workers write their profiles themselves, in files suffixed with their pid.
+"""
+import logging
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+ENV_INSTRUMENT = 'DEEP_SPEAKER_INSTRUMENT'
+ENV_PROFILE = 'DEEP_SPEAKER_PROFILE'
+ENV_PROFILER = 'DEEP_SPEAKER_PROFILER'
+ENV_PROFILE_DIR = 'DEEP_SPEAKER_PROFILE_DIR'
+PROFILERS = ['cprofile', 'pyinstrument']
+
+_timers = {}  # stage -> [calls, seconds].
+_counters = {}  # name -> value.
+_profilers = {}  # stage -> profiler.
+_config = {}
+
+
+def _configure():
+    profile = os.environ.get(ENV_PROFILE, '')
+    _config['profile'] = set([s for s in profile.split(',') if s != ''])
+    _config['enabled'] = os.environ.get(ENV_INSTRUMENT, '') not in ['', '0'] or len(_config['profile']) > 0
+    _config['profiler'] = os.environ.get(ENV_PROFILER, 'cprofile').lower()
+    _config['profile_dir'] = os.environ.get(ENV_PROFILE_DIR, 'profiles')
+    _config['profiling'] = False  # one profiler at a time: a profiled stage inside another one is only timed.
+
+
+_configure()
+
+
+def enable(profile=None, profiler=None, profile_dir=None):
+    """Turns the instrumentation on, in this process and in the processes it starts (through the environment).
+    profile is a list of stages (or ['all'])."""
+    os.environ[ENV_INSTRUMENT] = '1'
+    if profile:
+        os.environ[ENV_PROFILE] = ','.join(profile)
+    if profiler is not None:
+        assert profiler in PROFILERS, 'profiler should be one of {}.'.format(PROFILERS)
+        os.environ[ENV_PROFILER] = profiler
+    if profile_dir is not None:
+        os.environ[ENV_PROFILE_DIR] = profile_dir
+    _configure()
+
+
+def enabled():
+    return _config['enabled']
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, stage):
+        self.stage = stage
+        self.profiler = None
+        self.start = None
+
+    def __enter__(self):
+        if not _config['profiling'] and ('all' in _config['profile'] or self.stage in _config['profile']):
+            self.profiler = _profiler(self.stage)
+            _config['profiling'] = True
+            _start_profiler(self.profiler)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            _stop_profiler(self.profiler)
+            _config['profiling'] = False
+        entry = _timers.get(self.stage)
+        if entry is None:
+            _timers[self.stage] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+        return False
+
+
+def timer(stage):
+    """with timer('audio.read'): ... adds the wall time of the block to the stage."""
+    if not _config['enabled']:
+        return _NULL_TIMER
+    return _Timer(stage)
+
+
+def count(name, value=1):
+    if not _config['enabled']:
+        return
+    _counters[name] = _counters.get(name, 0) + value
+
+
+def _profiler(stage):
+    if stage not in _profilers:
+        if _config['profiler'] == 'pyinstrument':
+            from pyinstrument import Profiler  # optional dependency, only needed to profile with pyinstrument.
+            _profilers[stage] = Profiler()
+        else:
+            import cProfile
+            _profilers[stage] = cProfile.Profile()
+    return _profilers[stage]
+
+
+def _start_profiler(profiler):
+    if _config['profiler'] == 'pyinstrument':
+        profiler.start()
+    else:
+        profiler.enable()
+
+
+def _stop_profiler(profiler):
+    if _config['profiler'] == 'pyinstrument':
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+def _is_worker():
+    return multiprocessing.current_process().name != 'MainProcess'
+
+
+def init_worker():
+    """Called by the pool initializers: a forked worker starts with a copy of the timers and counters of the parent,
+    which must not be sent back. Nothing to do in the main process (serial runs call the initializers too)."""
+    if _is_worker():
+        _timers.clear()
+        _counters.clear()
+
+
+def drain():
+    """Timers and counters of this process since the last drain(), and resets them. None if disabled."""
+    if not _config['enabled']:
+        return None
+    if len(_profilers) > 0 and _is_worker():
+        dump_profiles(suffix='.{}'.format(os.getpid()))  # cumulative: the last dump of the worker has everything.
+    snapshot = {'timers': {k: list(v) for (k, v) in _timers.items()}, 'counters': dict(_counters)}
+    _timers.clear()
+    _counters.clear()
+    return snapshot
+
+
+def merge(snapshot):
+    """Adds the output of drain() (from a worker process) to the timers and counters of this process."""
+    if snapshot is None or not _config['enabled']:
+        return
+    for stage, (calls, seconds) in snapshot['timers'].items():
+        entry = _timers.setdefault(stage, [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+    for name, value in snapshot['counters'].items():
+        count(name, value)
+
+
+def report():
+    return {'timers': {k: {'calls': v[0], 'seconds': v[1]} for (k, v) in _timers.items()},
+            'counters': dict(_counters)}
+
+
+def log_report():
+    if not _config['enabled']:
+        return
+    for stage, (calls, seconds) in sorted(_timers.items()):
+        logger.info('[INSTRUMENT] {}: {} calls, {:.3f}s, {:.3f}ms per call.'.format(stage, calls, seconds,
+                                                                                 1000 * seconds / max(calls, 1)))
+    for name, value in sorted(_counters.items()):
+        logger.info('[INSTRUMENT] {} = {}'.format(name, value))
+
+
+def dump_profiles(suffix=''):
+    """Writes the stats of every profiled stage to the profile directory. Returns the filenames."""
+    if len(_profilers) == 0:
+        return []
+    if not os.path.exists(_config['profile_dir']):
+        os.makedirs(_config['profile_dir'], exist_ok=True)
+    filenames = []
+    for stage, profiler in _profilers.items():
+        if _config['profiler'] == 'pyinstrument':
+            filename = os.path.join(_config['profile_dir'], '{}{}.html'.format(stage, suffix))
+            with open(filename, 'w') as w:
+                w.write(profiler.output_html())
+        else:
+            filename = os.path.join(_config['profile_dir'], '{}{}.prof'.format(stage, suffix))
+            profiler.dump_stats(filename)  # python -m pstats <filename>
+        filenames.append(filename)
+        if suffix == '':
+            logger.info('[INSTRUMENT] profile of {} written to {}.'.format(stage, filename))
+    return filenames
+
+
+def add_arguments(arg_p):
+    arg_p.add_argument('--instrument', action='store_true', help='Per-stage timers and counters, logged at the end.')
+    arg_p.add_argument('--profile', default=None,
+                       help='Comma-separated stages to profile (all for every stage), e.g. audio.read,features.mfcc.')
+
+
+def setup(args):
+    if args.instrument or args.profile:
+        enable(profile=args.profile.split(',') if args.profile else None)
+
+
+def finish():
+    log_report()
+    dump_profiles()
@@ -0,0 +1,99 @@
+"""Embeddings without TensorFlow: the embedding part of triplet_softmax_model is fc1 = Dense(390 -> 200, sigmoid),
+followed by an L2 normalization (load_inference_model always adds it, whatever the checkpoint was trained with). The
+fc1 weights are exported once from a Keras checkpoint to a .npz, and NumpyEmbedder computes sigmoid(x.W + b) with one
+BLAS matrix product per batch.
+
+python get_emb.py --export_numpy_embedder checkpoints/embedder.npz
+python get_emb.py --batch_embeddings samples/ --numpy_embedder checkpoints/embedder.npz
+"""
+import logging
+import os
+from glob import glob
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def latest_checkpoint(checkpoints_dir='checkpoints'):
+    """The checkpoint load_inference_model would load."""
+    from natsort import natsorted
+    checkpoints = natsorted(glob(os.path.join(checkpoints_dir, '*.h5')))
+    assert len(checkpoints) != 0, 'No checkpoint in {}.'.format(checkpoints_dir)
+    return checkpoints[-1]
+
+
+def _decode(name):
+    return name.decode('utf8') if isinstance(name, bytes) else str(name)
+
+
+def read_checkpoint(checkpoint_file):
+    """(kernel, bias) of fc1, read from a checkpoint written by m.save_weights or ModelCheckpoint, with h5py (already a
+    dependency of Keras)."""
+    import h5py
+    with h5py.File(checkpoint_file, 'r') as h:
+        weights = h['model_weights'] if 'model_weights' in h else h  # full model (ModelCheckpoint) or weights only.
+        layer_names = [_decode(n) for n in weights.attrs['layer_names']]
+        assert 'fc1' in layer_names, 'No fc1 layer in {} (layers: {}).'.format(checkpoint_file, layer_names)
+        fc1 = weights['fc1']
+        values = {}
+        for weight_name in [_decode(n) for n in fc1.attrs['weight_names']]:
+            values[weight_name.split('/')[-1].split(':')[0]] = np.array(fc1[weight_name], dtype=np.float32)
+    return values['kernel'], values['bias']
+
+
+def export_numpy_embedder(checkpoint_file, output_filename, normalize=True):
+    """normalize=True like load_inference_model: the embeddings of a checkpoint trained without
+    --normalize_embeddings are normalized at inference too."""
+    kernel, bias = read_checkpoint(checkpoint_file)
+    np.savez(output_filename, kernel=kernel, bias=bias, normalize=normalize)
+    logger.info('[DUMP NUMPY EMBEDDER] fc1 {} (normalize={}) of {} in {}.'.format(kernel.shape, normalize,
+                                                                               checkpoint_file, output_filename))
+    return output_filename
+
+
+class NumpyEmbedder:
+    """predict(x) is load_inference_model().predict(x)[0] for the checkpoint the weights come from: x has shape
+    (num_frames, 390)."""
+
+    def __init__(self, kernel, bias, normalize=True):
+        self.kernel = np.ascontiguousarray(kernel, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.normalize = bool(normalize)
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        return cls(data['kernel'], data['bias'], data['normalize'])
+
+    def predict(self, x, batch_size=65536):
+        """Embeddings of the rows of x, batch_size rows at a time (bounds the memory of the intermediate arrays)."""
+        x = np.asarray(x, dtype=np.float32)
+        embeddings = np.empty((len(x), self.kernel.shape[1]), dtype=np.float32)
+        for start in range(0, len(x), batch_size):
+            y = embeddings[start:start + batch_size]
+            np.dot(x[start:start + batch_size], self.kernel, out=y)
+            # sigmoid, in place: 1 / (1 + exp(-(y + b))). exp overflows to inf for very negative inputs, giving 0.
+            y += self.bias
+            np.negative(y, out=y)
+            with np.errstate(over='ignore'):
+                np.exp(y, out=y)
+            y += 1
+            np.reciprocal(y, out=y)
+            if self.normalize:  # like K.l2_normalize: y / sqrt(max(sum(y ** 2), 1e-12)).
+                y /= np.sqrt(np.maximum(np.einsum('ij,ij->i', y, y), 1e-12))[:, None]
+        return embeddings
+
+
+def load_predict_fn(checkpoints_dir='checkpoints', numpy_embedder=None, batch_size=None):
+    """x -> embeddings of the frames: with the NumpyEmbedder saved in numpy_embedder (.npz), or with the Keras model of
+    load_inference_model (TensorFlow is then imported)."""
+    if numpy_embedder is not None:
+        embedder = NumpyEmbedder.load(numpy_embedder)
+        logger.info('Embeddings computed with numpy from {} (normalize={}).'.format(numpy_embedder, embedder.normalize))
+        if batch_size is None:
+            return embedder.predict
+        return lambda x: embedder.predict(x, batch_size=batch_size)
+    from unseen_speakers import load_inference_model
+    m = load_inference_model(checkpoints_dir=checkpoints_dir, verbose=False)
+    return lambda x: m.predict(x, batch_size=batch_size, verbose=0)[0]
@@ -0,0 +1,238 @@
+import logging
+import multiprocessing
+import time
+from queue import Empty
+
+import numpy as np
+
+import instrumentation
+from feature_stats import RunningStats
+from utils import generate_features, train_test_entities
+
+logger = logging.getLogger(__name__)
+
+ONLINE_MODES = ['softmax', 'triplet']
+
+
+class SharedBatchRing:
+    """Bounded ring of num_slots batches of (slot_rows, 390) features and int32 labels, in shared memory.
+
+    A producer takes a free slot, writes its rows in place and publishes (slot, num_rows, meta). The consumer copies
+    a published slot out and gives it back. Only slot indices go through the queues, and producers block while every
+    slot is full, so the memory never grows past num_slots batches.
+    """
+
+    def __init__(self, num_slots, slot_rows, num_features=39 * 10):
+        self.num_slots = num_slots
+        self.slot_rows = slot_rows
+        self.num_features = num_features
+        self._x = multiprocessing.RawArray('f', num_slots * slot_rows * num_features)
+        self._y = multiprocessing.RawArray('i', num_slots * slot_rows)
+        self.free_slots = multiprocessing.Queue()
+        self.full_slots = multiprocessing.Queue()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+
+    def _views(self, slot):
+        x = np.frombuffer(self._x, dtype=np.float32).reshape(self.num_slots, self.slot_rows, self.num_features)
+        y = np.frombuffer(self._y, dtype=np.int32).reshape(self.num_slots, self.slot_rows)
+        return x[slot], y[slot]
+
+    def put(self, x, y, meta=None, timeout=None):
+        """Raises queue.Empty if no slot was freed within timeout."""
+        slot = self.free_slots.get(timeout=timeout)
+        x_slot, y_slot = self._views(slot)
+        x_slot[:len(x)] = x
+        y_slot[:len(y)] = y
+        self.full_slots.put((slot, len(x), meta))
+
+    def get(self, timeout=None):
+        slot, num_rows, meta = self.full_slots.get(timeout=timeout)
+        x_slot, y_slot = self._views(slot)
+        x, y = x_slot[:num_rows].copy(), y_slot[:num_rows].copy()
+        self.free_slots.put(slot)
+        return x, y, meta
+
+
+class _SpeakerFrames:
+    """Fresh normalized MFCC-390 frames of the speakers, generated crops_per_step crops at a time.
+
+    Each speaker is normalized with the running statistics of its own train crops, like the per-speaker
+    mean_train/std_train of the precomputed inputs.
+    """
+
+    def __init__(self, entities, crops_per_step, rng):
+        self.entities = entities
+        self.crops_per_step = crops_per_step
+        self.rng = rng
+        self.stats = [RunningStats() for _ in entities]
+
+    def generate(self, label, split):
+        stats = self.stats[label]
+        if split == 'train' or stats.count == 0:
+            train = generate_features(self.entities[label]['train'], self.crops_per_step, rng=self.rng, stats=stats)
+        if split == 'test':
+            frames = generate_features(self.entities[label]['test'], self.crops_per_step, rng=self.rng)
+        else:
+            frames = train
+        if len(frames) == 0 or stats.count == 0:
+            return np.zeros((0, 39 * 10), dtype=np.float32)
+        frames = np.concatenate(frames).astype(np.float32)
+        frames -= stats.pooled_mean()
+        frames /= stats.pooled_std()
+        return frames
+
+    def take(self, label, split, num_rows, max_attempts=100):
+        """num_rows frames of the speaker, drawn without replacement from freshly generated crops."""
+        frames, total = [], 0
+        for _ in range(max_attempts):
+            if total >= num_rows:
+                break
+            new_frames = self.generate(label, split)
+            frames.append(new_frames)
+            total += len(new_frames)
+        assert total >= num_rows, 'Not enough {} audio to generate frames for speaker #{}.'.format(split, label)
+        frames = np.concatenate(frames)
+        return frames[np.sort(self.rng.choice(len(frames), size=num_rows, replace=False))]
+
+
+def online_worker(worker_id, ring, stop_event, entities, mode, batch_size, crops_per_step, pool_batches, seed):
+    """Fills the ring until stop_event is set. entities[label] is {'train': [...], 'test': [...]}."""
+    rng = np.random.default_rng([seed, worker_id])
+    speaker_frames = _SpeakerFrames(entities, crops_per_step, rng)
+
+    def put(x, y, meta):
+        while not stop_event.is_set():
+            try:
+                ring.put(x, y, meta, timeout=0.1)
+                return
+            except Empty:  # the ring is full: the training is slower than the workers.
+                continue
+
+    pool_x, pool_y, pool_rows = [], [], 0  # softmax mode: frames of several speakers, shuffled together.
+    speaker_order = []  # softmax mode: every speaker once per round, in a random order.
+    while not stop_event.is_set():
+        if mode == 'triplet':
+            # [anchor, positive, negative] rows for the train batch, then the same for the test batch.
+            third = batch_size // 3
+            anchor_positive_speaker, negative_speaker = rng.choice(len(entities), size=2, replace=False)
+            x, y = [], []
+            for split in ['train', 'test']:
+                x.append(speaker_frames.take(anchor_positive_speaker, split, 2 * third))
+                x.append(speaker_frames.take(negative_speaker, split, third))
+                y.extend([np.full(2 * third, anchor_positive_speaker), np.full(third, negative_speaker)])
+            put(np.concatenate(x), np.concatenate(y), (int(anchor_positive_speaker), int(negative_speaker)))
+            continue
+        if len(speaker_order) == 0:
+            speaker_order = list(rng.permutation(len(entities)))
+        label = speaker_order.pop()
+        frames = speaker_frames.generate(label, 'train')
+        pool_x.append(frames)
+        pool_y.append(np.full(len(frames), label))
+        pool_rows += len(frames)
+        if pool_rows >= pool_batches * batch_size:
+            x, y = np.concatenate(pool_x), np.concatenate(pool_y)
+            permutation = rng.permutation(len(x))
+            num_batches = len(x) // batch_size
+            for i in range(num_batches):
+                rows = permutation[i * batch_size:(i + 1) * batch_size]
+                put(x[rows], y[rows], None)
+            rest = permutation[num_batches * batch_size:]
+            pool_x, pool_y, pool_rows = [x[rest]], [y[rest]], len(rest)
+
+
+class OnlineInputs:
+    """Training batches generated from the audio while the model trains, instead of the precomputed inputs.
+
+    num_workers processes draw fresh crops of the train utterances, compute their MFCC-390 features and write whole
+    batches into a SharedBatchRing of num_slots batches. The audio entities are loaded once, before the workers
+    are forked: with the mmap cache backend they are views of the audio store, shared by all the processes.
+    Labels are the indices of the speakers in speaker_ids.
+
+    mode='softmax': next_batch() returns (x, y), batch_size frames of shuffled speakers (fit_model_softmax_online).
+    mode='triplet': next_batch() returns the same tuple as TripletSampler.next_batch() (fit_model).
+    """
+
+    def __init__(self, audio_reader, speaker_ids, mode='softmax', batch_size=900, num_workers=None, num_slots=None,
+                 crops_per_step=8, pool_batches=20, seed=0):
+        assert mode in ONLINE_MODES, 'mode should be one of {}.'.format(ONLINE_MODES)
+        self.speaker_ids = list(speaker_ids)
+        self.mode = mode
+        self.batch_size = batch_size
+        self.num_workers = num_workers or max(1, multiprocessing.cpu_count() - 1)
+        self.num_slots = num_slots or 4 * self.num_workers
+        self.crops_per_step = crops_per_step
+        self.pool_batches = pool_batches
+        self.seed = seed
+        self.entities = [train_test_entities(audio_reader, s) for s in self.speaker_ids]
+        self.ring = None
+        self.stop_event = None
+        self.workers = []
+        self.wait_seconds = 0.0  # time spent by next_batch() waiting for the workers.
+        self.num_batches = 0
+
+    def start(self):
+        if len(self.workers) > 0:
+            return self
+        slot_rows = 2 * 3 * (self.batch_size // 3) if self.mode == 'triplet' else self.batch_size
+        self.ring = SharedBatchRing(self.num_slots, slot_rows)
+        self.stop_event = multiprocessing.Event()
+        for worker_id in range(self.num_workers):
+            worker = multiprocessing.Process(target=online_worker,
+                                             args=(worker_id, self.ring, self.stop_event, self.entities, self.mode,
+                                                   self.batch_size, self.crops_per_step, self.pool_batches,
+                                                   self.seed),
+                                             daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logger.info('Started {} workers generating {} batches of {} frames.'.format(self.num_workers, self.mode,
+                                                                                    self.batch_size))
+        return self
+
+    def next_batch(self):
+        start = time.time()
+        with instrumentation.timer('online.wait'):
+            while True:
+                try:
+                    x, y, meta = self.ring.get(timeout=1.0)
+                    break
+                except Empty:
+                    if not any([worker.is_alive() for worker in self.workers]):
+                        raise RuntimeError('All the workers generating the online inputs died (see their traceback).')
+        self.wait_seconds += time.time() - start
+        self.num_batches += 1
+        if self.num_batches % 1000 == 0:
+            logger.info('{} batches, {:.1f}s waiting for the workers.'.format(self.num_batches, self.wait_seconds))
+        if self.mode == 'softmax':
+            return x, y
+        anchor_positive_speaker, negative_speaker = meta
+        train_rows = len(x) // 2
+        return anchor_positive_speaker, negative_speaker, x[:train_rows], y[:train_rows], x[train_rows:], \
+            y[train_rows:]
+
+    def generator(self):
+        """(inputs, targets) for fit_generator. The embeddings target is ignored by the loss of the softmax mode."""
+        assert self.mode == 'softmax'
+        while True:
+            x, y = self.next_batch()
+            yield x, {'embeddings': y, 'softmax': y}
+
+    def validation_data(self, crops_per_speaker=20, seed=1):
+        """Fixed validation set built from the test utterances, normalized with train crops of the same speakers."""
+        speaker_frames = _SpeakerFrames(self.entities, crops_per_speaker, np.random.default_rng(seed))
+        x, y = [], []
+        for label in range(len(self.entities)):
+            frames = speaker_frames.generate(label, 'test')
+            x.append(frames)
+            y.append(np.full(len(frames), label, dtype=np.int32))
+        x, y = np.concatenate(x), np.concatenate(y)
+        return x, {'embeddings': y, 'softmax': y}
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
@@ -4,6 +4,7 @@ import shutil
 import time
 from argparse import ArgumentParser
 
+import instrumentation
 from audio_reader import AudioReader
 from constants import c
 from utils import InputsGenerator
@@ -14,7 +15,10 @@ def arg_parse():
     arg_p.add_argument('--regenerate_full_cache', action='store_true')  ###是否要重新生成cache文件
     arg_p.add_argument('--update_cache', action='store_true')           ###当新的音频进来的时候，我们也需要对其进行预处理
     arg_p.add_argument('--generate_training_inputs', action='store_true')   ###生成适合输入模型的inputs
+    arg_p.add_argument('--migrate_cache_to_store', action='store_true')   ###把audio_cache_pkl转换成内存映射的audio_store
     arg_p.add_argument('--multi_threading', action='store_true')
+    arg_p.add_argument('--num_workers', type=int, default=None)    ###进程数，默认是CPU的个数
+    instrumentation.add_arguments(arg_p)    ###每个阶段的耗时和计数，--profile可以对某些阶段做profiling
     return arg_p
 
 
@@ -43,18 +47,25 @@ def generate_cache_from_training_inputs(audio_reader, args):
                                        audio_reader=audio_reader,
                                        max_count_per_class=1000,
                                        speakers_sub_list=None,
-                                       multi_threading=args.multi_threading)
+                                       multi_threading=args.multi_threading,
+                                       num_workers=args.num_workers)
     inputs_generator.start_generation()
 
 
 
 def main():
     args = arg_parse().parse_args()
+    instrumentation.setup(args)
 
+    # the cache is always written as pkl files. Only the generation of the inputs can read from the audio store.
+    cache_backend = c.AUDIO.CACHE_BACKEND if args.generate_training_inputs else 'pkl'
     audio_reader = AudioReader(input_audio_dir="deep-speaker-data/VCTK-Corpus/",
                                output_cache_dir="deep-speaker-data/cache",
                                sample_rate=c.AUDIO.SAMPLE_RATE,
-                               multi_threading=args.multi_threading)
+                               multi_threading=args.multi_threading,
+                               cache_backend=cache_backend,
+                               num_workers=args.num_workers,
+                               resample_mode=c.AUDIO.RESAMPLE_MODE)
 
     if args.regenerate_full_cache:
         start_regenerate = time.time()
@@ -77,6 +88,16 @@ def main():
         print("The time of regeneration inputs is {}".format(end_update-start_update))
         exit(1)
 
+    if args.migrate_cache_to_store:
+        start_migrate = time.time()
+        audio_reader.migrate_cache_to_store()
+        end_migrate = time.time()
+        print("The time of migration is {}".format(end_migrate-start_migrate))
+        exit(1)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    main()
+    try:
+        main()
+    finally:
+        instrumentation.finish()
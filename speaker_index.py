@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILENAME = 'vectors.f32'
+SCALES_FILENAME = 'scales.f32'
+IDS_FILENAME = 'ids.json'
+
+# storage of the normalized vectors: (numpy dtype, filename of the vectors).
+STORAGE_DTYPES = {'float32': (np.float32, VECTORS_FILENAME),
+                  'float16': (np.float16, 'vectors.f16'),
+                  'int8': (np.int8, 'vectors.i8')}
+
+
+def l2_normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def quantize(x, dtype):
+    """(codes, scales) of the rows of x in dtype. int8 rows are scaled by their own max(|x|) / 127, so that
+    codes * scales ~ x. The scales are 1 for the float dtypes."""
+    x = np.asarray(x, dtype=np.float32)
+    if dtype != 'int8':
+        return x.astype(STORAGE_DTYPES[dtype][0]), np.ones(len(x), dtype=np.float32)
+    scales = np.maximum(np.max(np.abs(x), axis=-1), 1e-12) / 127
+    codes = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes, scales):
+    x = codes.astype(np.float32)
+    if codes.dtype == np.int8:
+        x *= scales[:, None]
+    return x
+
+
+def _map(filename, dtype, row_shape):
+    """Copy-on-write memory map of the rows of filename (the writes to the map stay in memory, and the file can be
+    read-only). None if the file does not exist or is empty."""
+    row_bytes = int(np.prod(row_shape)) * np.dtype(dtype).itemsize
+    rows = os.path.getsize(filename) // row_bytes if os.path.isfile(filename) else 0
+    if rows == 0:
+        return None
+    return np.memmap(filename, dtype=dtype, mode='c', shape=(rows,) + tuple(row_shape))
+
+
+def _grow(filename, dtype, row_shape, capacity):
+    """_map of at least capacity rows of filename. The file only grows."""
+    row_bytes = int(np.prod(row_shape)) * np.dtype(dtype).itemsize
+    with open(filename, 'ab') as f:
+        f.truncate(max(os.path.getsize(filename), capacity * row_bytes))
+    return _map(filename, dtype, row_shape)
+
+
+class EnrollmentIndex:
+    """Enrolled speakers as L2-normalized rows of a memory-mapped matrix, searched by cosine similarity.
+
+    Cosine similarity of normalized vectors is a dot product: a batch of queries is scored against every enrolled
+    speaker with one matrix product, and the top-k are extracted with argpartition.
+
+    The rows are stored as float32, or compactly (dtype='float16', or 'int8' with one float32 scale per row, 4x
+    smaller than float32). The compact rows are scored block by block: a block is converted to float32 and the int8
+    scores are multiplied by the scales of the rows. The dtype of an existing index is read from its ids.json.
+
+    add() and remove() only change a copy-on-write map of the files: the files on disk keep matching ids.json until
+    save() writes the changed rows, then ids.json. Opening an index does not write anything: an index directory
+    without ids.json is an error, unless create is True (the directory and the files are then created by add() and
+    save()).
+    """
+
+    def __init__(self, index_dir, dim=200, dtype='float32', block_rows=65536, create=False):
+        assert dtype in STORAGE_DTYPES, 'dtype should be one of {}.'.format(sorted(STORAGE_DTYPES))
+        self.index_dir = index_dir
+        ids_filename = os.path.join(self.index_dir, IDS_FILENAME)
+        if not create and not os.path.isfile(ids_filename):
+            raise FileNotFoundError('No enrollment index in {} ({} is missing).'.format(index_dir, IDS_FILENAME))
+        if os.path.isfile(ids_filename):
+            with open(ids_filename) as r:
+                meta = json.load(r)
+            self.dim = meta['dim']
+            self.ids = meta['ids']
+            self.dtype = meta.get('dtype', 'float32')  # indexes written before the compact storage are float32.
+        else:
+            self.dim = dim
+            self.ids = []
+            self.dtype = dtype
+        self.vectors_filename = os.path.join(self.index_dir, STORAGE_DTYPES[self.dtype][1])
+        self.scales_filename = os.path.join(self.index_dir, SCALES_FILENAME)
+        self.block_rows = block_rows
+        self.id_to_row = {speaker_id: row for (row, speaker_id) in enumerate(self.ids)}
+        self.capacity = 0
+        self.vectors = None
+        self.scales = None
+        self._dirty = set()  # rows changed since the last save().
+        if len(self.ids) > 0:
+            self.vectors = _map(self.vectors_filename, STORAGE_DTYPES[self.dtype][0], (self.dim,))
+            assert self.vectors is not None and len(self.vectors) >= len(self.ids), \
+                '{} has less than the {} rows of {}.'.format(self.vectors_filename, len(self.ids), IDS_FILENAME)
+            self.capacity = len(self.vectors)
+            if self.dtype == 'int8':
+                self.scales = _map(self.scales_filename, np.float32, ())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _reserve(self, capacity):
+        if capacity <= self.capacity:
+            return
+        # the files only grow. Rows after len(self) are free slots.
+        if not os.path.exists(self.index_dir):
+            os.makedirs(self.index_dir)
+        vectors, scales = self.vectors, self.scales
+        self.vectors = _grow(self.vectors_filename, STORAGE_DTYPES[self.dtype][0], (self.dim,), capacity)
+        self.capacity = len(self.vectors)
+        if self.dtype == 'int8':
+            self.scales = _grow(self.scales_filename, np.float32, (), self.capacity)
+        if len(self._dirty) > 0:  # the unsaved rows only live in the previous copy-on-write maps.
+            rows = np.array(sorted(self._dirty), dtype=np.int64)
+            self.vectors[rows] = vectors[rows]
+            if scales is not None:
+                self.scales[rows] = scales[rows]
+
+    def nbytes(self):
+        """Size of the enrolled rows (and of their scales)."""
+        return self.matrix().nbytes + (self.scales[:len(self.ids)].nbytes if self.scales is not None else 0)
+
+    def matrix(self):
+        """The enrolled rows, as stored (see dequantized())."""
+        if self.vectors is None:
+            return np.zeros((0, self.dim), dtype=STORAGE_DTYPES[self.dtype][0])
+        return self.vectors[:len(self.ids)]
+
+    def dequantized(self):
+        """The enrolled rows as float32."""
+        if self.dtype == 'float32' or self.vectors is None:
+            return self.matrix().astype(np.float32, copy=False)
+        return dequantize(self.matrix(), self.scales[:len(self.ids)] if self.scales is not None else None)
+
+    def add(self, speaker_ids, embeddings):
+        """Enrolls (or replaces) the speakers. embeddings has shape (len(speaker_ids), dim)."""
+        embeddings = l2_normalize(embeddings).reshape(-1, self.dim)
+        assert len(speaker_ids) == len(embeddings)
+        new_ids = [s for s in dict.fromkeys(speaker_ids) if s not in self.id_to_row]
+        if len(self.ids) + len(new_ids) > self.capacity:
+            self._reserve(max(2 * self.capacity, len(self.ids) + len(new_ids), 1024))
+        for speaker_id in new_ids:
+            self.id_to_row[speaker_id] = len(self.ids)
+            self.ids.append(speaker_id)
+        rows = np.array([self.id_to_row[s] for s in speaker_ids], dtype=np.int64)
+        codes, scales = quantize(embeddings, self.dtype)
+        self.vectors[rows] = codes
+        if self.scales is not None:
+            self.scales[rows] = scales
+        self._dirty.update(rows.tolist())
+
+    def remove(self, speaker_ids):
+        """Removes the speakers. The last row is moved into the freed slot, so the matrix stays contiguous."""
+        for speaker_id in speaker_ids:
+            row = self.id_to_row.pop(speaker_id)
+            last = len(self.ids) - 1
+            if row != last:
+                self.vectors[row] = self.vectors[last]
+                if self.scales is not None:
+                    self.scales[row] = self.scales[last]
+                self.ids[row] = self.ids[last]
+                self.id_to_row[self.ids[row]] = row
+                self._dirty.add(row)
+            self.ids.pop()
+
+    def search(self, queries, k=5, chunk_size=1024):
+        """Returns (ids, scores) of the k most similar enrolled speakers for every query, best first.
+
+        queries has shape (num_queries, dim) or (dim,). Queries are scored chunk_size at a time to bound the memory
+        of the (num_queries, num_enrolled) score matrix.
+        """
+        queries = l2_normalize(queries).reshape(-1, self.dim)
+        k = min(k, len(self.ids))
+        if k == 0:
+            return [[] for _ in queries], np.zeros((len(queries), 0), dtype=np.float32)
+        top_rows = np.empty((len(queries), k), dtype=np.int64)
+        top_scores = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), chunk_size):
+            scores = self._scores(queries[start:start + chunk_size])
+            if k < scores.shape[1]:
+                rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                rows = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+            row_scores = np.take_along_axis(scores, rows, axis=1)
+            order = np.argsort(-row_scores, axis=1)
+            top_rows[start:start + chunk_size] = np.take_along_axis(rows, order, axis=1)
+            top_scores[start:start + chunk_size] = np.take_along_axis(row_scores, order, axis=1)
+        top_ids = [[self.ids[row] for row in rows] for rows in top_rows]
+        return top_ids, top_scores
+
+    def _scores(self, queries):
+        """(len(queries), len(self)) cosine similarities."""
+        if self.dtype == 'float32':
+            return np.dot(queries, self.matrix().T)
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), self.block_rows):
+            end = min(start + self.block_rows, len(self.ids))
+            # BLAS has no int8/float16 products: one float32 block at a time bounds the memory of the conversion.
+            scores[:, start:end] = np.dot(queries, self.vectors[start:end].astype(np.float32).T)
+            if self.scales is not None:
+                scores[:, start:end] *= self.scales[start:end]
+        return scores
+
+    def save(self):
+        if len(self._dirty) > 0:
+            rows = np.array(sorted(self._dirty), dtype=np.int64)
+            for m, filename in [(self.vectors, self.vectors_filename), (self.scales, self.scales_filename)]:
+                if m is not None:
+                    f = np.memmap(filename, dtype=m.dtype, mode='r+', shape=m.shape)
+                    f[rows] = m[rows]
+                    f.flush()
+                    del f
+            self._dirty.clear()
+        if not os.path.exists(self.index_dir):  # nothing was added to a new index.
+            os.makedirs(self.index_dir)
+        ids_filename = os.path.join(self.index_dir, IDS_FILENAME)
+        with open(ids_filename + '.tmp', 'w') as w:
+            json.dump({'dim': self.dim, 'dtype': self.dtype, 'ids': self.ids}, w)
+        os.replace(ids_filename + '.tmp', ids_filename)
+        logger.info('[DUMP ENROLLMENT INDEX] {} {} speakers in {}.'.format(len(self.ids), self.dtype, self.index_dir))
@@ -1,9 +1,134 @@
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import instrumentation
+
+WINDOW_LENGTH_SEC = 25.0 / 1000
+WINDOW_STEP_SEC = 10.0 / 1000
+NB_FEATURES = 13
+CONTEXT_FRAMES = 10  # number of 39-dim frames stacked into one 390-dim input.
+CONTEXT_STEP = 3
+
+_filterbanks = {}
 
 
 def get_mfcc_features_390(sig, rate, max_frames=None):
-    window_length_sec = 25.0 / 1000
-    window_step_sec = 10.0 / 1000
+    """Batched version of get_mfcc_features_390_reference. Same output, computed in a few NumPy passes."""
+    with instrumentation.timer('features.mfcc'):
+        windows = _windows(sig, rate, max_frames)
+        if windows is None:
+            return np.zeros((0, 3 * NB_FEATURES * CONTEXT_FRAMES))
+        new_feat_mat = _stack_context(batch_mfcc_features(windows, rate))
+        if max_frames is not None:
+            new_feat_mat = new_feat_mat[0:max_frames]
+    instrumentation.count('features.frames', len(new_feat_mat))
+    return new_feat_mat
+
+
+def batch_get_mfcc_features_390(signals, rate, max_windows=20000):
+    """get_mfcc_features_390 of every signal of the list. The 25ms windows of several signals go through one
+    batch_mfcc_features call, max_windows windows at most (about 32MB of float64 windows at 8kHz)."""
+    results = [None] * len(signals)
+    batch, batch_windows = [], 0
+
+    def flush():
+        if len(batch) == 0:
+            return
+        with instrumentation.timer('features.mfcc'):
+            feat_mat = batch_mfcc_features(np.concatenate([w for (_, w) in batch]), rate)
+        start = 0
+        for i, windows in batch:
+            results[i] = _stack_context(feat_mat[start:start + len(windows)])
+            start += len(windows)
+            instrumentation.count('features.frames', len(results[i]))  # 390-dim frames, like get_mfcc_features_390.
+        del batch[:]
+
+    for i, sig in enumerate(signals):
+        windows = _windows(sig, rate)
+        if windows is None:
+            results[i] = np.zeros((0, 3 * NB_FEATURES * CONTEXT_FRAMES))
+            continue
+        if batch_windows + len(windows) > max_windows:
+            flush()
+            batch_windows = 0
+        batch.append((i, windows))
+        batch_windows += len(windows)
+    flush()
+    return results
+
+
+def _windows(sig, rate, max_frames=None):
+    """(num_windows, window_size) strided view of the 25ms windows every 10ms, None if there are less than
+    CONTEXT_FRAMES windows."""
+    window_cnn_fr_size = int(WINDOW_LENGTH_SEC * rate)  # window size in frames
+    window_cnn_fr_steps = int(WINDOW_STEP_SEC * rate)  # the step size in frames. if step < window, overlap!
+    # the reference implementation discards every window whose duration is not exactly 25ms.
+    if window_cnn_fr_size / rate != WINDOW_LENGTH_SEC:
+        return None
+    sig = np.asarray(sig).reshape(-1)
+    if not np.issubdtype(sig.dtype, np.floating):
+        sig = sig.astype(float)
+    if max_frames is not None:
+        # only compute the windows needed by the first max_frames stacked frames.
+        needed_windows = CONTEXT_STEP * (max_frames - 1) + CONTEXT_FRAMES
+        sig = sig[:window_cnn_fr_steps * (needed_windows - 1) + window_cnn_fr_size]
+    num_windows = (len(sig) - window_cnn_fr_size) // window_cnn_fr_steps + 1
+    if num_windows < CONTEXT_FRAMES or (max_frames is not None and max_frames <= 0):
+        return None
+    return as_strided(sig, shape=(num_windows, window_cnn_fr_size),
+                      strides=(sig.strides[0] * window_cnn_fr_steps, sig.strides[0]))
+
+
+def _stack_context(feat_mat):
+    # CONTEXT_FRAMES consecutive 39-dim windows, every CONTEXT_STEP windows, flattened as (39, 10).
+    feat_mat = np.ascontiguousarray(feat_mat)
+    num_stacked = (len(feat_mat) - CONTEXT_FRAMES) // CONTEXT_STEP + 1
+    stacked = as_strided(feat_mat, shape=(num_stacked, CONTEXT_FRAMES, feat_mat.shape[1]),
+                         strides=(feat_mat.strides[0] * CONTEXT_STEP, feat_mat.strides[0], feat_mat.strides[1]))
+    return np.ascontiguousarray(stacked.transpose(0, 2, 1)).reshape(num_stacked, -1)  # (39, 10).flatten()
+
+
+def batch_mfcc_features(frames, rate, nb_features=NB_FEATURES, nfft=512, preemph=0.97, ceplifter=22):
+    """mfcc_features applied to every row of frames (num_windows, window_size) at once.
+
+    Each window is processed as an independent signal, exactly like the per-window calls of mfcc_features:
+    pre-emphasis restarts at the first sample of every window and the deltas see a one-frame sequence.
+    """
+    from python_speech_features.base import get_filterbanks, lifter
+    from python_speech_features.sigproc import powspec
+    from scipy.fftpack import dct
+    emphasized = np.empty_like(frames)
+    emphasized[:, 0] = frames[:, 0]
+    np.subtract(frames[:, 1:], preemph * frames[:, :-1], out=emphasized[:, 1:])
+    pspec = powspec(emphasized, nfft)
+    energy = np.sum(pspec, 1)
+    energy = np.where(energy == 0, np.finfo(float).eps, energy)
+
+    key = (nb_features, nfft, rate)
+    if key not in _filterbanks:
+        _filterbanks[key] = get_filterbanks(nb_features, nfft, rate, 0, rate / 2).T
+    feat = np.dot(pspec, _filterbanks[key])
+    feat = np.where(feat == 0, np.finfo(float).eps, feat)
+    feat = dct(np.log(feat), type=2, axis=1, norm='ortho')[:, :nb_features]
+    feat = lifter(feat, ceplifter)
+    feat[:, 0] = np.log(energy)
+
+    delta_feat = _single_frame_delta(feat, 2)
+    double_delta_feat = _single_frame_delta(delta_feat, 2)
+    return np.concatenate((feat, delta_feat, double_delta_feat), axis=1)
+
+
+def _single_frame_delta(feat, n):
+    # python_speech_features.delta on sequences of length one: the edge padding repeats the only frame.
+    denominator = 2 * sum([i ** 2 for i in range(1, n + 1)])
+    padded = np.repeat(feat[:, np.newaxis, :], 2 * n + 1, axis=1)
+    return np.tensordot(np.arange(-n, n + 1), padded, axes=(0, 1)) / denominator
+
+
+def get_mfcc_features_390_reference(sig, rate, max_frames=None):
+    """Original window-by-window implementation. Kept to check get_mfcc_features_390 against it."""
+    window_length_sec = WINDOW_LENGTH_SEC
+    window_step_sec = WINDOW_STEP_SEC
     window_cnn_fr_size = int(window_length_sec * rate)  # window size in frames
     window_cnn_fr_steps = int(window_step_sec * rate)  # the step size in frames. if step < window, overlap!
     feat_mat = []
@@ -29,7 +154,7 @@ def get_mfcc_features_390(sig, rate, max_frames=None):
     return new_feat_mat
 
 
-def mfcc_features(sig, rate, nb_features=13):
+def mfcc_features(sig, rate, nb_features=NB_FEATURES):
     from python_speech_features import mfcc, delta
     mfcc_feat = mfcc(sig, rate, numcep=nb_features, nfilt=nb_features)
     delta_feat = delta(mfcc_feat, 2)
@@ -0,0 +1,150 @@
+import logging
+import time
+from math import ceil, gcd
+
+import numpy as np
+
+from feature_stats import RunningStats
+from speech_features import WINDOW_LENGTH_SEC, WINDOW_STEP_SEC, CONTEXT_FRAMES, CONTEXT_STEP, \
+    get_mfcc_features_390
+
+logger = logging.getLogger(__name__)
+
+
+def stream_audio(filename, sample_rate, block_seconds=30.0):
+    """Yields the audio of filename, mono and resampled to sample_rate, block_seconds at a time.
+
+    Decoded with soundfile and resampled with the same polyphase filter as read_audio_polyphase. Every block is
+    resampled with enough input context on both sides to cover the filter, so the concatenated blocks are the
+    resampled signal of the whole file.
+    """
+    import soundfile
+    from scipy.signal import resample_poly
+    from audio_reader import polyphase_filter
+    with soundfile.SoundFile(filename) as f:
+        orig_sr = f.samplerate
+        if orig_sr == sample_rate:
+            for block in f.blocks(blocksize=int(block_seconds * orig_sr), dtype='float32', always_2d=True):
+                yield np.mean(block, axis=1)
+            return
+        g = gcd(sample_rate, orig_sr)
+        up, down = sample_rate // g, orig_sr // g
+        window = polyphase_filter(up, down)
+        # input samples on each side of a block covered by the filter, rounded to a multiple of down so that
+        # every block starts on an output sample.
+        pad = down * (ceil((len(window) // 2) / up / down) + 1)
+        block_size = down * max(1, int(block_seconds * orig_sr) // down)
+        buf, buf_start, pos, eof = np.zeros(0, dtype=np.float32), 0, 0, False
+        while True:
+            while not eof and len(buf) - (pos - buf_start) < block_size + pad:
+                data = f.read(block_size, dtype='float32', always_2d=True)
+                if len(data) == 0:
+                    eof = True
+                    break
+                buf = np.concatenate([buf, np.mean(data, axis=1)])
+            available = len(buf) - (pos - buf_start)
+            if available <= 0:
+                return
+            size = min(block_size, available)
+            left, right = pos - buf_start, min(pad, available - size)
+            out = resample_poly(buf[:left + size + right], up, down, window=window)
+            first = left * up // down
+            yield out[first:first + int(ceil((pos + size) * up / down)) - pos * up // down].astype(np.float32)
+            pos += size
+            # keeps the left context of the next block only.
+            drop = max(0, pos - pad) - buf_start
+            buf, buf_start = buf[drop:], buf_start + drop
+
+
+def stream_features(audio_blocks, sample_rate, chunk_frames=1000):
+    """Yields the MFCC-390 frames of a stream of audio blocks, at most chunk_frames at a time.
+
+    Each chunk is computed on the samples of its own frames only: consecutive chunks overlap by the samples of the
+    context windows they share (25ms windows every 10ms, 10 windows every 3 windows). The chunks put end to end are
+    get_mfcc_features_390 of the whole signal.
+    """
+    window_size = int(WINDOW_LENGTH_SEC * sample_rate)
+    window_step = int(WINDOW_STEP_SEC * sample_rate)
+    frame_step = CONTEXT_STEP * window_step  # samples between two consecutive 390-dim frames.
+    chunk_samples = frame_step * (chunk_frames - 1) + (CONTEXT_FRAMES - 1) * window_step + window_size
+    buf = np.zeros(0, dtype=np.float32)
+    for block in audio_blocks:
+        buf = np.concatenate([buf, block])
+        while len(buf) >= chunk_samples:
+            yield get_mfcc_features_390(buf[:chunk_samples], sample_rate)
+            buf = buf[chunk_frames * frame_step:]
+    feat = get_mfcc_features_390(buf, sample_rate)
+    if len(feat) > 0:
+        yield feat
+
+
+def stream_embeddings(predict_fn, filename, sample_rate, segment_seconds=10.0, hop_seconds=None,
+                      chunk_frames=1000, block_seconds=30.0, stats=None):
+    """Yields (start_sec, end_sec, embedding) for segments of segment_seconds every hop_seconds of filename.
+
+    predict_fn maps a (num_frames, 390) matrix to the (num_frames, emb_dim) frame embeddings. The features are
+    normalized by the running mean and std of the frames seen so far (stats, a RunningStats, updated in place),
+    because the statistics of the whole recording are not known until its end. Memory is bounded by one audio
+    block, one feature chunk and one segment of frame embeddings, whatever the length of the recording.
+    The last segment is shorter if the recording does not end on a hop.
+    """
+    hop_seconds = segment_seconds if hop_seconds is None else hop_seconds
+    frame_seconds = CONTEXT_STEP * WINDOW_STEP_SEC
+    context_seconds = (CONTEXT_FRAMES - 1) * WINDOW_STEP_SEC + WINDOW_LENGTH_SEC
+    segment_frames = max(1, int(round(segment_seconds / frame_seconds)))
+    hop_frames = max(1, int(round(hop_seconds / frame_seconds)))
+    stats = RunningStats() if stats is None else stats
+
+    def segment(start, embeddings):
+        end = start + len(embeddings)
+        return start * frame_seconds, (end - 1) * frame_seconds + context_seconds, np.mean(embeddings, axis=0)
+
+    pending = None  # frame embeddings from frame pending_start on.
+    pending_start, next_start, num_frames, covered = 0, 0, 0, 0
+    for feat in stream_features(stream_audio(filename, sample_rate, block_seconds), sample_rate, chunk_frames):
+        stats.update(feat)
+        embeddings = predict_fn((feat - stats.pooled_mean()) / stats.pooled_std())
+        pending = embeddings if pending is None else np.concatenate([pending, embeddings])
+        num_frames += len(embeddings)
+        while next_start + segment_frames <= num_frames:
+            offset = next_start - pending_start
+            yield segment(next_start, pending[offset:offset + segment_frames])
+            covered = next_start + segment_frames
+            next_start += hop_frames
+        drop = min(next_start, num_frames) - pending_start
+        pending, pending_start = pending[drop:], pending_start + drop
+    if covered < num_frames and next_start < num_frames:
+        yield segment(next_start, pending[next_start - pending_start:])
+
+
+def compute_stream_embeddings(filename, output_filename, sample_rate, segment_seconds=10.0, hop_seconds=None,
+                              chunk_frames=1000, checkpoints_dir='checkpoints', numpy_embedder=None):
+    """Embeds a long recording segment by segment. Writes output_filename (.npz) with the segment boundaries, the
+    segment embeddings and the mean embedding of all the frames of the recording."""
+    from numpy_embedder import load_predict_fn
+    model_fn = load_predict_fn(checkpoints_dir, numpy_embedder=numpy_embedder)
+    totals = {'sum': 0.0, 'frames': 0}
+
+    def predict_fn(feat):
+        embeddings = model_fn(feat)
+        totals['sum'] = totals['sum'] + np.sum(embeddings, axis=0, dtype=np.float64)
+        totals['frames'] += len(embeddings)
+        return embeddings
+
+    start_time = time.time()
+    starts, ends, embeddings = [], [], []
+    for start, end, embedding in stream_embeddings(predict_fn, filename, sample_rate, segment_seconds, hop_seconds,
+                                                   chunk_frames):
+        starts.append(start)
+        ends.append(end)
+        embeddings.append(embedding)
+        if len(embeddings) % 100 == 0:
+            logger.info('{} segments, {:.1f}s of audio, {:.1f}x real time.'.format(
+                len(embeddings), end, end / (time.time() - start_time)))
+    assert totals['frames'] != 0, 'No feature frame in {}.'.format(filename)
+    np.savez(output_filename, segment_starts=np.array(starts), segment_ends=np.array(ends),
+             segment_embeddings=np.array(embeddings, dtype=np.float32),
+             embedding=(totals['sum'] / totals['frames']).astype(np.float32))
+    logger.info('[DUMP STREAM EMBEDDINGS] {} segments of {} in {} ({:.1f}s).'.format(
+        len(embeddings), filename, output_filename, time.time() - start_time))
+    return np.array(starts), np.array(ends), np.array(embeddings)
@@ -13,8 +13,12 @@ from keras.layers import Dense, Lambda
 from keras.optimizers import Adam
 from natsort import natsorted
 
+import instrumentation
 from constants import c
-from triplet_loss import deep_speaker_loss
+from triplet_loss import deep_speaker_loss, active_triplets
+from triplet_mining import HardNegativeMiner, embed_batches
+from training_set import load_training_set
+from triplet_sampler import TripletSampler
 from utils import data_to_keras
 
 BATCH_SIZE = 900
@@ -37,6 +41,13 @@ def get_script_arguments():
     parser.add_argument('--loss_on_embeddings', action='store_true')
     parser.add_argument('--freeze_embedding_weights', action='store_true')
     parser.add_argument('--normalize_embeddings', action='store_true')
+    # generate the features from the audio cache while training, instead of reading the precomputed inputs.
+    parser.add_argument('--online', action='store_true')
+    parser.add_argument('--num_workers', type=int, default=None)
+    # semi-hard negative speakers and frames, picked from embeddings refreshed every --mining_refresh_steps steps.
+    parser.add_argument('--hard_negatives', action='store_true')
+    parser.add_argument('--mining_refresh_steps', type=int, default=200)
+    instrumentation.add_arguments(parser)
     args = get_arguments(parser)
     return args
 
@@ -55,10 +66,11 @@ def triplet_softmax_model(num_speakers_softmax, batch_size=BATCH_SIZE,
     return Model(inputs=[inp], outputs=[embeddings, softmax])
 
 
-def compile_triplet_softmax_model(m: Model, loss_on_softmax=True, loss_on_embeddings=False):
+def compile_triplet_softmax_model(m: Model, loss_on_softmax=True, loss_on_embeddings=False, sparse_labels=False):
+    # with sparse_labels, the targets are integer speaker indices instead of one-hot vectors.
     losses = {
         'embeddings': deep_speaker_loss,
-        'softmax': 'categorical_crossentropy',
+        'softmax': 'sparse_categorical_crossentropy' if sparse_labels else 'categorical_crossentropy',
     }
 
     loss_weights = {
@@ -71,11 +83,17 @@ def compile_triplet_softmax_model(m: Model, loss_on_softmax=True, loss_on_embedd
     m.compile(optimizer=Adam(lr=0.001),
               loss=losses,
               loss_weights=loss_weights,
-              metrics=['accuracy'])
+              metrics={'embeddings': ['accuracy', active_triplets], 'softmax': ['accuracy']})
 
 
 def fit_model(m, kx_train, ky_train, kx_test, ky_test,
-              batch_size=BATCH_SIZE, max_grad_steps=1000000, initial_epoch=0):
+              batch_size=BATCH_SIZE, max_grad_steps=1000000, initial_epoch=0, sampler=None, hard_negatives=False,
+              mining_refresh_steps=200):
+    """sampler provides the batches (an OnlineInputs in triplet mode). By default, a TripletSampler on kx/ky.
+
+    With hard_negatives, the TripletSampler picks semi-hard negatives with a HardNegativeMiner, whose embeddings are
+    refreshed with the current model every mining_refresh_steps steps.
+    """
     # TODO: use this callback checkpoint.
     # checkpoint = ModelCheckpoint(monitor='val_acc', filepath='checkpoints/model_{epoch:02d}_{val_acc:.3f}.h5',
     #                              save_best_only=True)
@@ -89,71 +107,76 @@ def fit_model(m, kx_train, ky_train, kx_test, ky_test,
     # negative = second one.
     # order is [anchor, positive, negative].
 
-    def select_inputs_and_outputs_for_speaker(x, y, speaker_id_):
-        indices = np.random.choice(np.where(y.argmax(axis=1) == speaker_id_)[0], size=batch_size // 3)
-        return x[indices], y[indices]
-
     print()
     print()
-    assert sorted(set(ky_test.argmax(axis=1))) == sorted(set(ky_train.argmax(axis=1)))
-    num_different_speakers = len(set(ky_train.argmax(axis=1)))
-    print('num different speakers =', num_different_speakers)
-    deque_size = 100
-    train_overall_loss_emb = deque(maxlen=deque_size)
-    test_overall_loss_emb = deque(maxlen=deque_size)
-    train_overall_loss_softmax = deque(maxlen=deque_size)
-    test_overall_loss_softmax = deque(maxlen=deque_size)
-    # TODO: not very much epoch here.
-    for epoch in range(initial_epoch, max_grad_steps):
-        two_different_speakers = np.random.choice(range(num_different_speakers), size=2, replace=False)
-        anchor_positive_speaker = two_different_speakers[0]
-        # negative_speaker = two_different_speakers[0]
-        negative_speaker = two_different_speakers[1]
-        assert negative_speaker != anchor_positive_speaker
-
-        train_inputs_outputs = [
-            select_inputs_and_outputs_for_speaker(kx_train, ky_train, anchor_positive_speaker),
-            select_inputs_and_outputs_for_speaker(kx_train, ky_train, anchor_positive_speaker),
-            select_inputs_and_outputs_for_speaker(kx_train, ky_train, negative_speaker)
-        ]
-        inputs = np.vstack([v[0] for v in train_inputs_outputs])
-        outputs = np.vstack([v[1] for v in train_inputs_outputs])
-
-        train_loss = m.train_on_batch(inputs, {'embeddings': outputs * 0, 'softmax': outputs})
-        train_loss = dict(zip(m.metrics_names, train_loss))
-        train_overall_loss_emb.append(train_loss['embeddings_loss'])
-        train_overall_loss_softmax.append(train_loss['softmax_loss'])
-
-        test_inputs_outputs = [
-            select_inputs_and_outputs_for_speaker(kx_test, ky_test, anchor_positive_speaker),
-            select_inputs_and_outputs_for_speaker(kx_test, ky_test, anchor_positive_speaker),
-            select_inputs_and_outputs_for_speaker(kx_test, ky_test, negative_speaker)
-        ]
-
-        test_inputs = np.vstack([v[0] for v in test_inputs_outputs])
-        test_outputs = np.vstack([v[1] for v in test_inputs_outputs])
-
-        test_loss = m.test_on_batch(test_inputs, {'embeddings': test_outputs * 0, 'softmax': test_outputs})
-        test_loss = dict(zip(m.metrics_names, test_loss))
-        test_overall_loss_emb.append(test_loss['embeddings_loss'])
-        test_overall_loss_softmax.append(test_loss['softmax_loss'])
-
-        if epoch % 10 == 0:
-            format_str = '{0}, train(emb, last {3}) = {1:.5f} test(emb, last {3}) = {2:.5f}.'
-            print(format_str.format(str(epoch).zfill(6),
-                                    np.mean(train_overall_loss_emb),
-                                    np.mean(test_overall_loss_emb),
-                                    deque_size))
-
-        if epoch % 100 == 0:
-            print('train metrics =', train_loss)
-            print('test metrics =', test_loss)
-            m.save_weights('checkpoints/unified_model_checkpoints_{}.h5'.format(epoch), overwrite=True)
-            print('Last two speakers were {} and {}.'.format(anchor_positive_speaker, negative_speaker))
-            print('Saving...')
-
-
-def fit_model_softmax(m, kx_train, ky_train, kx_test, ky_test, batch_size=BATCH_SIZE, max_epochs=1000, initial_epoch=0):
+    miner = None
+    if sampler is None:
+        # ky_train and ky_test are either one-hot matrices or integer labels (sparse_labels).
+        one_hot = ky_train.ndim == 2
+        y_train = ky_train.argmax(axis=1) if one_hot else ky_train
+        y_test = ky_test.argmax(axis=1) if one_hot else ky_test
+        assert sorted(set(y_test)) == sorted(set(y_train))
+        num_different_speakers = len(set(y_train))
+        print('num different speakers =', num_different_speakers)
+        if hard_negatives:
+            miner = HardNegativeMiner(kx_train, y_train, m.get_layer('softmax').units,
+                                      refresh_every=mining_refresh_steps)
+        # the batches are prepared in a background thread while the model trains on the previous one.
+        sampler = TripletSampler(kx_train, y_train, kx_test, y_test, batch_size=batch_size,
+                                 num_speakers=m.get_layer('softmax').units, one_hot=one_hot, miner=miner)
+    sampler.start()
+    try:
+        deque_size = 100
+        train_overall_loss_emb = deque(maxlen=deque_size)
+        test_overall_loss_emb = deque(maxlen=deque_size)
+        train_overall_loss_softmax = deque(maxlen=deque_size)
+        test_overall_loss_softmax = deque(maxlen=deque_size)
+        train_active_triplets = deque(maxlen=deque_size)  # triplets with a non-zero loss (giving a gradient), per step.
+        # TODO: not very much epoch here.
+        for epoch in range(initial_epoch, max_grad_steps):
+            if miner is not None and (epoch - initial_epoch) % miner.refresh_every == 0:
+                with instrumentation.timer('train.mining_refresh'):
+                    miner.refresh(lambda x: embed_batches(m, x, batch_size))
+            with instrumentation.timer('train.next_batch'):  # waiting for the sampler.
+                anchor_positive_speaker, negative_speaker, inputs, outputs, test_inputs, test_outputs = \
+                    sampler.next_batch()
+            assert negative_speaker != anchor_positive_speaker
+
+            with instrumentation.timer('train.step'):
+                train_loss = m.train_on_batch(inputs, {'embeddings': outputs * 0, 'softmax': outputs})
+            instrumentation.count('train.frames', len(inputs))
+            train_loss = dict(zip(m.metrics_names, train_loss))
+            train_overall_loss_emb.append(train_loss['embeddings_loss'])
+            train_overall_loss_softmax.append(train_loss['softmax_loss'])
+            train_active_triplets.append(train_loss['embeddings_active_triplets'] * (batch_size // 3))
+
+            with instrumentation.timer('train.test_step'):
+                test_loss = m.test_on_batch(test_inputs, {'embeddings': test_outputs * 0, 'softmax': test_outputs})
+            test_loss = dict(zip(m.metrics_names, test_loss))
+            test_overall_loss_emb.append(test_loss['embeddings_loss'])
+            test_overall_loss_softmax.append(test_loss['softmax_loss'])
+
+            if epoch % 10 == 0:
+                format_str = '{0}, train(emb, last {3}) = {1:.5f} test(emb, last {3}) = {2:.5f} ' \
+                             'active triplets(last {3}) = {4:.1f}/{5}.'
+                print(format_str.format(str(epoch).zfill(6),
+                                        np.mean(train_overall_loss_emb),
+                                        np.mean(test_overall_loss_emb),
+                                        deque_size,
+                                        np.mean(train_active_triplets),
+                                        batch_size // 3))
+
+            if epoch % 100 == 0:
+                print('train metrics =', train_loss)
+                print('test metrics =', test_loss)
+                m.save_weights('checkpoints/unified_model_checkpoints_{}.h5'.format(epoch), overwrite=True)
+                print('Last two speakers were {} and {}.'.format(anchor_positive_speaker, negative_speaker))
+                print('Saving...')
+    finally:
+        sampler.stop()
+
+
+def softmax_callbacks():
     checkpoint = ModelCheckpoint(filepath='checkpoints/unified_model_checkpoints_{epoch}.h5',
                                  period=10)
     # if the accuracy does not increase by 1.0% over 10 epochs, we stop the training.
@@ -162,6 +185,15 @@ def fit_model_softmax(m, kx_train, ky_train, kx_test, ky_test, batch_size=BATCH_
     # if the accuracy does not increase over 10 epochs, we reduce the learning rate by half.
     reduce_lr = ReduceLROnPlateau(monitor='val_softmax_acc', factor=0.5, patience=10, min_lr=0.0001, verbose=1)
 
+    class WarningCallback(Callback):
+        def on_epoch_end(self, epoch, logs=None):
+            print('The embedding loss here does not make sense. Do not get fooled by it. '
+                  'Triplets are not generated here. We train the embedding weights first.')
+
+    return [early_stopping, reduce_lr, checkpoint, WarningCallback()]
+
+
+def fit_model_softmax(m, kx_train, ky_train, kx_test, ky_test, batch_size=BATCH_SIZE, max_epochs=1000, initial_epoch=0):
     max_len_train = len(kx_train) - len(kx_train) % batch_size
 
     kx_train = kx_train[0:max_len_train]
@@ -174,11 +206,6 @@ def fit_model_softmax(m, kx_train, ky_train, kx_test, ky_test, batch_size=BATCH_
     print('The embedding loss here does not make sense. Do not get fooled by it. Triplets are not present here.')
     print('We train the embedding weights first.')
 
-    class WarningCallback(Callback):
-        def on_epoch_end(self, epoch, logs=None):
-            print('The embedding loss here does not make sense. Do not get fooled by it. '
-                  'Triplets are not generated here. We train the embedding weights first.')
-
     m.fit(kx_train,
           {'embeddings': ky_train, 'softmax': ky_train},
           batch_size=batch_size,
@@ -186,7 +213,41 @@ def fit_model_softmax(m, kx_train, ky_train, kx_test, ky_test, batch_size=BATCH_
           initial_epoch=initial_epoch,
           verbose=1,
           validation_data=(kx_test, {'embeddings': ky_test, 'softmax': ky_test}),
-          callbacks=[early_stopping, reduce_lr, checkpoint, WarningCallback()])
+          callbacks=softmax_callbacks())
+
+
+def fit_model_softmax_online(m, online_inputs, batch_size=BATCH_SIZE, steps_per_epoch=1000, max_epochs=1000,
+                             initial_epoch=0):
+    """Same as fit_model_softmax, on batches generated while training (OnlineInputs in softmax mode).
+
+    The validation set is generated once from the test utterances, so that the callbacks compare the epochs on the
+    same frames.
+    """
+    kx_test, ky_test = online_inputs.validation_data()
+    max_len_test = len(kx_test) - len(kx_test) % batch_size  # the input layer has a fixed batch size.
+    ky_test = {k: v[0:max_len_test] for (k, v) in ky_test.items()}
+    kx_test = kx_test[0:max_len_test]
+
+    print('The embedding loss here does not make sense. Do not get fooled by it. Triplets are not present here.')
+    print('We train the embedding weights first.')
+
+    def validation_generator():  # full batches, like the training ones.
+        while True:
+            for i in range(0, max_len_test, batch_size):
+                yield kx_test[i:i + batch_size], {k: v[i:i + batch_size] for (k, v) in ky_test.items()}
+
+    online_inputs.start()
+    try:
+        m.fit_generator(online_inputs.generator(),
+                        steps_per_epoch=steps_per_epoch,
+                        epochs=initial_epoch + max_epochs,
+                        initial_epoch=initial_epoch,
+                        verbose=1,
+                        validation_data=validation_generator(),
+                        validation_steps=max_len_test // batch_size,
+                        callbacks=softmax_callbacks())
+    finally:
+        online_inputs.stop()
 
 
 def start_training():
@@ -195,21 +256,45 @@ def start_training():
         os.makedirs('checkpoints')
 
     args = get_script_arguments()
+    instrumentation.setup(args)
     if not args.loss_on_softmax and not args.loss_on_embeddings:
         print('Please provide at least --loss_on_softmax or --loss_on_embeddings.')
         exit(1)
 
 
-    data_filename = "deep-speaker-data/cache/full_inputs.pkl"
-    assert os.path.exists(data_filename), 'Data does not exist.'
-    print('Loading the inputs in memory. It might take a while...')
-    data = pickle.load(open(data_filename, 'rb'))
-    kx_train, ky_train, kx_test, ky_test, categorical_speakers = data_to_keras(data)
-
-    print(categorical_speakers.speaker_ids)
-    print(len(categorical_speakers.speaker_ids))
-
-    assert c.AUDIO.SPEAKERS_TRAINING_SET == categorical_speakers.speaker_ids
+    online_inputs = None
+    if args.online:
+        # no precomputed inputs: the workers read the audio cache (use CACHE_BACKEND mmap to share it between them).
+        from audio_reader import AudioReader
+        from online_inputs import OnlineInputs
+        audio_reader = AudioReader(input_audio_dir="deep-speaker-data/VCTK-Corpus",
+                                   output_cache_dir="deep-speaker-data/cache/",
+                                   sample_rate=c.AUDIO.SAMPLE_RATE,
+                                   cache_backend=c.AUDIO.CACHE_BACKEND)
+        speaker_ids = c.AUDIO.SPEAKERS_TRAINING_SET
+        online_inputs = OnlineInputs(audio_reader, speaker_ids,
+                                     mode='softmax' if args.loss_on_softmax else 'triplet',
+                                     batch_size=BATCH_SIZE,
+                                     num_workers=args.num_workers)
+        online_inputs.start()  # the workers are forked before the model is built.
+    else:
+        training_set_dir = "deep-speaker-data/cache/training_set"
+        data_filename = "deep-speaker-data/cache/full_inputs.pkl"
+        if os.path.exists(training_set_dir):
+            print('Loading the inputs from {} (memory-mapped).'.format(training_set_dir))
+            data = load_training_set(training_set_dir)
+        else:
+            # full_inputs.pkl was written by older versions of preprocess.py.
+            assert os.path.exists(data_filename), 'Data does not exist.'
+            print('Loading the inputs in memory. It might take a while...')
+            data = pickle.load(open(data_filename, 'rb'))
+        kx_train, ky_train, kx_test, ky_test, categorical_speakers = data_to_keras(data, one_hot=False)
+        speaker_ids = categorical_speakers.speaker_ids
+
+    print(speaker_ids)
+    print(len(speaker_ids))
+
+    assert c.AUDIO.SPEAKERS_TRAINING_SET == speaker_ids
     # assert len(categorical_speakers.speaker_ids) == 80
 
     emb_trainable = True
@@ -217,13 +302,14 @@ def start_training():
         print('FrEeZiNg tHe eMbeDdInG wEiGhTs.')
         emb_trainable = False
 
-    m = triplet_softmax_model(num_speakers_softmax=len(categorical_speakers.speaker_ids),
+    m = triplet_softmax_model(num_speakers_softmax=len(speaker_ids),
                               emb_trainable=emb_trainable,
                               normalize_embeddings=args.normalize_embeddings)
 
     checkpoints = natsorted(glob('checkpoints/*.h5'))
 
-    compile_triplet_softmax_model(m, loss_on_softmax=args.loss_on_softmax, loss_on_embeddings=args.loss_on_embeddings)
+    compile_triplet_softmax_model(m, loss_on_softmax=args.loss_on_softmax, loss_on_embeddings=args.loss_on_embeddings,
+                                  sparse_labels=True)
     print(m.summary())
 
     initial_epoch = 0
@@ -234,12 +320,24 @@ def start_training():
         print('Loading checkpoint: {}.'.format(checkpoint_file))
         m.load_weights(checkpoint_file)  # latest one.
 
-    if args.loss_on_softmax:
+    if args.online and args.loss_on_softmax:
+        print('Softmax pre-training (online inputs).')
+        fit_model_softmax_online(m, online_inputs, initial_epoch=initial_epoch)
+    elif args.online:
+        try:
+            fit_model(m, None, None, None, None, initial_epoch=initial_epoch, sampler=online_inputs)
+        finally:
+            online_inputs.stop()
+    elif args.loss_on_softmax:
         print('Softmax pre-training.')
         fit_model_softmax(m, kx_train, ky_train, kx_test, ky_test, initial_epoch=initial_epoch)
     else:
-        fit_model(m, kx_train, ky_train, kx_test, ky_test, initial_epoch=initial_epoch)
+        fit_model(m, kx_train, ky_train, kx_test, ky_test, initial_epoch=initial_epoch,
+                  hard_negatives=args.hard_negatives, mining_refresh_steps=args.mining_refresh_steps)
 
 
 if __name__ == '__main__':
-    start_training()
+    try:
+        start_training()
+    finally:
+        instrumentation.finish()
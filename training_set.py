@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from feature_stats import RunningStats
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.json'
+FEATURES_DTYPE = np.float32
+
+
+def _features_filename(training_set_dir, speaker_id, split):
+    return os.path.join(training_set_dir, '{}_{}.npy'.format(speaker_id, split))
+
+
+def read_index(training_set_dir):
+    index_filename = os.path.join(training_set_dir, INDEX_FILENAME)
+    if not os.path.isfile(index_filename):
+        return {'speakers': {}}
+    with open(index_filename) as r:
+        return json.load(r)
+
+
+def _write_index(training_set_dir, index):
+    # written next to the final file then renamed, so that an interrupted run never leaves a truncated index.
+    index_filename = os.path.join(training_set_dir, INDEX_FILENAME)
+    with open(index_filename + '.tmp', 'w') as w:
+        json.dump(index, w, indent=2, sort_keys=True)
+    os.replace(index_filename + '.tmp', index_filename)
+
+
+def add_speaker(training_set_dir, inputs):
+    """Appends the inputs of one speaker (output of InputsGenerator.generate_inputs) to the training set.
+
+    The train and test crops are stacked into one (num_frames, 390) matrix each, saved as .npy files.
+    """
+    if not os.path.exists(training_set_dir):
+        os.makedirs(training_set_dir)
+    speaker_id = inputs['speaker_id']
+    entry = {'mean_train': float(inputs['mean_train']), 'std_train': float(inputs['std_train'])}
+    for split in ['train', 'test']:
+        crops = inputs[split]
+        features = np.vstack(crops).astype(FEATURES_DTYPE) if len(crops) > 0 else np.zeros((0, 390), FEATURES_DTYPE)
+        np.save(_features_filename(training_set_dir, speaker_id, split), features)
+        entry['num_{}'.format(split)] = len(features)
+    index = read_index(training_set_dir)
+    if 'stats_train' in inputs:  # per-dimension statistics, not in the pkl files of older versions.
+        entry['stats_train'] = inputs['stats_train']
+    index['speakers'][speaker_id] = entry
+    index['global_stats_train'] = global_stats(index).to_dict()
+    _write_index(training_set_dir, index)
+    logger.info('[ADD SPEAKER TO TRAINING SET] {} ({} train, {} test).'.format(speaker_id, entry['num_train'],
+                                                                            entry['num_test']))
+
+
+def global_stats(index):
+    """Per-dimension statistics of the train frames of all the speakers, merged from the per-speaker ones."""
+    stats = RunningStats()
+    for entry in index['speakers'].values():
+        if 'stats_train' in entry:
+            stats.merge(RunningStats.from_dict(entry['stats_train']))
+    return stats
+
+
+def has_speaker(training_set_dir, speaker_id):
+    return speaker_id in read_index(training_set_dir)['speakers']
+
+
+def load_training_set(training_set_dir, speakers_sub_list=None, mmap=True):
+    """Same layout as the content of full_inputs.pkl: {speaker_id: {'train', 'test', 'speaker_id', ...}}.
+
+    'train' and 'test' are lists holding one memory-mapped (num_frames, 390) matrix, so nothing is read from the disk
+    until the features are actually used.
+    """
+    index = read_index(training_set_dir)
+    speaker_ids = sorted(index['speakers']) if speakers_sub_list is None else speakers_sub_list
+    mmap_mode = 'r' if mmap else None
+    data = {}
+    for speaker_id in speaker_ids:
+        entry = index['speakers'][speaker_id]
+        data[speaker_id] = {'train': [np.load(_features_filename(training_set_dir, speaker_id, 'train'),
+                                              mmap_mode=mmap_mode)],
+                            'test': [np.load(_features_filename(training_set_dir, speaker_id, 'test'),
+                                             mmap_mode=mmap_mode)],
+                            'speaker_id': speaker_id,
+                            'mean_train': entry['mean_train'],
+                            'std_train': entry['std_train']}
+    return data
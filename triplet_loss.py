@@ -14,6 +14,29 @@ def batch_cosine_similarity(x1, x2):
     return dot
 
 
+def triplet_losses(y_pred):
+    """Loss of every [anchor, positive, negative] triplet of the batch (see deep_speaker_loss for the layout)."""
+    batch_size = K.int_shape(y_pred)[0]
+    # the batch size is not static when the batches come from a generator (fit_model_softmax_online).
+    elements = int(batch_size / 3) if batch_size is not None else K.shape(y_pred)[0] // 3
+    logging.info('elements={}'.format(elements))
+
+    anchor = y_pred[0:elements]
+    positive_ex = y_pred[elements:2 * elements]
+    negative_ex = y_pred[2 * elements:]
+    logging.info('anchor={}'.format(anchor))
+    logging.info('positive_ex={}'.format(positive_ex))
+    logging.info('negative_ex={}'.format(negative_ex))
+
+    sap = batch_cosine_similarity(anchor, positive_ex)
+    logging.info('sap={}'.format(sap))
+    san = batch_cosine_similarity(anchor, negative_ex)
+    logging.info('san={}'.format(san))
+    loss = K.maximum(san - sap + alpha, 0.0)
+    logging.info('loss={}'.format(loss))
+    return loss
+
+
 def deep_speaker_loss(y_true, y_pred):
     logging.info('y_true={}'.format(y_true))
     logging.info('y_pred={}'.format(y_pred))
@@ -35,23 +58,13 @@ def deep_speaker_loss(y_true, y_pred):
     # NEG EX 3 (512,)
     # _____________________________________________________
 
-    elements = int(K.int_shape(y_pred)[0] / 3)
-    logging.info('elements={}'.format(elements))
-
-    anchor = y_pred[0:elements]
-    positive_ex = y_pred[elements:2 * elements]
-    negative_ex = y_pred[2 * elements:]
-    logging.info('anchor={}'.format(anchor))
-    logging.info('positive_ex={}'.format(positive_ex))
-    logging.info('negative_ex={}'.format(negative_ex))
-
-    sap = batch_cosine_similarity(anchor, positive_ex)
-    logging.info('sap={}'.format(sap))
-    san = batch_cosine_similarity(anchor, negative_ex)
-    logging.info('san={}'.format(san))
-    loss = K.maximum(san - sap + alpha, 0.0)
-    logging.info('loss={}'.format(loss))
+    loss = triplet_losses(y_pred)
     # total_loss = K.sum(loss)
     total_loss = K.mean(loss)
     logging.info('total_loss={}'.format(total_loss))
     return total_loss
+
+
+def active_triplets(y_true, y_pred):
+    """Metric: fraction of the triplets of the batch with a non-zero loss (the ones that give a gradient)."""
+    return K.mean(K.cast(K.greater(triplet_losses(y_pred), 0.0), K.floatx()))
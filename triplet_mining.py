@@ -0,0 +1,87 @@
+import logging
+import time
+
+import numpy as np
+
+from triplet_loss import alpha
+from triplet_sampler import SpeakerIndex
+
+logger = logging.getLogger(__name__)
+
+
+def l2_normalize(x, axis=-1):
+    return x / np.maximum(np.linalg.norm(x, axis=axis, keepdims=True), 1e-12)
+
+
+def embed_batches(m, x, batch_size):
+    """Embeddings of x with m.predict, in batches of batch_size rows (the input layer has a fixed batch size)."""
+    num_rows = len(x)
+    pad = -num_rows % batch_size
+    if pad > 0:
+        x = np.concatenate([x, np.zeros((pad,) + x.shape[1:], dtype=x.dtype)])
+    return m.predict(x, batch_size=batch_size, verbose=0)[0][:num_rows]
+
+
+def _semi_hard(similarities, upper, count, rng, top_k):
+    """Indices of count draws among the candidates whose similarity is in (upper - alpha, upper): closer than the
+    positives, but not by more than the margin. Falls back to the top_k most similar ones if there are none."""
+    candidates = np.where((similarities > upper - alpha) & (similarities < upper))[0]
+    if len(candidates) == 0:
+        candidates = np.argsort(-similarities)[:min(top_k, np.sum(np.isfinite(similarities)))]
+    return rng.choice(candidates, size=count)
+
+
+class HardNegativeMiner:
+    """Picks semi-hard negative speakers and frames for the triplet batches, from cached embeddings.
+
+    refresh() embeds frames_per_speaker random train frames of every speaker with the current model (batched predict
+    calls) and keeps the speaker centroids, their similarity matrix, and the mean similarity of every speaker's frames
+    to its own centroid (the expected similarity of the positives). The sampler thread only reads self.state, which
+    refresh() replaces in one assignment.
+    """
+
+    def __init__(self, kx_train, y_train, num_speakers, frames_per_speaker=100, refresh_every=200, top_k=10,
+                 seed=None):
+        self.kx_train = kx_train
+        self.index = SpeakerIndex(np.asarray(y_train), num_speakers)
+        self.speakers = self.index.speakers()
+        self.frames_per_speaker = frames_per_speaker
+        self.refresh_every = refresh_every
+        self.top_k = top_k
+        self.rng = np.random.RandomState(seed)
+        self.state = None
+
+    def refresh(self, embed_fn):
+        start = time.time()
+        rows = np.stack([self.index.sample(s, self.frames_per_speaker, self.rng) for s in self.speakers])
+        embeddings = l2_normalize(embed_fn(self.kx_train[rows.reshape(-1)]))
+        embeddings = embeddings.reshape(len(self.speakers), self.frames_per_speaker, -1)
+        centroids = l2_normalize(embeddings.mean(axis=1))
+        intra = np.einsum('sfd,sd->s', embeddings, centroids) / self.frames_per_speaker
+        similarities = centroids @ centroids.T
+        np.fill_diagonal(similarities, -np.inf)
+        position = np.full(self.index.num_speakers, -1)
+        position[self.speakers] = np.arange(len(self.speakers))
+        self.state = {'rows': rows, 'embeddings': embeddings, 'centroids': centroids, 'intra': intra,
+                      'similarities': similarities, 'position': position}
+        logger.info('[MINING] embedded {} frames in {:.2f}s, mean centroid similarity = {:.3f}.'.format(
+            rows.size, time.time() - start, np.mean(similarities[np.isfinite(similarities)])))
+
+    def negative_speaker(self, anchor_positive_speaker, rng):
+        state = self.state
+        if state is None:  # not refreshed yet: uniform, like TripletSampler.
+            return rng.choice(self.speakers[self.speakers != anchor_positive_speaker])
+        a = state['position'][anchor_positive_speaker]
+        n = _semi_hard(state['similarities'][a], state['intra'][a], 1, rng, self.top_k)[0]
+        return self.speakers[n]
+
+    def negative_rows(self, anchor_positive_speaker, negative_speaker, count, rng):
+        """Rows of kx_train of the negative speaker, the closest to the anchor speaker's centroid (semi-hard)."""
+        state = self.state
+        if state is None:
+            return self.index.sample(negative_speaker, count, rng)
+        a = state['position'][anchor_positive_speaker]
+        n = state['position'][negative_speaker]
+        similarities = state['embeddings'][n] @ state['centroids'][a]
+        frames = _semi_hard(similarities, state['intra'][a], count, rng, max(1, self.frames_per_speaker // 2))
+        return state['rows'][n][frames]
@@ -0,0 +1,123 @@
+import threading
+from queue import Empty, Queue, Full
+
+import numpy as np
+
+
+class SpeakerIndex:
+    """Rows of every speaker, grouped CSR-style: the rows of speaker s are order[offsets[s]:offsets[s + 1]]."""
+
+    def __init__(self, labels, num_speakers=None):
+        labels = np.asarray(labels)
+        self.num_speakers = int(labels.max()) + 1 if num_speakers is None else num_speakers
+        self.order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=self.num_speakers)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def speakers(self):
+        return np.where(np.diff(self.offsets) > 0)[0]
+
+    def sample(self, speaker_id, size, rng=np.random):
+        start, end = self.offsets[speaker_id], self.offsets[speaker_id + 1]
+        assert end > start, 'Speaker #{} has no rows.'.format(speaker_id)
+        return self.order[rng.randint(start, end, size=size)]
+
+
+class TripletSampler:
+    """Builds the [anchor, positive, negative] train and test batches of fit_model in a background thread.
+
+    Up to `prefetch` batches are kept ready in a queue so that the Keras step does not wait on NumPy.
+    Each batch is (anchor_positive_speaker, negative_speaker, train_inputs, train_outputs, test_inputs, test_outputs).
+    The outputs are one-hot vectors, or the integer labels if one_hot is False.
+    With a miner (HardNegativeMiner), the negative speaker and the negative train frames are semi-hard ones instead of
+    uniformly drawn.
+
+    An exception raised while building a batch stops the thread and is raised again by next_batch().
+    """
+
+    def __init__(self, kx_train, y_train, kx_test, y_test, batch_size, num_speakers=None, prefetch=4, seed=None,
+                 one_hot=True, miner=None):
+        self.kx_train = kx_train
+        self.kx_test = kx_test
+        self.y_train = np.asarray(y_train)
+        self.y_test = np.asarray(y_test)
+        num_speakers = int(max(self.y_train.max(), self.y_test.max())) + 1 if num_speakers is None else num_speakers
+        self.train_index = SpeakerIndex(self.y_train, num_speakers)
+        self.test_index = SpeakerIndex(self.y_test, num_speakers)
+        self.num_speakers = num_speakers
+        self.speakers = self.train_index.speakers()
+        self.categories = np.eye(num_speakers, dtype=np.float32) if one_hot else None
+        self.batch_size = batch_size
+        self.miner = miner
+        self.rng = np.random.RandomState(seed)
+        self.queue = Queue(maxsize=prefetch)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def _select(self, x, y, index, speakers):
+        indices = np.concatenate([index.sample(s, self.batch_size // 3, self.rng) for s in speakers])
+        outputs = y[indices] if self.categories is None else self.categories[y[indices]]
+        return x[indices], outputs
+
+    def make_batch(self):
+        if self.miner is None:
+            anchor_positive_speaker, negative_speaker = self.rng.choice(self.speakers, size=2, replace=False)
+        else:
+            anchor_positive_speaker = self.rng.choice(self.speakers)
+            negative_speaker = self.miner.negative_speaker(anchor_positive_speaker, self.rng)
+        speakers = [anchor_positive_speaker, anchor_positive_speaker, negative_speaker]
+        if self.miner is None:
+            train_inputs, train_outputs = self._select(self.kx_train, self.y_train, self.train_index, speakers)
+        else:
+            count = self.batch_size // 3
+            indices = np.concatenate([self.train_index.sample(anchor_positive_speaker, 2 * count, self.rng),
+                                      self.miner.negative_rows(anchor_positive_speaker, negative_speaker, count,
+                                                               self.rng)])
+            train_inputs = self.kx_train[indices]
+            train_outputs = self.y_train[indices]
+            if self.categories is not None:
+                train_outputs = self.categories[train_outputs]
+        test_inputs, test_outputs = self._select(self.kx_test, self.y_test, self.test_index, speakers)
+        return anchor_positive_speaker, negative_speaker, train_inputs, train_outputs, test_inputs, test_outputs
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                batch = self.make_batch()
+            except Exception as e:
+                self.error = e
+                batch = e  # next_batch() raises it.
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(batch, timeout=0.1)
+                    break
+                except Full:
+                    continue
+            if self.error is not None:
+                return
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def next_batch(self):
+        if self.thread is None:
+            return self.make_batch()
+        while True:
+            try:
+                batch = self.queue.get(timeout=1.0)
+                break
+            except Empty:
+                if not self.thread.is_alive():
+                    raise RuntimeError('The triplet sampler thread stopped.') from self.error
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
@@ -1,4 +1,5 @@
 import logging
+import os
 from glob import glob
 
 import numpy as np
@@ -6,7 +7,6 @@ from natsort import natsorted
 
 from constants import c
 from speech_features import get_mfcc_features_390
-from train_cli import triplet_softmax_model
 from utils import normalize, InputsGenerator
 
 logger = logging.getLogger(__name__)
@@ -18,31 +18,20 @@ def get_feat_from_audio(audio_reader, sr, norm_data, speaker):
     return feat
 
 
-def generate_features_for_unseen_speakers(audio_reader, target_speaker='p363'):
-    assert target_speaker in audio_reader.all_speaker_ids
-    # audio.metadata = dict()  # small cache <SPEAKER_ID -> SENTENCE_ID, filename>
-    # audio.cache = dict()  # big cache <filename, data:audio librosa, blanks.>
-    inputs_generator = InputsGenerator(cache_dir=audio_reader.cache_dir,
-                                       audio_reader=audio_reader,
-                                       max_count_per_class=1000)
-    inputs = inputs_generator.generate_inputs_for_inference(target_speaker)
-    return inputs
-
-
-def inference_unseen_speakers(audio_reader, sp1, sp2):
-    sp1_feat = generate_features_for_unseen_speakers(audio_reader, target_speaker=sp1)
-    sp2_feat = generate_features_for_unseen_speakers(audio_reader, target_speaker=sp2)
-
+def load_inference_model(checkpoints_dir='checkpoints', verbose=True):
+    """Embedding model (batch_size=None) with the weights of the latest checkpoint."""
+    from train_cli import triplet_softmax_model  # keras and tensorflow are only imported when a model is needed.
     # batch_size => None (for inference).
     m = triplet_softmax_model(num_speakers_softmax=len(c.AUDIO.SPEAKERS_TRAINING_SET),
                               emb_trainable=False,
                               normalize_embeddings=True,
                               batch_size=None)
 
-    checkpoints = natsorted(glob('checkpoints/*.h5'))
+    checkpoints = natsorted(glob(os.path.join(checkpoints_dir, '*.h5')))
 
     # compile_triplet_softmax_model(m, loss_on_softmax=False, loss_on_embeddings=False)
-    print(m.summary())
+    if verbose:
+        print(m.summary())
 
     if len(checkpoints) != 0:
         checkpoint_file = checkpoints[-1]
@@ -50,6 +39,25 @@ def inference_unseen_speakers(audio_reader, sp1, sp2):
         logger.info('Initial epoch is {}.'.format(initial_epoch))
         logger.info('Loading checkpoint: {}.'.format(checkpoint_file))
         m.load_weights(checkpoint_file)  # latest one.
+    return m
+
+
+def generate_features_for_unseen_speakers(audio_reader, target_speaker='p363'):
+    assert target_speaker in audio_reader.all_speaker_ids
+    # audio.metadata = dict()  # small cache <SPEAKER_ID -> SENTENCE_ID, filename>
+    # audio.cache = dict()  # big cache <filename, data:audio librosa, blanks.>
+    inputs_generator = InputsGenerator(cache_dir=audio_reader.cache_dir,
+                                       audio_reader=audio_reader,
+                                       max_count_per_class=1000)
+    inputs = inputs_generator.generate_inputs_for_inference(target_speaker)
+    return inputs
+
+
+def inference_unseen_speakers(audio_reader, sp1, sp2):
+    sp1_feat = generate_features_for_unseen_speakers(audio_reader, target_speaker=sp1)
+    sp2_feat = generate_features_for_unseen_speakers(audio_reader, target_speaker=sp2)
+
+    m = load_inference_model()
 
     emb_sp1 = m.predict(np.vstack(sp1_feat))[0]
     emb_sp2 = m.predict(np.vstack(sp2_feat))[0]
@@ -81,21 +89,7 @@ def inference_unseen_speakers(audio_reader, sp1, sp2):
 def inference_embeddings(audio_reader, speaker_id):
     speaker_feat = generate_features_for_unseen_speakers(audio_reader, target_speaker=speaker_id)
 
-    # batch_size => None (for inference).
-    m = triplet_softmax_model(num_speakers_softmax=len(c.AUDIO.SPEAKERS_TRAINING_SET),
-                              emb_trainable=False,
-                              normalize_embeddings=True,
-                              batch_size=None)
-
-    checkpoints = natsorted(glob('checkpoints/*.h5'))
-    print(m.summary())
-
-    if len(checkpoints) != 0:
-        checkpoint_file = checkpoints[-1]
-        initial_epoch = int(checkpoint_file.split('/')[-1].split('.')[0].split('_')[-1])
-        logger.info('Initial epoch is {}.'.format(initial_epoch))
-        logger.info('Loading checkpoint: {}.'.format(checkpoint_file))
-        m.load_weights(checkpoint_file)  # latest one.
+    m = load_inference_model()
 
     emb_sp1 = m.predict(np.vstack(speaker_feat))[0]
 
@@ -1,58 +1,146 @@
-import dill
 import logging
 import numpy as np
 import os
 import pickle
+import zlib
 
+import instrumentation
 from constants import c
-from speech_features import get_mfcc_features_390
+from feature_cache import FeatureCache, audio_entities_hash, feature_key
+from feature_stats import RunningStats, stack_and_normalize
+from speech_features import get_mfcc_features_390, batch_get_mfcc_features_390
+from training_set import add_speaker, has_speaker
+from vad import VOICED_SEGMENTS
 
 logger = logging.getLogger(__name__)
 
 
-def data_to_keras(data):
-    categorical_speakers = SpeakersToCategorical(data)
-    kx_train, ky_train, kx_test, ky_test = [], [], [], []
-    #ky_test = []
-    for speaker_id in categorical_speakers.get_speaker_ids():
-        d = data[speaker_id]
-        y = categorical_speakers.get_one_hot_vector(d['speaker_id'])
-        for x_train_elt in data[speaker_id]['train']:
-            for x_train_sub_elt in x_train_elt:
-                kx_train.append(x_train_sub_elt)
-                ky_train.append(y)
-
-        for x_test_elt in data[speaker_id]['test']:
-            for x_test_sub_elt in x_test_elt:
-                kx_test.append(x_test_sub_elt)
-                ky_test.append(y)
-
-    kx_train = np.array(kx_train)
-    kx_test = np.array(kx_test)
-
-    ky_train = np.array(ky_train)
-    ky_test = np.array(ky_test)
+def data_to_keras(data, one_hot=True):
+    """Stacks the frames of every speaker into contiguous float32 arrays.
 
+    The arrays are preallocated and filled speaker by speaker. Labels are integers (sorted speaker order). They are
+    expanded into one-hot vectors only if one_hot is True: with sparse_categorical_crossentropy, the dense
+    (num_frames, num_speakers) matrices are never built.
+    """
+    categorical_speakers = SpeakersToCategorical(data)
+    speaker_ids = categorical_speakers.get_speaker_ids()
+    outputs = []
+    for split in ['train', 'test']:
+        counts = [sum([len(m) for m in data[speaker_id][split]]) for speaker_id in speaker_ids]
+        num_features = next((np.shape(m)[1] for s in speaker_ids for m in data[s][split] if len(m) > 0), 39 * 10)
+        kx = np.empty((sum(counts), num_features), dtype=np.float32)
+        ky = np.empty(sum(counts), dtype=np.int32)
+        start = 0
+        for speaker_id, count in zip(speaker_ids, counts):
+            if count > 0:
+                np.concatenate([np.asarray(m).reshape(-1, num_features) for m in data[speaker_id][split]],
+                               axis=0, out=kx[start:start + count])
+            ky[start:start + count] = categorical_speakers.map_speakers_to_index[speaker_id]
+            start += count
+        if one_hot:
+            ky = categorical_speakers.speaker_categories[ky]
+        outputs.extend([kx, ky])
+    kx_train, ky_train, kx_test, ky_test = outputs
     return kx_train, ky_train, kx_test, ky_test, categorical_speakers
 
 
-def generate_features(audio_entities, max_count, progress_bar=False):
+def generate_features(audio_entities, max_count, progress_bar=False, rng=None, stats=None, batch_size=256):
+    """MFCC-390 of max_count random crops of the audio entities (crops too short for one frame are dropped).
+
+    rng is a np.random.Generator (np.random.default_rng(seed) for reproducible crops). All the crops are drawn up
+    front by sample_crops, then their features are computed batch_size crops at a time.
+    If stats (RunningStats) is given, it is updated with every batch of crops as it is generated.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    entity_ids, starts, ends = sample_crops(audio_entities, max_count, rng)
+    sources = [crop_source(audio_entity) for audio_entity in audio_entities]
     features = []
-    count_range = range(max_count)
+    batch_range = range(0, len(entity_ids), batch_size)
     if progress_bar:
         from tqdm import tqdm
-        count_range = tqdm(count_range)
-    for _ in count_range:
-        audio_entity = np.random.choice(audio_entities)
-        voice_only_signal = audio_entity['audio_voice_only']
-        cuts = np.random.uniform(low=1, high=len(voice_only_signal), size=2)
-        signal_to_process = voice_only_signal[int(min(cuts)):int(max(cuts))]
-        features_per_conv = get_mfcc_features_390(signal_to_process, c.AUDIO.SAMPLE_RATE, max_frames=None)
-        if len(features_per_conv) > 0:
-            features.append(features_per_conv)
+        batch_range = tqdm(batch_range)
+    for i in batch_range:
+        signals = [sources[e][s:t] for (e, s, t) in zip(entity_ids[i:i + batch_size], starts[i:i + batch_size],
+                                                        ends[i:i + batch_size])]
+        batch = [f for f in batch_get_mfcc_features_390(signals, c.AUDIO.SAMPLE_RATE) if len(f) > 0]
+        instrumentation.count('features.crops', len(batch))
+        features.extend(batch)
+        if stats is not None and len(batch) > 0:
+            stats.update(np.concatenate(batch))
     return features
 
 
+def crop_source(audio_entity):
+    """1-D signal the crops of the entity are cut from. Entities dumped before the VAD only have audio_voice_only."""
+    if audio_entity.get(VOICED_SEGMENTS) is not None:
+        return audio_entity['audio'].reshape(-1)
+    return audio_entity['audio_voice_only'].reshape(-1)
+
+
+def _crop_segments(audio_entity):
+    # [start, end) regions of crop_source(audio_entity) where crops are cut.
+    segments = audio_entity.get(VOICED_SEGMENTS)
+    if segments is not None:
+        return np.asarray(segments, dtype=np.int64).reshape(-1, 2)
+    length = len(audio_entity['audio_voice_only'])
+    return np.array([[1, length]] if length > 1 else [], dtype=np.int64).reshape(-1, 2)
+
+
+def sample_crops(audio_entities, count, rng, unique=True):
+    """Draws count crops as three int64 arrays (entity_ids, starts, ends): crop i is
+    crop_source(audio_entities[entity_ids[i]])[starts[i]:ends[i]].
+
+    The entity is drawn uniformly among the entities with voiced audio, the voiced segment with a probability
+    proportional to its length, and the two cuts uniformly inside the segment, so no crop contains silence between
+    two segments. With unique=True, duplicated crops are dropped (the order of the others is kept).
+    """
+    segments = [_crop_segments(audio_entity) for audio_entity in audio_entities]
+    num_segments = np.array([len(s) for s in segments], dtype=np.int64)
+    empty = np.zeros(0, dtype=np.int64)
+    if num_segments.sum() == 0 or count <= 0:
+        return empty, empty, empty
+    segments = np.concatenate(segments)
+    lengths = (segments[:, 1] - segments[:, 0]).astype(np.float64)
+    first = np.concatenate([[0], np.cumsum(num_segments)])  # segments of entity e: first[e]:first[e + 1].
+    cumulative = np.concatenate([[0.0], np.cumsum(lengths)])
+    totals = cumulative[first[1:]] - cumulative[first[:-1]]
+    voiced = np.where(totals > 0)[0]
+    if len(voiced) == 0:
+        return empty, empty, empty
+
+    entity_ids = voiced[rng.integers(len(voiced), size=count)]
+    positions = cumulative[first[entity_ids]] + rng.random(count) * totals[entity_ids]
+    segment_ids = np.searchsorted(cumulative, positions, side='right') - 1
+    segment_ids = np.clip(segment_ids, first[entity_ids], first[entity_ids + 1] - 1)
+    cuts = segments[segment_ids, 0][:, None] + rng.random((count, 2)) * lengths[segment_ids][:, None]
+    starts = np.floor(np.min(cuts, axis=1)).astype(np.int64)
+    ends = np.floor(np.max(cuts, axis=1)).astype(np.int64)
+    if unique:
+        _, index = np.unique(np.stack([entity_ids, starts, ends], axis=1), axis=0, return_index=True)
+        index = np.sort(index)
+        entity_ids, starts, ends = entity_ids[index], starts[index], ends[index]
+    return entity_ids, starts, ends
+
+
+def utterance_features(audio, sample_rate):
+    """MFCC-390 of a whole utterance, normalized by its own mean and std (the utterance is the only crop)."""
+    feat = get_mfcc_features_390(audio, sample_rate, max_frames=None)
+    if len(feat) == 0:
+        return feat
+    return (feat - np.mean(feat)) / np.std(feat)
+
+
+def audio_file_features(filename, sample_rate, resample_mode='librosa'):
+    """utterance_features of the voiced part of an audio file (filename or file object), from the first to the last
+    voiced segment of the VAD: the audio_voice_only of the cache."""
+    from audio_reader import read_audio_from_filename
+    from vad import voiced_segments
+    audio, _ = read_audio_from_filename(filename, sample_rate, resample_mode)
+    segments = voiced_segments(audio, sample_rate)
+    voice_start, voice_end = (segments[0, 0], segments[-1, 1]) if len(segments) > 0 else (0, 0)
+    return utterance_features(audio[voice_start:voice_end], sample_rate)
+
+
 def normalize(list_matrices, mean, std):
     return [(m - mean) / std for m in list_matrices]
 
@@ -60,12 +148,18 @@ def normalize(list_matrices, mean, std):
 class InputsGenerator:
 
     def __init__(self, cache_dir, audio_reader, max_count_per_class=500,
-                 speakers_sub_list=None, multi_threading=False):
+                 speakers_sub_list=None, multi_threading=False, feature_cache_max_bytes=2 * 1024 ** 3,
+                 num_workers=None, task_size=100, seed=0):
         self.cache_dir = cache_dir
         self.audio_reader = audio_reader
         self.multi_threading = multi_threading
+        self.num_workers = num_workers
+        self.task_size = task_size  # crops per task: a speaker is split into max_count_per_class / task_size tasks.
+        self.seed = seed
         self.inputs_dir = os.path.join(self.cache_dir, 'inputs')
+        self.training_set_dir = os.path.join(self.cache_dir, 'training_set')
         self.max_count_per_class = max_count_per_class
+        self.feature_cache = FeatureCache(os.path.join(self.cache_dir, 'features'), max_bytes=feature_cache_max_bytes)
         if not os.path.exists(self.inputs_dir):
             os.makedirs(self.inputs_dir)
 
@@ -74,104 +168,198 @@ class InputsGenerator:
     def start_generation(self):
         logger.info('Starting the inputs generation...')
         #前面半部分是生成每一个说话人的pkl文件
-        if self.multi_threading:
-            num_threads = os.cpu_count()
-            logger.info('Using {} threads.'.format(num_threads))
-            parallel_function(self.generate_and_dump_inputs_to_pkl, sorted(self.speaker_ids), num_threads)
-        else:
-            logger.info('Using only 1 thread.')
-            for s in self.speaker_ids:
-                self.generate_and_dump_inputs_to_pkl(s)
+        speaker_ids = [s for s in sorted(self.speaker_ids) if self._should_generate(s)]
+        num_workers = (self.num_workers or os.cpu_count()) if self.multi_threading else 1
+        logger.info('Using {} workers.'.format(num_workers))
+        for inputs in self.generate_all_inputs(speaker_ids, num_workers):
+            self._dump_inputs(inputs)
         #****************************************************#
-        #后面半部分，其实就是把前面生成的所有说话人的pkl文件整合到一起
+        #后面半部分，其实就是把前面生成的所有说话人的pkl文件整合到training_set中
+        #已经在training_set中的说话人不会再读一次，新的说话人只是追加进去
         from glob import glob
-        logger.info('Generating the unified inputs pkl file.')
-        full_inputs = {}
-        for inputs_filename in glob(self.inputs_dir + '/*.pkl', recursive=True):
+        logger.info('Adding the new speakers to the training set at {}.'.format(self.training_set_dir))
+        for inputs_filename in sorted(glob(self.inputs_dir + '/*.pkl', recursive=True)):
+            speaker_id = os.path.splitext(os.path.basename(inputs_filename))[0]
+            if has_speaker(self.training_set_dir, speaker_id):
+                continue
             with open(inputs_filename, 'rb') as r:
                 inputs = pickle.load(r)
                 logger.info('Read {}'.format(inputs_filename))
-            full_inputs[inputs['speaker_id']] = inputs
-        full_inputs_output_filename = os.path.join(self.cache_dir, 'full_inputs.pkl')
-        # dill can manage with files larger than 4GB.
-        # dill其实就是pickle的扩展版，就是处理大数据集
-        with open(full_inputs_output_filename, 'wb') as w:
-            dill.dump(obj=full_inputs, file=w)
-        logger.info('[DUMP UNIFIED INPUTS] {}'.format(full_inputs_output_filename))
+            add_speaker(self.training_set_dir, inputs)
+        logger.info('[DUMP TRAINING SET] {}'.format(self.training_set_dir))
 
-    def generate_and_dump_inputs_to_pkl(self, speaker_id):
-        """生成每一个说话人的pkl文件，这个任务是说话人识别，需要以说话人为单位"""
+    def _should_generate(self, speaker_id):
         if speaker_id not in c.AUDIO.SPEAKERS_TRAINING_SET:
             """如果不training set里就不要这个说话人了"""
             logger.info('Discarding speaker for the training dataset (cf. conf.json): {}.'.format(speaker_id))
-            return
-
+            return False
         output_filename = os.path.join(self.inputs_dir, speaker_id + '.pkl')
         if os.path.isfile(output_filename):
             logger.info('Inputs file already exists: {}.'.format(output_filename))
-            return
+            return False
+        return True
 
-        inputs = self.generate_inputs(speaker_id)  ###这个inputs作为内容写到了inputs文件夹中speaker_id.pkl中
+    def _dump_inputs(self, inputs):
+        output_filename = os.path.join(self.inputs_dir, inputs['speaker_id'] + '.pkl')
         with open(output_filename, 'wb') as w:
             pickle.dump(obj=inputs, file=w)
         logger.info('[DUMP INPUTS] {}'.format(output_filename))
 
-    def generate_inputs_for_inference(self, speaker_id):
+    def tasks(self, speaker_id):
+        """(speaker_id, split, task_id, count, seed) for the crops of one speaker, task_size crops per task."""
+        tasks = []
+        for split in ['train', 'test']:
+            for task_id, start in enumerate(range(0, self.max_count_per_class, self.task_size)):
+                count = min(self.task_size, self.max_count_per_class - start)
+                tasks.append((speaker_id, split, task_id, count, task_seed(self.seed, speaker_id, split, task_id)))
+        return tasks
+
+    def generate_all_inputs(self, speaker_ids, num_workers=1):
+        """Yields the inputs of every speaker (same as generate_inputs) as soon as all its tasks are done.
+
+        With several workers, the tasks of all the speakers go through one pool: a worker takes the next task as soon
+        as it is free, so speakers with many utterances do not hold the others back. The AudioReader is sent once
+        per worker, and every task has its own seed: the inputs do not depend on num_workers.
+        With the pkl cache, the audio of the speakers is decoded once into a shared store (AudioReader.share_cache)
+        that the workers slice, instead of every worker unpickling the speakers of its tasks.
+        """
+        tasks = [t for s in speaker_ids for t in self.tasks(s)]
+        if len(tasks) == 0:
+            return
+        num_tasks = {s: len(self.tasks(s)) for s in speaker_ids}
+        results = {s: [] for s in speaker_ids}
+        shared = False
+        if num_workers > 1:
+            from multiprocessing import Pool
+            if self.audio_reader.audio_store is None:
+                self.audio_reader.share_cache(speaker_ids)
+                shared = True
+            pool = Pool(processes=num_workers, initializer=init_inputs_worker, initargs=(self.audio_reader,))
+            completed = pool.imap_unordered(inputs_worker, tasks, chunksize=1)
+        else:
+            init_inputs_worker(self.audio_reader)
+            pool = None
+            completed = map(inputs_worker, tasks)
+        try:
+            while True:
+                with instrumentation.timer('inputs.wait'):  # waiting for the next task of the workers.
+                    result = next(completed, None)
+                if result is None:
+                    break
+                speaker_id, split, task_id, features, stats, worker_stats = result
+                instrumentation.merge(worker_stats)
+                results[speaker_id].append((split, task_id, features, stats))
+                if len(results[speaker_id]) == num_tasks[speaker_id]:
+                    yield merge_tasks(speaker_id, results.pop(speaker_id))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if shared:
+                self.audio_reader.close_shared_cache()
+
+    def generate_and_dump_inputs_to_pkl(self, speaker_id):
+        """生成每一个说话人的pkl文件，这个任务是说话人识别，需要以说话人为单位"""
+        if self._should_generate(speaker_id):
+            self._dump_inputs(self.generate_inputs(speaker_id))  ###这个inputs作为内容写到了inputs文件夹中speaker_id.pkl中
+
+    def generate_inputs_for_inference(self, speaker_id, seed=0):
+        """The crops only depend on the audio of the speaker and on the seed, so they are cached on disk."""
         speaker_cache, metadata = self.audio_reader.load_cache([speaker_id])
-        audio_entities = list(speaker_cache.values())
+        audio_entities = [speaker_cache[f] for f in sorted(speaker_cache)]
+        key = feature_key(audio_entities_hash(audio_entities), c.AUDIO.SAMPLE_RATE, seed, self.max_count_per_class)
+        feat = self.feature_cache.get(key)
+        if feat is not None:
+            return feat
         logger.info('Generating the inputs necessary for the inference (speaker is {})...'.format(speaker_id))
         logger.info('This might take a couple of minutes to complete.')
-        feat = generate_features(audio_entities, self.max_count_per_class, progress_bar=False)
-        mean = np.mean([np.mean(t) for t in feat])
-        std = np.mean([np.std(t) for t in feat])
-        feat = normalize(feat, mean, std)
+        stats = RunningStats()
+        feat = generate_features(audio_entities, self.max_count_per_class, progress_bar=False,
+                                 rng=np.random.default_rng(seed), stats=stats)
+        feat = stack_and_normalize(feat, stats.pooled_mean(), stats.pooled_std())
+        self.feature_cache.put(key, feat)
         return feat
 
     def generate_inputs(self, speaker_id):
         """生成一个说话人pkl文件的输入"""
-        from audio_reader import extract_speaker_id
-        per_speaker_dict = {}
-        cache, metadata = self.audio_reader.load_cache([speaker_id])
-
-        for filename, audio_entity in cache.items():
-            speaker_id_2 = extract_speaker_id(audio_entity['filename'])
-            assert speaker_id_2 == speaker_id, '{} {}'.format(speaker_id_2, speaker_id)
-            if speaker_id not in per_speaker_dict:
-                per_speaker_dict[speaker_id] = []
-            per_speaker_dict[speaker_id].append(audio_entity)
-        #per_speaker_dict = per_speaker_dict
-
-        audio_entities = per_speaker_dict[speaker_id]
-        cutoff = int(len(audio_entities) * 0.8)
-        #训练集中这个说话人的句子80%，这个是占句子总数的，而不是一句话的长度
-        audio_entities_train = audio_entities[0:cutoff]  ##list
-        audio_entities_test = audio_entities[cutoff:]
-
-        train = generate_features(audio_entities_train, self.max_count_per_class)
-        test = generate_features(audio_entities_test, self.max_count_per_class)
-        logger.info('Generated {}/{} inputs for train/test for speaker {}.'.format(self.max_count_per_class,
-                                                                                   self.max_count_per_class,
-                                                                                   speaker_id))
+        return next(self.generate_all_inputs([speaker_id], num_workers=1))
+
+
+def task_seed(seed, speaker_id, split, task_id):
+    """Seed of one task, derived from the seed of the generator and the identity of the task only."""
+    return int(np.random.SeedSequence([seed, zlib.crc32(speaker_id.encode('utf-8')), ['train', 'test'].index(split),
+                                       task_id]).generate_state(1)[0])
+
+
+def train_test_entities(audio_reader, speaker_id):
+    from audio_reader import extract_speaker_id
+    cache, metadata = audio_reader.load_cache([speaker_id])
+    audio_entities = [cache[f] for f in cache]
+    for audio_entity in audio_entities:
+        speaker_id_2 = extract_speaker_id(audio_entity['filename'])
+        assert speaker_id_2 == speaker_id, '{} {}'.format(speaker_id_2, speaker_id)
+    cutoff = int(len(audio_entities) * 0.8)
+    #训练集中这个说话人的句子80%，这个是占句子总数的，而不是一句话的长度
+    return {'train': audio_entities[0:cutoff], 'test': audio_entities[cutoff:]}
+
+
+_inputs_worker_args = {}
+
+
+def init_inputs_worker(audio_reader):
+    """Runs once per worker. Only the (speaker_id, split, task_id, count, seed) tuples are sent afterwards."""
+    _inputs_worker_args['audio_reader'] = audio_reader
+    _inputs_worker_args['entities'] = {}
+    instrumentation.init_worker()
+
+
+def inputs_worker(task):
+    speaker_id, split, task_id, count, seed = task
+    entities = _inputs_worker_args['entities']
+    if speaker_id not in entities:
+        if len(entities) >= 2:  # the tasks of a speaker are contiguous: only the last speakers are kept in memory.
+            entities.pop(next(iter(entities)))
+        entities[speaker_id] = train_test_entities(_inputs_worker_args['audio_reader'], speaker_id)
+    stats = RunningStats() if split == 'train' else None  # the test crops are normalized with the train stats.
+    with instrumentation.timer('inputs.task'):
+        features = generate_features(entities[speaker_id][split], count, rng=np.random.default_rng(seed),
+                                     stats=stats)
+    return speaker_id, split, task_id, features, stats, instrumentation.drain()
+
+
+def merge_tasks(speaker_id, results):
+    """Puts the crops of the tasks of one speaker back in task order and normalizes them with the train stats."""
+    train, test = [], []
+    stats_train = RunningStats()
+    for split, task_id, features, stats in sorted(results, key=lambda r: (r[0] != 'train', r[1])):
+        if split == 'train':
+            train.extend(features)
+            stats_train.merge(stats)
+        else:
+            test.extend(features)
+    logger.info('Generated {}/{} inputs for train/test for speaker {}.'.format(len(train), len(test), speaker_id))
 
-        mean_train = np.mean([np.mean(t) for t in train])
-        std_train = np.mean([np.std(t) for t in train])
+    # pooled over all the frames and all the dimensions of the train crops. The per-dimension statistics are
+    # kept in stats_train (merged into the global statistics of the training set).
+    mean_train = stats_train.pooled_mean()
+    std_train = stats_train.pooled_std()
 
-        train = normalize(train, mean_train, std_train)
-        test = normalize(test, mean_train, std_train)  ###为什么测试集在归一化的时候要输入mean_train和std_train
+    train = stack_and_normalize(train, mean_train, std_train)
+    test = stack_and_normalize(test, mean_train, std_train)  ###为什么测试集在归一化的时候要输入mean_train和std_train
 
-        inputs = {'train': train, 'test': test, 'speaker_id': speaker_id,
-                  'mean_train': mean_train, 'std_train': std_train}
-        return inputs
+    inputs = {'train': train, 'test': test, 'speaker_id': speaker_id,
+              'mean_train': mean_train, 'std_train': std_train, 'stats_train': stats_train.to_dict()}
+    return inputs
 
 
 class SpeakersToCategorical:
     def __init__(self, data):
-        from keras.utils import to_categorical
         self.speaker_ids = sorted(list(data.keys()))
         self.int_speaker_ids = list(range(len(self.speaker_ids)))
         self.map_speakers_to_index = dict([(k, v) for (k, v) in zip(self.speaker_ids, self.int_speaker_ids)])
         self.map_index_to_speakers = dict([(v, k) for (k, v) in zip(self.speaker_ids, self.int_speaker_ids)])
-        self.speaker_categories = to_categorical(self.int_speaker_ids, num_classes=len(self.speaker_ids))
+        # same as keras.utils.to_categorical, without importing keras.
+        self.speaker_categories = np.eye(len(self.speaker_ids), dtype=np.float32)[self.int_speaker_ids]
 
     def get_speaker_from_index(self, index):
         return self.map_index_to_speakers[index]
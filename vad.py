@@ -0,0 +1,57 @@
+import numpy as np
+
+SEGMENTS_DTYPE = np.int64
+VOICED_SEGMENTS = 'voiced_segments'  # key of the segments in the audio entities.
+
+
+def frame_rms(audio, frame_length, hop_length):
+    """RMS of every frame of frame_length samples, every hop_length samples (frames entirely inside the audio).
+
+    Computed from the cumulative sum of the squared samples: two lookups per frame, whatever frame_length is.
+    """
+    audio = np.asarray(audio).reshape(-1)
+    if len(audio) < frame_length:
+        return np.zeros(0)
+    num_frames = (len(audio) - frame_length) // hop_length + 1
+    cumsum = np.concatenate([[0.0], np.cumsum(np.square(audio, dtype=np.float64))])
+    starts = np.arange(num_frames) * hop_length
+    energy = (cumsum[starts + frame_length] - cumsum[starts]) / frame_length
+    return np.sqrt(np.maximum(energy, 0.0))
+
+
+def voiced_segments(audio, sample_rate, frame_ms=25.0, step_ms=10.0, high=0.5, low=0.3, noise_percentile=10,
+                    min_segment_ms=100.0, min_silence_ms=200.0, min_rms=1e-4):
+    """Voiced regions of audio as a (num_segments, 2) array of [start, end) sample offsets.
+
+    The thresholds are placed between the noise floor (noise_percentile of the frame levels in dB) and the loudest
+    frame: frames above the high fraction start a segment, which extends to the neighbouring frames above the low
+    fraction (hysteresis). Segments separated by less than min_silence_ms are merged, then the ones shorter than
+    min_segment_ms are dropped. The audio is silent (no segment) if no frame is louder than min_rms.
+    """
+    frame_length = int(frame_ms * sample_rate / 1000)
+    hop_length = int(step_ms * sample_rate / 1000)
+    rms = frame_rms(audio, frame_length, hop_length)
+    if len(rms) == 0 or np.max(rms) < min_rms:
+        return np.zeros((0, 2), dtype=SEGMENTS_DTYPE)
+    db = 20 * np.log10(np.maximum(rms, min_rms))
+    floor, peak = np.percentile(db, noise_percentile), np.max(db)
+    is_high = db > floor + high * (peak - floor)
+    is_low = db > floor + low * (peak - floor)
+
+    # runs of frames above the low threshold: [starts, ends) in frames.
+    edges = np.diff(np.concatenate([[0], is_low.astype(np.int8), [0]]))
+    starts = np.where(edges == 1)[0]
+    ends = np.where(edges == -1)[0]
+    num_high = np.concatenate([[0], np.cumsum(is_high)])
+    keep = num_high[ends] - num_high[starts] > 0
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return np.zeros((0, 2), dtype=SEGMENTS_DTYPE)
+
+    split = (starts[1:] - ends[:-1]) * step_ms >= min_silence_ms
+    starts = starts[np.concatenate([[True], split])]
+    ends = ends[np.concatenate([split, [True]])]
+
+    segments = np.stack([starts * hop_length, (ends - 1) * hop_length + frame_length], axis=1)
+    segments = segments[segments[:, 1] - segments[:, 0] >= min_segment_ms * sample_rate / 1000]
+    return segments.astype(SEGMENTS_DTYPE)